@@ -61,4 +61,38 @@ module CompressionBasedDistance
 	*/
 	funcdef build_matrix(BuildMatrixParams input) returns(string job_id);
 	
+	/* Input parameters for extend_matrix function
+	
+		list<string> node_ids - List of Shock node ids for input sequence files (both the
+			sequence files in the existing distance matrix and the new sequence files)
+		string sizes_node_id - Shock node id for the compressed sizes file saved by a previous job
+		string format - Format of input sequence files ('fasta', 'fastq', etc.)
+		string scale - Scale for distance matrix values ('std' or 'inf')
+		int sequence_length - Length to trim sequence reads to (must match previous job)
+		int min_reads - Minimum number of reads a sequence file must contain
+		int max_reads - Maximum number of reads to use from a sequence file (must match previous job)
+		int extreme - Set to true for extreme compression (must match previous job)
+			
+	*/
+	typedef structure {
+		list<string> node_ids;
+		string sizes_node_id;
+		string format;
+		string scale;
+		int sequence_length;
+		int min_reads;
+		int max_reads;
+		int extreme;
+	} ExtendMatrixParams;
+	
+	/*
+      Extend a distance matrix built by a previous job with new sequence
+      files.  Only the compressed sizes of the new sequence files and the
+      pairs that include a new sequence file are computed.  The compressed
+      sizes of the other sequence files and pairs are taken from the
+      compressed sizes file saved by the previous job.  Returns the job
+      identifier of the job submitted to build the distance matrix.
+	*/
+	funcdef extend_matrix(ExtendMatrixParams input) returns(string job_id);
+	
 };
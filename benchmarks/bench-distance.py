@@ -0,0 +1,250 @@
+#! /usr/bin/python
+
+import argparse
+import collections
+import os
+import shutil
+import tempfile
+import time
+import numpy
+from biokbase.CompressionBasedDistance import Worker
+from biokbase.CompressionBasedDistance.Worker import CompressionBasedDistance, PairSeparator
+
+desc1 = '''
+NAME
+      bench-distance -- measure speed of calculating a distance matrix
+
+SYNOPSIS
+'''
+
+desc2 = '''
+DESCRIPTION
+      Measure the time to calculate a distance matrix from compressed sizes and
+      write it to a CSV file for each number of samples in the --num-samples
+      list.  The compressed sizes are randomly generated.
+
+      The time of a whole job is measured by running runJob() with a tiny input
+      sequence file for each sample when the number of samples is no more than
+      --max-job-samples.  The tasks run in the benchmark process one after the
+      other and the compress and merge tasks return the generated sizes so the
+      time is the cost of the job's bookkeeping: submitting the tasks, saving
+      each size in the arrays indexed by sample number, journaling, writing the
+      compressed sizes file, and calculating the distance matrix.  The journal is
+      flushed to disk after every size so the time depends on the file system of
+      the --work-folder folder.
+
+      The calculator works on arrays of sizes indexed by sample number.  The time
+      of the original dictionary-based calculator that computed one pair at a
+      time is also measured when the number of samples is no more than
+      --max-dict-samples because the dictionary of pair sizes is very large.
+'''
+
+desc3 = '''
+EXAMPLES
+      Measure the calculator with 1000, 5000, and 10000 samples:
+      > python bench-distance.py --num-samples 1000,5000,10000
+
+AUTHORS
+      Mike Mundy
+'''
+
+''' Generate random compressed sizes.
+
+    @param numSamples Number of samples
+    @return Tuple with list of sample names, array of sample sizes, and square array of pair sizes
+'''
+
+def generate_sizes(numSamples):
+    random = numpy.random.RandomState(1)
+    names = [ 'sample%06d' %(index) for index in range(numSamples) ]
+    singleSizes = random.randint(100000, 500000, numSamples).astype(float)
+    pairSizes = numpy.empty((numSamples, numSamples), dtype=float)
+    for start in range(0, numSamples, 256):
+        end = min(start + 256, numSamples)
+        total = singleSizes[start:end, numpy.newaxis] + singleSizes[numpy.newaxis, :]
+        pairSizes[start:end] = numpy.floor(total * random.uniform(0.55, 0.95, (end - start, numSamples)))
+    pairSizes = numpy.minimum(pairSizes, pairSizes.T) # Make the array symmetric
+    numpy.fill_diagonal(pairSizes, numpy.nan)
+    return names, singleSizes, pairSizes
+
+''' Build a dictionary of compressed sizes keyed by file name.
+
+    @param names List of sample names
+    @param singleSizes Array of sample sizes
+    @param pairSizes Square array of pair sizes
+    @return Dictionary mapping file names to compressed sizes
+'''
+
+def build_sizes_dict(names, singleSizes, pairSizes):
+    sizes = dict(zip(names, singleSizes.tolist()))
+    for i in range(len(names)):
+        row = pairSizes[i].tolist()
+        for j in range(i + 1, len(names)):
+            sizes[names[i] + PairSeparator + names[j]] = row[j]
+    return sizes
+
+''' Scheduler that runs each task in the benchmark process when the job runs its tasks.
+
+    The scheduler has the same interface as TaskScheduler.
+'''
+
+class InlineScheduler:
+
+    def __init__(self, pool, numProcesses, extreme, sortMemory, limiter=None):
+        self.ready = collections.deque()
+
+    def submit(self, kind, name, func, args, onDone, onError, size):
+        self.ready.append( (func, args, onDone) )
+        return
+
+    def run(self):
+        while len(self.ready) > 0:
+            func, args, onDone = self.ready.popleft()
+            onDone(func(*args))
+        return
+
+    def summary(self):
+        return dict()
+
+''' Shock client that saves nodes in a local folder. '''
+
+class LocalShockClient:
+
+    def __init__(self, url, token=None):
+        self.folder = url
+
+    def create_node(self, path, attributes):
+        nodeId = 'node%d' %(len(os.listdir(self.folder)))
+        shutil.move(path, os.path.join(self.folder, nodeId))
+        return { 'id': nodeId }
+
+    def delete_node(self, nodeId):
+        return
+
+''' User and job state client that ignores job updates. '''
+
+class LocalUserAndJobState:
+
+    def __init__(self, url, token=None):
+        return
+
+    def update_job_progress(self, jobId, token, status, progress, estimate):
+        return
+
+    def complete_job(self, jobId, token, status, error, results):
+        return
+
+''' Run a job that builds a distance matrix from generated sizes.
+
+    @param workDirectory Path to folder for job files
+    @param names List of sample names
+    @param singleSizes Array of sample sizes
+    @param pairSizes Square array of pair sizes
+    @return Elapsed time in seconds of runJob()
+'''
+
+def time_job(workDirectory, names, singleSizes, pairSizes):
+    # Create a tiny sequence file for each sample.
+    inputFolder = os.path.join(workDirectory, 'input')
+    os.mkdir(inputFolder)
+    filePaths = list()
+    for name in names:
+        filePaths.append(os.path.join(inputFolder, name+'.fasta'))
+        with open(filePaths[-1], 'w') as f:
+            f.write('>read\nACGT\n')
+
+    # The compress and merge tasks return the generated sizes.
+    indices = dict([ (name, index) for index, name in enumerate(names) ])
+    def compress_seq(args):
+        return singleSizes[indices[os.path.basename(args['sourceFile'])[:-7]]]
+    def merge_compress_seq(args):
+        return pairSizes[indices[os.path.basename(args['sourceFile1'])[:-7]], indices[os.path.basename(args['sourceFile2'])[:-7]]]
+    Worker.compress_seq = compress_seq
+    Worker.merge_compress_seq = merge_compress_seq
+    Worker.TaskScheduler = InlineScheduler
+    Worker.ShockClient = LocalShockClient
+    Worker.UserAndJobState = LocalUserAndJobState
+    CompressionBasedDistance._log = lambda self, level, message: None
+
+    shockFolder = os.path.join(workDirectory, 'shock')
+    os.mkdir(shockFolder)
+    config = { 'shock_url': shockFolder, 'userandjobstate_url': '', 'work_folder_path': workDirectory, 'num_pool_processes': '1' }
+    context = { 'token': '', 'client_ip': '', 'user_id': '', 'module': '', 'method': '', 'call_id': '' }
+    input = { 'node_ids': [], 'file_paths': filePaths, 'format': 'fasta', 'scale': 'std', 'sequence_length': 0,
+              'min_reads': 0, 'max_reads': 0, 'extreme': 0 }
+    start = time.time()
+    CompressionBasedDistance().runJob({ 'id': 'bench', 'config': config, 'context': context, 'input': input })
+    elapsed = time.time() - start
+    shutil.rmtree(inputFolder)
+    shutil.rmtree(shockFolder)
+    return elapsed
+
+''' Calculate a distance matrix one pair at a time (the original calculator).
+
+    @param sizes Dictionary mapping file names to compressed sizes
+    @param outputFile Path to output CSV file
+    @return Nothing
+'''
+
+def dict_calculator(sizes, outputFile):
+    singleSizes = dict()
+    pairSizes = dict()
+    for fname in sizes:
+        if PairSeparator in fname:
+            pairSizes[fname] = sizes[fname]
+        else:
+            singleSizes[fname] = sizes[fname]
+    fnames = sorted(singleSizes.keys())
+    indices = dict(zip(fnames, range(len(fnames))))
+    cbdArray = numpy.zeros((len(fnames), len(fnames)), dtype=float)
+    for pair in pairSizes:
+        name1, name2 = pair.split(PairSeparator)
+        c1 = float(singleSizes[name1])
+        c2 = float(singleSizes[name2])
+        c12 = float(pairSizes[pair])
+        distance = 1.0 - ( 2.0 * ( (c1 + c2 - c12) / (c1 + c2) ) )
+        cbdArray[indices[name1],indices[name2]] = distance
+        cbdArray[indices[name2],indices[name1]] = distance
+    outf = open(outputFile, 'w')
+    outf.write('ID,' + ','.join(fnames) + '\n')
+    for i in range(len(fnames)):
+        outf.write(fnames[i] + ',' + ','.join(['{0:g}'.format(x) for x in cbdArray[i,:]]) + '\n')
+    outf.close()
+    return
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, prog='bench-distance', epilog=desc3)
+    parser.add_argument('--num-samples', help='comma separated list of number of samples', action='store', dest='numSamples', default='1000,5000,10000')
+    parser.add_argument('--max-job-samples', help='maximum number of samples for measuring a whole job', action='store', dest='maxJobSamples', type=int, default=1000)
+    parser.add_argument('--work-folder', help='path to folder for temporary files', action='store', dest='workFolder', default=None)
+    parser.add_argument('--max-dict-samples', help='maximum number of samples for dictionary-based measurements', action='store', dest='maxDictSamples', type=int, default=2000)
+    usage = parser.format_usage()
+    parser.description = desc1 + '      ' + usage + desc2
+    parser.usage = argparse.SUPPRESS
+    args = parser.parse_args()
+
+    workDirectory = tempfile.mkdtemp(prefix='bench-distance-', dir=args.workFolder)
+    outputFile = os.path.join(workDirectory, 'distance.csv')
+    cbd = CompressionBasedDistance()
+    print '%8s %12s %12s %12s %12s' %('samples', 'job', 'calculator', 'csv MB', 'dict calc')
+    for numSamples in [ int(value) for value in args.numSamples.split(',') ]:
+        names, singleSizes, pairSizes = generate_sizes(numSamples)
+        jobTime = '-'
+        dictTime = '-'
+        if numSamples <= args.maxJobSamples:
+            jobTime = '%.2f' %(time_job(workDirectory, names, singleSizes, pairSizes))
+        if numSamples <= args.maxDictSamples:
+            sizes = build_sizes_dict(names, singleSizes, pairSizes)
+            start = time.time()
+            dict_calculator(sizes, outputFile)
+            dictTime = '%.2f' %(time.time() - start)
+            del sizes
+        start = time.time()
+        cbd._cbdCalculator(names, singleSizes, pairSizes, 'std', outputFile)
+        calcTime = time.time() - start
+        print '%8d %12s %12.2f %12.1f %12s' %(numSamples, jobTime, calcTime, os.path.getsize(outputFile) / 1048576.0, dictTime)
+        del pairSizes
+
+    os.remove(outputFile)
+    os.rmdir(workDirectory)
+    exit(0)
@@ -0,0 +1,121 @@
+#! /usr/bin/python
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from Bio import SeqIO
+from biokbase.CompressionBasedDistance.Helpers import SequenceParsers, extract_seq
+
+desc1 = '''
+NAME
+      bench-extract -- compare speed of extracting sequence reads
+
+SYNOPSIS
+'''
+
+desc2 = '''
+DESCRIPTION
+      Measure the number of sequence reads per second extracted from a sequence
+      file by the fast FASTA and FASTQ parsers used by extract_seq() and by
+      Bio.SeqIO.  Each parser is run with the --repeat number of times and the
+      best time is reported.
+
+      The --source-path optional argument specifies the path to a sequence file.
+      When it is not specified, a random sequence file is generated with the
+      --num-reads number of reads with a length of --read-length.
+
+      The --format optional argument specifies the format of the sequence file
+      and must be 'fasta' or 'fastq'.
+'''
+
+desc3 = '''
+EXAMPLES
+      Compare the parsers with a generated fastq file with 1 million reads:
+      > python bench-extract.py --format fastq --num-reads 1000000
+
+AUTHORS
+      Mike Mundy
+'''
+
+''' Generate a random sequence file.
+
+    @param path Path to output file
+    @param format Format of sequence file
+    @param numReads Number of reads in file
+    @param readLength Length of each read
+    @return Nothing
+'''
+
+def generate_file(path, format, numReads, readLength):
+    random.seed(1)
+    bases = [ ''.join([ random.choice('ACGT') for i in range(readLength) ]) for j in range(1000) ]
+    with open(path, 'w') as f:
+        for index in range(numReads):
+            seq = random.choice(bases)
+            if format == 'fasta':
+                f.write('>read%d\n%s\n' %(index, seq))
+            else:
+                f.write('@read%d\n%s\n+\n%s\n' %(index, seq, 'I'*readLength))
+    return
+
+''' Run a function and return the best time of several runs.
+
+    @param func Function to run
+    @param repeat Number of times to run function
+    @return Best elapsed time in seconds
+'''
+
+def best_time(func, repeat):
+    bestTime = None
+    for index in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if bestTime is None or elapsed < bestTime:
+            bestTime = elapsed
+    return bestTime
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, prog='bench-extract', epilog=desc3)
+    parser.add_argument('--source-path', help='path to sequence file', action='store', dest='sourcePath', default=None)
+    parser.add_argument('--format', help='format of sequence file', action='store', dest='format', default='fastq', choices=[ 'fasta', 'fastq' ])
+    parser.add_argument('--num-reads', help='number of reads in generated file', action='store', dest='numReads', type=int, default=500000)
+    parser.add_argument('--read-length', help='length of reads in generated file', action='store', dest='readLength', type=int, default=150)
+    parser.add_argument('--repeat', help='number of times to run each parser', action='store', dest='repeat', type=int, default=3)
+    usage = parser.format_usage()
+    parser.description = desc1 + '      ' + usage + desc2
+    parser.usage = argparse.SUPPRESS
+    args = parser.parse_args()
+
+    workDirectory = tempfile.mkdtemp(prefix='bench-extract-')
+    sourcePath = args.sourcePath
+    if sourcePath is None:
+        sourcePath = os.path.join(workDirectory, 'reads.'+args.format)
+        generate_file(sourcePath, args.format, args.numReads, args.readLength)
+    numReads = sum(1 for seq in SequenceParsers[args.format](open(sourcePath, 'rb')))
+    print 'File %s has %d reads (%d bytes)' %(sourcePath, numReads, os.path.getsize(sourcePath))
+
+    # Time the parsers by themselves.
+    def biopython_parse():
+        for seqRecord in SeqIO.parse(sourcePath, args.format):
+            str(seqRecord.seq)
+    def fast_parse():
+        for seq in SequenceParsers[args.format](open(sourcePath, 'rb')):
+            pass
+    bioTime = best_time(biopython_parse, args.repeat)
+    fastTime = best_time(fast_parse, args.repeat)
+    print 'Parse with Bio.SeqIO:     %10.0f reads/sec' %(numReads / bioTime)
+    print 'Parse with fast parser:   %10.0f reads/sec (%.1fx)' %(numReads / fastTime, bioTime / fastTime)
+
+    # Time extract_seq() which also writes the extracted reads.
+    extractArgs = { 'sourceFile': sourcePath, 'format': args.format, 'destFile': os.path.join(workDirectory, 'reads.sequence'),
+                    'sequenceLen': 0, 'maxReads': 0, 'minReads': 0, 'nodeId': None, 'shockUrl': None, 'auth': None }
+    extractTime = best_time(lambda: extract_seq(extractArgs), args.repeat)
+    print 'Extract with extract_seq: %10.0f reads/sec' %(numReads / extractTime)
+
+    for name in os.listdir(workDirectory):
+        os.remove(os.path.join(workDirectory, name))
+    os.rmdir(workDirectory)
+    exit(0)
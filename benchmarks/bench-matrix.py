@@ -0,0 +1,121 @@
+#! /usr/bin/python
+
+import argparse
+import os
+import tempfile
+import time
+import numpy
+from biokbase.CompressionBasedDistance.Matrix import load_matrix, write_binary_matrix
+
+desc1 = '''
+NAME
+      bench-matrix -- measure speed of loading a distance matrix
+
+SYNOPSIS
+'''
+
+desc2 = '''
+DESCRIPTION
+      Measure the throughput of loading a distance matrix with load_matrix() for
+      each number of samples in the --num-samples list.  A random distance matrix
+      is saved in both csv and binary format and the time to load the full matrix
+      from each file and the time to load a subset with --subset-percent of the
+      IDs are reported.
+
+      The original loader that parsed the csv file one cell at a time is also
+      measured when the number of samples is no more than --max-legacy-samples.
+'''
+
+desc3 = '''
+EXAMPLES
+      Measure loading matrices with 1000 and 5000 samples:
+      > python bench-matrix.py --num-samples 1000,5000
+
+AUTHORS
+      Mike Mundy
+'''
+
+''' Save a random distance matrix in csv and binary format.
+
+    @param numSamples Number of samples
+    @param csvPath Path to output csv file
+    @param binaryPath Path to output binary file
+    @return List of IDs
+'''
+
+def generate_matrix(numSamples, csvPath, binaryPath):
+    random = numpy.random.RandomState(1)
+    idList = [ 'sample%06d' %(index) for index in range(numSamples) ]
+    distances = random.uniform(0.1, 0.9, (numSamples, numSamples))
+    distances = numpy.minimum(distances, distances.T)
+    numpy.fill_diagonal(distances, 0.0)
+    rowFormat = ','.join([ '%g' ] * numSamples) + '\n'
+    with open(csvPath, 'w') as f:
+        f.write('ID,' + ','.join(idList) + '\n')
+        for row in range(numSamples):
+            f.write(idList[row] + ',' + rowFormat %tuple(distances[row].tolist()))
+    write_binary_matrix(binaryPath, idList, distances)
+    return idList
+
+''' Load a distance matrix from a csv file one cell at a time (the original loader).
+
+    @param path Path to csv file
+    @return Tuple with list of IDs and square array of distance values
+'''
+
+def legacy_load(path):
+    sourceFile = open(path, 'r')
+    idList = sourceFile.readline().strip('\n\r').split(',')
+    idList.pop(0)
+    sourceArray = numpy.zeros((len(idList),len(idList)), dtype=float)
+    row = 0
+    for line in sourceFile:
+        fields = line.strip('\n\r').split(',')
+        fields.pop(0)
+        for index in range(0,len(fields)):
+            sourceArray[row,index] = float(fields[index])
+        row += 1
+    sourceFile.close()
+    return idList, sourceArray
+
+''' Run a function and return the elapsed time.
+
+    @param func Function to run
+    @return Elapsed time in seconds
+'''
+
+def elapsed(func):
+    start = time.time()
+    func()
+    return time.time() - start
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, prog='bench-matrix', epilog=desc3)
+    parser.add_argument('--num-samples', help='comma separated list of number of samples', action='store', dest='numSamples', default='1000,5000')
+    parser.add_argument('--subset-percent', help='percent of IDs to load for subset measurements', action='store', dest='subsetPercent', type=float, default=10.0)
+    parser.add_argument('--max-legacy-samples', help='maximum number of samples for measuring the original loader', action='store', dest='maxLegacySamples', type=int, default=2000)
+    usage = parser.format_usage()
+    parser.description = desc1 + '      ' + usage + desc2
+    parser.usage = argparse.SUPPRESS
+    args = parser.parse_args()
+
+    workDirectory = tempfile.mkdtemp(prefix='bench-matrix-')
+    csvPath = os.path.join(workDirectory, 'matrix.csv')
+    binaryPath = os.path.join(workDirectory, 'matrix.matrix')
+    print '%8s %10s %10s %10s %10s %10s %10s' %('samples', 'csv MB', 'legacy', 'csv', 'csv MB/s', 'binary', 'subset')
+    for numSamples in [ int(value) for value in args.numSamples.split(',') ]:
+        idList = generate_matrix(numSamples, csvPath, binaryPath)
+        subset = idList[::max(int(100.0 / args.subsetPercent), 1)]
+        csvSize = os.path.getsize(csvPath) / 1048576.0
+        legacyTime = '-'
+        if numSamples <= args.maxLegacySamples:
+            legacyTime = '%.2f' %(elapsed(lambda: legacy_load(csvPath)))
+        csvTime = elapsed(lambda: load_matrix(csvPath))
+        binaryTime = elapsed(lambda: load_matrix(binaryPath))
+        subsetTime = elapsed(lambda: load_matrix(binaryPath, subset))
+        print '%8d %10.1f %10s %10.2f %10.1f %10.2f %10.2f' %(numSamples, csvSize, legacyTime, csvTime, csvSize / csvTime, binaryTime, subsetTime)
+
+    os.remove(csvPath)
+    os.remove(binaryPath)
+    os.rmdir(workDirectory)
+    exit(0)
@@ -0,0 +1,76 @@
+#! /usr/bin/python
+
+import argparse
+import time
+import numpy
+from biokbase.CompressionBasedDistance import Scaling
+from biokbase.CompressionBasedDistance.Scaling import classical_mds
+
+desc1 = '''
+NAME
+      bench-mds -- measure speed of multidimensional scaling of a distance matrix
+
+SYNOPSIS
+'''
+
+desc2 = '''
+DESCRIPTION
+      Measure the time to compute the coordinates of the points in a 'mds' plot
+      from cbd-plotmatrix for each number of samples in the --num-samples list.
+      The distance matrix is randomly generated.
+
+      The time with the dense solver that finds all of the eigenvalues is also
+      measured when the number of samples is no more than --max-dense-samples.
+'''
+
+desc3 = '''
+EXAMPLES
+      Measure scaling matrices with 1000 and 10000 samples:
+      > python bench-mds.py --num-samples 1000,10000
+
+AUTHORS
+      Mike Mundy
+'''
+
+''' Generate a random distance matrix.
+
+    @param numSamples Number of samples
+    @return Square array of distance values
+'''
+
+def generate_matrix(numSamples):
+    random = numpy.random.RandomState(1)
+    points = random.uniform(0.0, 1.0, (numSamples, 10))
+    squares = (points ** 2).sum(axis=1)
+    distances = squares[:, numpy.newaxis] + squares[numpy.newaxis, :] - 2.0 * numpy.dot(points, points.T)
+    numpy.maximum(distances, 0.0, out=distances)
+    numpy.sqrt(distances, out=distances)
+    numpy.fill_diagonal(distances, 0.0)
+    return distances
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, prog='bench-mds', epilog=desc3)
+    parser.add_argument('--num-samples', help='comma separated list of number of samples', action='store', dest='numSamples', default='1000,5000,10000')
+    parser.add_argument('--max-dense-samples', help='maximum number of samples for measuring the dense solver', action='store', dest='maxDenseSamples', type=int, default=2000)
+    usage = parser.format_usage()
+    parser.description = desc1 + '      ' + usage + desc2
+    parser.usage = argparse.SUPPRESS
+    args = parser.parse_args()
+
+    print '%8s %10s %10s' %('samples', 'partial', 'dense')
+    for numSamples in [ int(value) for value in args.numSamples.split(',') ]:
+        distances = generate_matrix(numSamples)
+        denseTime = '-'
+        if numSamples <= args.maxDenseSamples:
+            denseLimit = Scaling.DenseEigenLimit
+            Scaling.DenseEigenLimit = numSamples
+            start = time.time()
+            classical_mds(distances)
+            denseTime = '%.2f' %(time.time() - start)
+            Scaling.DenseEigenLimit = denseLimit
+        start = time.time()
+        classical_mds(distances, overwrite=True)
+        print '%8d %10.2f %10s' %(numSamples, time.time() - start, denseTime)
+        del distances
+
+    exit(0)
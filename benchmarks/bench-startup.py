@@ -0,0 +1,120 @@
+#! /usr/bin/python
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+desc1 = '''
+NAME
+      bench-startup -- measure startup time of the cbd command line tools
+
+SYNOPSIS
+'''
+
+desc2 = '''
+DESCRIPTION
+      Measure the time to start each cbd command script in a new Python
+      interpreter and print its help.  Each script is run --repeat times and
+      the fastest and average times are reported along with the time to start
+      an interpreter that does nothing.  The heavy modules loaded by each
+      script are also listed.  A script that only prints help should not load
+      any of them.
+
+      The --scripts-path optional argument specifies the path to the folder
+      with the command scripts.  The default is the scripts folder next to the
+      benchmarks folder.  The --scripts optional argument specifies a comma
+      separated list of script names to measure.  The default is every
+      cbd-*.py script in the folder.
+'''
+
+desc3 = '''
+EXAMPLES
+      Measure startup time of every command script:
+      > python bench-startup.py
+
+      Measure startup time of cbd-plotmatrix and cbd-filtermatrix 50 times:
+      > python bench-startup.py --scripts cbd-plotmatrix.py,cbd-filtermatrix.py --repeat 50
+
+AUTHORS
+      Mike Mundy
+'''
+
+# Modules that take a noticeable amount of time to import.
+HeavyModules = [ 'numpy', 'scipy', 'matplotlib', 'Bio', 'shock', 'biokbase.userandjobstate', 'biokbase.auth', 'biokbase.log' ]
+
+# Program run in a new interpreter to load a script and report the heavy modules.
+Driver = '''
+import os, sys, runpy
+path = sys.argv[1]
+sys.argv = [ path, '--help' ]
+stdout = sys.stdout
+sys.stdout = open(os.devnull, 'w')
+try:
+    runpy.run_path(path, run_name='__main__')
+except SystemExit:
+    pass
+sys.stdout = stdout
+print ','.join([ name for name in %r if name in sys.modules ])
+''' %(HeavyModules)
+
+''' Run a program in a new interpreter and measure the elapsed time.
+
+    @param argList List of arguments for the interpreter
+    @return Tuple with elapsed time in seconds and output from the program
+    @raise RuntimeError when the program fails
+'''
+
+def run_interpreter(argList):
+    start = time.time()
+    proc = subprocess.Popen([ sys.executable ] + argList, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    (so, se) = proc.communicate()
+    elapsed = time.time() - start
+    if proc.returncode != 0:
+        errorLines = se.strip().split('\n')
+        raise RuntimeError(errorLines[-1])
+    return elapsed, so.strip()
+
+''' Measure the startup time of a program.
+
+    @param argList List of arguments for the interpreter
+    @param repeat Number of times to run the program
+    @return Tuple with fastest time, average time, and output from the last run
+    @raise RuntimeError when the program fails
+'''
+
+def measure(argList, repeat):
+    timeList = list()
+    for index in range(repeat):
+        elapsed, output = run_interpreter(argList)
+        timeList.append(elapsed)
+    return min(timeList), sum(timeList) / len(timeList), output
+
+if __name__ == "__main__":
+    defaultScriptsPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts')
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, prog='bench-startup', epilog=desc3)
+    parser.add_argument('--scripts-path', help='path to folder with command scripts', action='store', dest='scriptsPath', default=defaultScriptsPath)
+    parser.add_argument('--scripts', help='comma separated list of scripts to measure', action='store', dest='scripts', default=None)
+    parser.add_argument('--repeat', help='number of times to run each script', action='store', dest='repeat', type=int, default=10)
+    usage = parser.format_usage()
+    parser.description = desc1 + '      ' + usage + desc2
+    parser.usage = argparse.SUPPRESS
+    args = parser.parse_args()
+
+    if args.scripts is None:
+        scriptList = sorted([ name for name in os.listdir(args.scriptsPath) if name.startswith('cbd-') and name.endswith('.py') ])
+    else:
+        scriptList = args.scripts.split(',')
+
+    print '%-26s %8s %8s  %s' %('script', 'fastest', 'average', 'heavy modules')
+    fastest, average, output = measure([ '-c', 'pass' ], args.repeat)
+    print '%-26s %8.3f %8.3f' %('(interpreter)', fastest, average)
+    for name in scriptList:
+        try:
+            fastest, average, output = measure([ '-c', Driver, os.path.join(args.scriptsPath, name) ], args.repeat)
+            print '%-26s %8.3f %8.3f  %s' %(name, fastest, average, output)
+        except RuntimeError as e:
+            print '%-26s %8s %8s  %s' %(name, '-', '-', e)
+
+    exit(0)
@@ -0,0 +1,90 @@
+#! /usr/bin/python
+
+import argparse
+import time
+import numpy
+from biokbase.CompressionBasedDistance.Matrix import condensed_index
+from biokbase.CompressionBasedDistance.Tree import upgma, nj
+
+desc1 = '''
+NAME
+      bench-tree -- measure speed of building a tree from a distance matrix
+
+SYNOPSIS
+'''
+
+desc2 = '''
+DESCRIPTION
+      Measure the time to build a tree with the upgma and nj methods used by
+      cbd-plotmatrix for each number of samples in the --num-samples list.  The
+      time to convert each tree to ASCII art and Newick format is also reported.
+      The condensed distance matrix is randomly generated.
+
+      The nj method does O(N^3) work so it is only measured when the number of
+      samples is no more than --max-nj-samples.
+'''
+
+desc3 = '''
+EXAMPLES
+      Measure building trees with 1000 and 3000 samples:
+      > python bench-tree.py --num-samples 1000,3000
+
+AUTHORS
+      Mike Mundy
+'''
+
+''' Generate a random condensed distance matrix.
+
+    @param numSamples Number of samples
+    @return Condensed array of distance values
+'''
+
+def generate_condensed(numSamples):
+    random = numpy.random.RandomState(1)
+    points = random.uniform(0.0, 1.0, (numSamples, 10))
+    condensed = numpy.zeros(numSamples * (numSamples - 1) // 2, dtype=float)
+    for i in range(numSamples - 1):
+        start = condensed_index(numSamples, i, i + 1)
+        condensed[start:start+numSamples-i-1] = numpy.sqrt(((points[i+1:] - points[i]) ** 2).sum(axis=1))
+    return condensed
+
+''' Build a tree and convert it to text.
+
+    @param method Function to build the tree
+    @param idList List of IDs
+    @param condensed Condensed array of distance values
+    @return Tuple with time to build the tree and time to convert the tree to text
+'''
+
+def measure(method, idList, condensed):
+    start = time.time()
+    tree = method(idList, condensed)
+    buildTime = time.time() - start
+    start = time.time()
+    tree.ascii_art()
+    tree.newick()
+    return buildTime, time.time() - start
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, prog='bench-tree', epilog=desc3)
+    parser.add_argument('--num-samples', help='comma separated list of number of samples', action='store', dest='numSamples', default='1000,3000')
+    parser.add_argument('--max-nj-samples', help='maximum number of samples for measuring the nj method', action='store', dest='maxNjSamples', type=int, default=3000)
+    usage = parser.format_usage()
+    parser.description = desc1 + '      ' + usage + desc2
+    parser.usage = argparse.SUPPRESS
+    args = parser.parse_args()
+
+    print '%8s %10s %10s %10s %10s' %('samples', 'upgma', 'upgma text', 'nj', 'nj text')
+    for numSamples in [ int(value) for value in args.numSamples.split(',') ]:
+        idList = [ 'sample%06d' %(index) for index in range(numSamples) ]
+        condensed = generate_condensed(numSamples)
+        upgmaTime, upgmaTextTime = measure(upgma, idList, condensed)
+        njTime = '-'
+        njTextTime = '-'
+        if numSamples <= args.maxNjSamples:
+            buildTime, textTime = measure(nj, idList, condensed)
+            njTime = '%.2f' %(buildTime)
+            njTextTime = '%.2f' %(textTime)
+        print '%8d %10.2f %10.2f %10s %10s' %(numSamples, upgmaTime, upgmaTextTime, njTime, njTextTime)
+
+    exit(0)
@@ -0,0 +1,65 @@
+import unittest
+import shutil
+import tempfile
+import os
+from biokbase.CompressionBasedDistance.Cache import SampleCache, SortedFileName, SizesFileName
+from biokbase.CompressionBasedDistance.Helpers import extract_seq
+
+class TestSampleCache(unittest.TestCase):
+    '''
+    Test getting samples from the cache when the sorted file in the job is replaced
+    '''
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cache = SampleCache(os.path.join(self.folder, 'cache'), 1024 * 1024)
+        self.cachedFile = os.path.join(self.folder, 'cached.sorted')
+        with open(self.cachedFile, 'w') as f:
+            f.write('AAAA\nCCCC\nGGGG\n')
+        self.cache.add('key1', self.cachedFile)
+        self.entryFile = os.path.join(self.folder, 'cache', 'key1', SortedFileName)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def extract(self, sortedFile, packed):
+        sourceFile = os.path.join(self.folder, 'sample.fasta')
+        with open(sourceFile, 'w') as f:
+            f.write('>read1\nTTTT\n>read2\nACGT\n')
+        args = { 'nodeId': None, 'sourceFile': sourceFile, 'format': 'fasta', 'destFile': sortedFile, 'sortMemory': 1024 * 1024,
+                 'packed': packed, 'sequenceLen': 4, 'maxReads': 0, 'minReads': 0, 'shockUrl': None, 'auth': None }
+        extract_seq(args)
+
+    def test_getMissing(self):
+        '''Get a sample that is not in the cache and verify that no file is linked.'''
+
+        sortedFile = os.path.join(self.folder, 'job.sorted')
+        self.assertEqual(self.cache.get('key2', sortedFile), None)
+        self.assertFalse(os.path.exists(sortedFile))
+
+    def test_getBadSizes(self):
+        '''Get a sample with a bad compressed sizes file and verify that the sorted file is not linked.'''
+
+        with open(os.path.join(self.folder, 'cache', 'key1', SizesFileName), 'w') as f:
+            f.write('{"xz-9": ')
+        sortedFile = os.path.join(self.folder, 'job.sorted')
+        self.assertRaises(ValueError, self.cache.get, 'key1', sortedFile)
+        self.assertFalse(os.path.exists(sortedFile))
+
+        with open(os.path.join(self.folder, 'cache', 'key1', SizesFileName), 'w') as f:
+            f.write('[ 1 ]')
+        self.assertRaises(ValueError, self.cache.get, 'key1', sortedFile)
+        self.assertFalse(os.path.exists(sortedFile))
+
+    def test_extractOverCachedSample(self):
+        '''Extract a sample to a sorted file that is linked to the cache and verify that the cache entry is not changed.'''
+
+        for packed in [ False, True ]:
+            sortedFile = os.path.join(self.folder, 'job.sorted')
+            self.assertEqual(self.cache.get('key1', sortedFile), dict())
+            self.extract(sortedFile, packed)
+            self.assertEqual(open(self.entryFile, 'r').read(), 'AAAA\nCCCC\nGGGG\n')
+            os.remove(sortedFile)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,362 @@
+import unittest
+import subprocess
+import gzip
+import bz2
+import random
+import shutil
+import tempfile
+import os
+from biokbase.CompressionBasedDistance.Helpers import compress_seq, merge_compress_seq, extract_seq, split_sequence_file, extract_chunk, combine_chunks, parse_input_file, file_compression_type
+
+''' Check if a command is available on the path.
+
+    @param name Name of command
+    @return True when the command is found
+'''
+
+def have_command(name):
+    for folder in os.environ.get('PATH', '').split(os.pathsep):
+        if os.access(os.path.join(folder, name), os.X_OK):
+            return True
+    return False
+
+''' Generate random reads with some repeated reads like an amplicon sample.
+
+    @param numReads Number of reads
+    @param length Length of each read
+    @param seed Seed for random number generator
+    @return List of reads
+'''
+
+def make_reads(numReads, length, seed):
+    generator = random.Random(seed)
+    reads = list()
+    for index in range(numReads):
+        if len(reads) > 0 and generator.random() < 0.3:
+            reads.append(generator.choice(reads))
+        else:
+            reads.append(''.join([ generator.choice('ACGT') for position in range(length) ]))
+    return reads
+
+''' Get the output of the sort command for a file the way jobs used to sort reads.
+
+    @param path Path to file
+    @return Sorted file data
+'''
+
+def sort_output(path):
+    env = dict(os.environ)
+    env['LC_ALL'] = 'C'
+    proc = subprocess.Popen([ 'sort', path ], stdout = subprocess.PIPE, env = env)
+    (so, se) = proc.communicate()
+    return so
+
+''' Get the size of a file compressed by the xz command the way jobs used to measure it.
+
+    @param path Path to file
+    @param extreme True to use extreme compression
+    @return Size in bytes of compressed data
+'''
+
+def xz_size(path, extreme):
+    if extreme:
+        level = '-9e'
+    else:
+        level = '-9'
+    proc = subprocess.Popen([ 'xz', level, '-T1', '--no-warn', '--stdout', path ], stdout = subprocess.PIPE)
+    (so, se) = proc.communicate()
+    return len(so)
+
+''' Get the size of two sorted files merged by the sort command and compressed by the xz command.
+
+    @param path1 Path to first file
+    @param path2 Path to second file
+    @param extreme True to use extreme compression
+    @return Size in bytes of compressed data
+'''
+
+def merged_xz_size(path1, path2, extreme):
+    if extreme:
+        level = '-9e'
+    else:
+        level = '-9'
+    env = dict(os.environ)
+    env['LC_ALL'] = 'C'
+    sortProc = subprocess.Popen([ 'sort', '-m', path1, path2 ], stdout = subprocess.PIPE, env = env)
+    xzProc = subprocess.Popen([ 'xz', level, '-T1', '--no-warn', '--stdout' ], stdin = sortProc.stdout, stdout = subprocess.PIPE)
+    sortProc.stdout.close()
+    (so, se) = xzProc.communicate()
+    sortProc.wait()
+    return len(so)
+
+class TestCompressedSize(unittest.TestCase):
+    '''
+    Test that compressed sizes are the same as the sizes from the xz command
+    '''
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write_reads(self, name, reads):
+        path = os.path.join(self.folder, name)
+        with open(path, 'wb') as f:
+            f.write(''.join([ read + '\n' for read in reads ]))
+        return path
+
+    @unittest.skipUnless(have_command('xz'), 'xz command is not available')
+    def test_compressSeq(self):
+        '''Compress a sorted file in-process and verify the size is the same as xz -9.'''
+
+        path = self.write_reads('sample.sorted', sorted(make_reads(20000, 100, 1)))
+        self.assertEqual(compress_seq({ 'sourceFile': path, 'extreme': False }), xz_size(path, False))
+
+    @unittest.skipUnless(have_command('xz'), 'xz command is not available')
+    def test_compressSeqExtreme(self):
+        '''Compress a sorted file in-process with extreme compression and verify the size is the same as xz -9e.'''
+
+        path = self.write_reads('sample.sorted', sorted(make_reads(5000, 100, 2)))
+        self.assertEqual(compress_seq({ 'sourceFile': path, 'extreme': True }), xz_size(path, True))
+
+    @unittest.skipUnless(have_command('xz'), 'xz command is not available')
+    def test_compressEmpty(self):
+        '''Compress an empty file and verify the size is the same as xz -9.'''
+
+        path = self.write_reads('empty.sorted', [])
+        self.assertEqual(compress_seq({ 'sourceFile': path, 'extreme': False }), xz_size(path, False))
+
+    @unittest.skipUnless(have_command('xz') and have_command('sort'), 'xz or sort command is not available')
+    def test_mergeCompressSeq(self):
+        '''Merge and compress two sorted files in-process and verify the size is the same as sort -m piped to xz -9.'''
+
+        reads = make_reads(20000, 100, 3)
+        path1 = self.write_reads('first.sorted', sorted(reads[:12000]))
+        path2 = self.write_reads('second.sorted', sorted(reads[8000:] + make_reads(3000, 100, 4)))
+        before = sorted(os.listdir(self.folder))
+        size = merge_compress_seq({ 'sourceFile1': path1, 'sourceFile2': path2, 'extreme': False })
+        self.assertEqual(size, merged_xz_size(path1, path2, False))
+        self.assertEqual(sorted(os.listdir(self.folder)), before) # No merged file is left behind
+
+    @unittest.skipUnless(have_command('xz') and have_command('sort'), 'xz or sort command is not available')
+    def test_mergeCompressSeqExtreme(self):
+        '''Merge and compress two sorted files in-process with extreme compression and verify the size is the same as sort -m piped to xz -9e.'''
+
+        path1 = self.write_reads('first.sorted', sorted(make_reads(3000, 100, 5)))
+        path2 = self.write_reads('second.sorted', sorted(make_reads(3000, 100, 6)))
+        size = merge_compress_seq({ 'sourceFile1': path1, 'sourceFile2': path2, 'extreme': True })
+        self.assertEqual(size, merged_xz_size(path1, path2, True))
+
+    @unittest.skipUnless(have_command('xz') and have_command('sort'), 'xz or sort command is not available')
+    def test_mergeCompressSeqEmpty(self):
+        '''Merge an empty file with a sorted file and verify the size is the same as sort -m piped to xz -9.'''
+
+        path1 = self.write_reads('empty.sorted', [])
+        path2 = self.write_reads('second.sorted', sorted(make_reads(1000, 100, 7)))
+        size = merge_compress_seq({ 'sourceFile1': path1, 'sourceFile2': path2, 'extreme': False })
+        self.assertEqual(size, merged_xz_size(path1, path2, False))
+
+class TestSortReads(unittest.TestCase):
+    '''
+    Test that extracted reads are sorted the same as the sort command
+    '''
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        # Mix reads of different lengths so some reads are prefixes of other reads.
+        self.reads = make_reads(6000, 100, 8) + [ read[:60] for read in make_reads(2000, 100, 8) ] + make_reads(2000, 80, 9)
+        random.Random(10).shuffle(self.reads)
+        self.sourceFile = os.path.join(self.folder, 'sample.fasta')
+        with open(self.sourceFile, 'wb') as f:
+            for index in range(len(self.reads)):
+                f.write('>read%d\n%s\n' %(index, self.reads[index]))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def extract(self, name, sortMemory, sequenceLen=0):
+        args = { 'nodeId': None, 'sourceFile': self.sourceFile, 'format': 'fasta', 'destFile': os.path.join(self.folder, name),
+                 'sortMemory': sortMemory, 'packed': False, 'sequenceLen': sequenceLen, 'maxReads': 0, 'minReads': 0,
+                 'shockUrl': None, 'auth': None }
+        extract_seq(args)
+        return open(args['destFile'], 'rb').read()
+
+    def expected(self, reads):
+        path = os.path.join(self.folder, 'reads.txt')
+        with open(path, 'wb') as f:
+            f.write(''.join([ read + '\n' for read in reads ]))
+        return sort_output(path)
+
+    @unittest.skipUnless(have_command('sort'), 'sort command is not available')
+    def test_sortInMemory(self):
+        '''Extract reads that fit in the sort memory and verify the output is the same as the sort command.'''
+
+        self.assertEqual(self.extract('memory.sorted', 1024 * 1024 * 1024), self.expected(self.reads))
+        self.assertEqual(sorted(os.listdir(self.folder)), [ 'memory.sorted', 'reads.txt', 'sample.fasta' ])
+
+    @unittest.skipUnless(have_command('sort'), 'sort command is not available')
+    def test_sortWithSpills(self):
+        '''Extract reads with a small sort memory so runs are spilled and verify the output is the same as the sort command.'''
+
+        self.assertEqual(self.extract('spill.sorted', 64 * 1024), self.expected(self.reads))
+        self.assertEqual(self.extract('spill.sorted', 64 * 1024), self.extract('memory.sorted', 1024 * 1024 * 1024))
+        self.assertEqual(sorted(os.listdir(self.folder)), [ 'memory.sorted', 'reads.txt', 'sample.fasta', 'spill.sorted' ])
+
+    @unittest.skipUnless(have_command('sort'), 'sort command is not available')
+    def test_sortTrimmedWithSpills(self):
+        '''Extract trimmed reads with spilled runs and verify the output is the same as the sort command.'''
+
+        trimmed = [ read[:70] for read in self.reads if len(read) >= 70 ]
+        self.assertEqual(self.extract('trim.sorted', 64 * 1024, 70), self.expected(trimmed))
+
+class TestExtractChunks(unittest.TestCase):
+    '''
+    Test that extracting a sequence file in chunks gives the same sorted file as extracting the whole file
+    '''
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        generator = random.Random(11)
+        self.reads = make_reads(5000, 100, 12) + make_reads(1000, 40, 13)
+        generator.shuffle(self.reads)
+
+        # Sequences are split over lines in the FASTA file and quality lines in the
+        # FASTQ file can start with "@" or "+" so finding the start of a record is tested.
+        self.fastaFile = os.path.join(self.folder, 'sample.fasta')
+        with open(self.fastaFile, 'wb') as f:
+            for index in range(len(self.reads)):
+                f.write('>read%d\n%s\n%s\n' %(index, self.reads[index][:70], self.reads[index][70:]))
+        self.fastqFile = os.path.join(self.folder, 'sample.fastq')
+        with open(self.fastqFile, 'wb') as f:
+            for index in range(len(self.reads)):
+                quality = ''.join([ generator.choice('@+ABCDEFGHI') for position in range(len(self.reads[index])) ])
+                f.write('@read%d\n%s\n+\n%s\n' %(index, self.reads[index], quality))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def make_args(self, sourceFile, format, name, maxReads, sequenceLen, packed):
+        return { 'nodeId': None, 'sourceFile': sourceFile, 'sourceSize': os.path.getsize(sourceFile), 'format': format,
+                 'destFile': os.path.join(self.folder, name), 'sortMemory': 1024 * 1024 * 1024, 'packed': packed,
+                 'sequenceLen': sequenceLen, 'maxReads': maxReads, 'minReads': 0, 'shockUrl': None, 'auth': None }
+
+    def extract_whole(self, sourceFile, format, maxReads=0, sequenceLen=0, packed=False):
+        args = self.make_args(sourceFile, format, 'whole.sorted', maxReads, sequenceLen, packed)
+        extract_seq(args)
+        return open(args['destFile'], 'rb').read()
+
+    def extract_chunks(self, sourceFile, format, sequenceLen=0, packed=False):
+        # Run the chunks the same way as the worker does.
+        args = self.make_args(sourceFile, format, 'chunked.sorted', 0, sequenceLen, packed)
+        chunks = split_sequence_file(args, 7919)
+        self.assertTrue(len(chunks) > 10)
+        combineArgs = dict(args)
+        combineArgs['chunkFiles'] = list()
+        combineArgs['numReads'] = 0
+        for index, (start, end) in enumerate(chunks):
+            chunkArgs = dict(args)
+            chunkArgs['chunkStart'] = start
+            chunkArgs['chunkEnd'] = end
+            chunkArgs['destFile'] = '%s.chunk%d' %(args['destFile'], index)
+            combineArgs['chunkFiles'].append(chunkArgs['destFile'])
+            combineArgs['numReads'] += extract_chunk(chunkArgs)
+        combine_chunks(combineArgs)
+        self.assertEqual([ name for name in os.listdir(self.folder) if '.chunk' in name ], [])
+        return open(args['destFile'], 'rb').read()
+
+    def test_fastaChunks(self):
+        '''Extract a FASTA file in chunks and verify the sorted file is the same as extracting the whole file.'''
+
+        self.assertEqual(self.extract_chunks(self.fastaFile, 'fasta'), self.extract_whole(self.fastaFile, 'fasta'))
+
+    def test_fastqChunks(self):
+        '''Extract a FASTQ file in chunks and verify the sorted file is the same as extracting the whole file.'''
+
+        self.assertEqual(self.extract_chunks(self.fastqFile, 'fastq'), self.extract_whole(self.fastqFile, 'fastq'))
+
+    def test_maxReadsChunks(self):
+        '''Split a file with a maximum number of reads and verify that the file is extracted in one task.'''
+
+        self.assertEqual(split_sequence_file(self.make_args(self.fastaFile, 'fasta', 'chunked.sorted', 1234, 0, False), 7919), [])
+        self.assertEqual(split_sequence_file(self.make_args(self.fastqFile, 'fastq', 'chunked.sorted', 1234, 50, True), 7919), [])
+
+    def test_packedChunks(self):
+        '''Extract trimmed and packed reads in chunks and verify the packed file is the same as extracting the whole file.'''
+
+        self.assertEqual(self.extract_chunks(self.fastqFile, 'fastq', 50, True), self.extract_whole(self.fastqFile, 'fastq', 0, 50, True))
+
+class TestCompressedInput(unittest.TestCase):
+    '''
+    Test that compressed sequence files are decompressed as they are extracted
+    '''
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.sourceFile = os.path.join(self.folder, 'sample.fastq')
+        with open(self.sourceFile, 'wb') as f:
+            reads = make_reads(20000, 100, 14)
+            for index in range(len(reads)):
+                f.write('@read%d\n%s\n+\n%s\n' %(index, reads[index], 'I' * len(reads[index])))
+        self.data = open(self.sourceFile, 'rb').read()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def extract(self, sourceFile):
+        args = { 'nodeId': None, 'sourceFile': sourceFile, 'format': 'fastq', 'destFile': os.path.join(self.folder, 'sample.sorted'),
+                 'sortMemory': 1024 * 1024 * 1024, 'packed': False, 'sequenceLen': 0, 'maxReads': 0, 'minReads': 0,
+                 'shockUrl': None, 'auth': None }
+        extract_seq(args)
+        return open(args['destFile'], 'rb').read()
+
+    def compress_command(self, cmd, extension):
+        path = self.sourceFile + extension
+        with open(path, 'wb') as f:
+            subprocess.check_call(cmd + [ '--stdout', self.sourceFile ], stdout = f)
+        return path
+
+    def check_extract(self, path, kind):
+        self.assertEqual(file_compression_type(path), kind)
+        self.assertEqual(self.extract(path), self.extract(self.sourceFile))
+
+    def test_gzip(self):
+        '''Extract a gzip compressed file and verify the sorted file is the same as extracting the uncompressed file.'''
+
+        path = self.sourceFile + '.gz'
+        f = gzip.open(path, 'wb')
+        f.write(self.data)
+        f.close()
+        self.check_extract(path, 'gzip')
+
+    def test_bzip2(self):
+        '''Extract a bzip2 compressed file and verify the sorted file is the same as extracting the uncompressed file.'''
+
+        path = self.sourceFile + '.bz2'
+        with open(path, 'wb') as f:
+            f.write(bz2.compress(self.data))
+        self.check_extract(path, 'bzip2')
+
+    @unittest.skipUnless(have_command('xz'), 'xz command is not available')
+    def test_xz(self):
+        '''Extract an xz compressed file and verify the sorted file is the same as extracting the uncompressed file.'''
+
+        self.check_extract(self.compress_command([ 'xz', '-T1' ], '.xz'), 'xz')
+
+    def test_parseInputFile(self):
+        '''Parse a list file with compressed sequence files and verify the format is from the extension before the compression extension.'''
+
+        path = self.sourceFile + '.gz'
+        f = gzip.open(path, 'wb')
+        f.write(self.data)
+        f.close()
+        listPath = os.path.join(self.folder, 'list.input')
+        with open(listPath, 'w') as f:
+            f.write('%s\tday0\n%s\tday7\n' %(path, self.sourceFile))
+        fileList, extensions, numMissingFiles = parse_input_file(listPath)
+        self.assertEqual(fileList, [ path, self.sourceFile ])
+        self.assertEqual(extensions, { 'fastq': 1 })
+        self.assertEqual(numMissingFiles, 0)
+
+if __name__ == '__main__':
+    unittest.main()
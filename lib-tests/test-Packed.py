@@ -0,0 +1,152 @@
+import unittest
+import subprocess
+import random
+import shutil
+import tempfile
+import os
+from biokbase.CompressionBasedDistance.Helpers import extract_seq, compress_seq, merge_compress_seq
+from biokbase.CompressionBasedDistance.Packed import is_packed, text_size, sorted_lines, packed_text_blocks
+
+''' Check if a command is available on the path.
+
+    @param name Name of command
+    @return True when the command is found
+'''
+
+def have_command(name):
+    for folder in os.environ.get('PATH', '').split(os.pathsep):
+        if os.access(os.path.join(folder, name), os.X_OK):
+            return True
+    return False
+
+''' Generate random reads with some repeated reads and some reads with N bases.
+
+    @param numReads Number of reads
+    @param length Length of each read
+    @param seed Seed for random number generator
+    @return List of reads
+'''
+
+def make_reads(numReads, length, seed):
+    generator = random.Random(seed)
+    reads = list()
+    for index in range(numReads):
+        if len(reads) > 0 and generator.random() < 0.3:
+            reads.append(generator.choice(reads))
+        elif generator.random() < 0.01:
+            reads.append(''.join([ generator.choice('ACGTN') for position in range(length) ]))
+        else:
+            reads.append(''.join([ generator.choice('ACGT') for position in range(length) ]))
+    return reads
+
+''' Run a pipeline of commands with LC_ALL=C the way jobs used to sort and compress reads.
+
+    @param commands List of commands where each command is a list of arguments
+    @return Output of last command
+'''
+
+def run_pipeline(commands):
+    env = dict(os.environ)
+    env['LC_ALL'] = 'C'
+    procs = list()
+    for cmd in commands:
+        if len(procs) == 0:
+            procs.append(subprocess.Popen(cmd, stdout = subprocess.PIPE, env = env))
+        else:
+            procs.append(subprocess.Popen(cmd, stdin = procs[-1].stdout, stdout = subprocess.PIPE, env = env))
+            procs[-2].stdout.close()
+    (so, se) = procs[-1].communicate()
+    for proc in procs[:-1]:
+        proc.wait()
+    return so
+
+class TestPackedReads(unittest.TestCase):
+    '''
+    Test that packed sorted files give the same text and compressed sizes as text sorted files
+    '''
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write_fasta(self, name, reads):
+        path = os.path.join(self.folder, name)
+        with open(path, 'wb') as f:
+            for index in range(len(reads)):
+                f.write('>read%d\n%s\n' %(index, reads[index]))
+        return path
+
+    def write_reads(self, name, reads):
+        path = os.path.join(self.folder, name)
+        with open(path, 'wb') as f:
+            f.write(''.join([ read + '\n' for read in reads ]))
+        return path
+
+    def extract(self, sourceFile, name, packed, sortMemory=1024 * 1024 * 1024):
+        args = { 'nodeId': None, 'sourceFile': sourceFile, 'format': 'fasta', 'destFile': os.path.join(self.folder, name),
+                 'sortMemory': sortMemory, 'packed': packed, 'sequenceLen': 30, 'maxReads': 0, 'minReads': 0,
+                 'shockUrl': None, 'auth': None }
+        extract_seq(args)
+        return args['destFile']
+
+    @unittest.skipUnless(have_command('sort'), 'sort command is not available')
+    def test_packedText(self):
+        '''Extract packed reads with and without spilled runs and verify the text is the same as the sort command.'''
+
+        # Use more reads than a pack block and reads that are longer than the trimmed length.
+        reads = make_reads(70000, 36, 1)
+        sourceFile = self.write_fasta('sample.fasta', reads)
+        expected = run_pipeline([ [ 'sort', self.write_reads('reads.txt', [ read[:30] for read in reads ]) ] ])
+        for packedFile in [ self.extract(sourceFile, 'memory.packed', True), self.extract(sourceFile, 'spill.packed', True, 256 * 1024) ]:
+            self.assertTrue(is_packed(packedFile))
+            self.assertEqual(''.join(sorted_lines(packedFile)), expected)
+            self.assertEqual(''.join(packed_text_blocks([ packedFile ])), expected)
+            self.assertEqual(text_size(packedFile), len(expected))
+        self.assertEqual(open(self.extract(sourceFile, 'sample.sorted', False), 'rb').read(), expected)
+
+    @unittest.skipUnless(have_command('xz'), 'xz command is not available')
+    def test_packedCompressSeq(self):
+        '''Compress a packed sorted file and verify the size is the same as xz -9 of the text sorted file.'''
+
+        sourceFile = self.write_fasta('sample.fasta', make_reads(20000, 30, 2))
+        packedFile = self.extract(sourceFile, 'sample.packed', True)
+        textFile = self.extract(sourceFile, 'sample.sorted', False)
+        size = compress_seq({ 'sourceFile': packedFile, 'extreme': False })
+        self.assertEqual(size, len(run_pipeline([ [ 'xz', '-9', '-T1', '--no-warn', '--stdout', textFile ] ])))
+        self.assertEqual(size, compress_seq({ 'sourceFile': textFile, 'extreme': False }))
+
+    @unittest.skipUnless(have_command('xz') and have_command('sort'), 'xz or sort command is not available')
+    def test_packedMergeCompressSeq(self):
+        '''Merge and compress packed sorted files and verify the size is the same as sort -m of the text sorted files piped to xz -9.'''
+
+        reads = make_reads(20000, 30, 3)
+        packedFile1 = self.extract(self.write_fasta('first.fasta', reads[:12000]), 'first.packed', True)
+        packedFile2 = self.extract(self.write_fasta('second.fasta', reads[8000:]), 'second.packed', True)
+        textFile1 = self.extract(os.path.join(self.folder, 'first.fasta'), 'first.sorted', False)
+        textFile2 = self.extract(os.path.join(self.folder, 'second.fasta'), 'second.sorted', False)
+        expected = len(run_pipeline([ [ 'sort', '-m', textFile1, textFile2 ], [ 'xz', '-9', '-T1', '--no-warn', '--stdout' ] ]))
+        self.assertEqual(merge_compress_seq({ 'sourceFile1': packedFile1, 'sourceFile2': packedFile2, 'extreme': False }), expected)
+        self.assertEqual(merge_compress_seq({ 'sourceFile1': packedFile1, 'sourceFile2': textFile2, 'extreme': False }), expected)
+        self.assertEqual(merge_compress_seq({ 'sourceFile1': textFile1, 'sourceFile2': textFile2, 'extreme': False }), expected)
+
+    @unittest.skipUnless(have_command('sort'), 'sort command is not available')
+    def test_packedMergeText(self):
+        '''Merge packed sorted files with and without escaped reads and verify the text is the same as sort -m of the text sorted files.'''
+
+        # Use more reads than a decode block so the files are merged a block at a time.
+        allReads = make_reads(150000, 30, 4)
+        for reads in [ allReads, [ read for read in allReads if 'N' not in read ] ]:
+            packedFiles = list()
+            textFiles = list()
+            for index, (start, end) in enumerate([ (0, 80000), (60000, 150000), (100000, 110000) ]):
+                sourceFile = self.write_fasta('sample%d.fasta' %(index), reads[start:end])
+                packedFiles.append(self.extract(sourceFile, 'sample%d.packed' %(index), True))
+                textFiles.append(self.extract(sourceFile, 'sample%d.sorted' %(index), False))
+            expected = run_pipeline([ [ 'sort', '-m' ] + textFiles ])
+            self.assertEqual(''.join(packed_text_blocks(packedFiles)), expected)
+            self.assertEqual(''.join(packed_text_blocks(packedFiles[:2])), run_pipeline([ [ 'sort', '-m' ] + textFiles[:2] ]))
+
+if __name__ == '__main__':
+    unittest.main()
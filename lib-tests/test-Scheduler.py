@@ -0,0 +1,95 @@
+import unittest
+import hashlib
+import pickle
+import StringIO
+import os
+import urllib2
+from multiprocessing import Pool
+from biokbase.CompressionBasedDistance.Helpers import CommandError, run_command
+from biokbase.CompressionBasedDistance.Cache import file_checksum
+from biokbase.CompressionBasedDistance.Scheduler import TaskScheduler, TaskError, portable_exception
+
+# Task functions must be at the top level of the module so they can be pickled.
+
+def add_task(first, second):
+    return first + second
+
+def http_error_task():
+    raise urllib2.HTTPError('http://localhost/node/1', 500, 'Internal Server Error', {}, StringIO.StringIO('error body'))
+
+def command_error_task():
+    run_command([ 'false' ])
+    return 0
+
+class TestTaskScheduler(unittest.TestCase):
+    '''
+    Test running tasks and reporting failed tasks
+    '''
+
+    def setUp(self):
+        self.pool = Pool(2)
+        self.scheduler = TaskScheduler(self.pool, 2, False, 1024 * 1024)
+        self.results = list()
+        self.errors = list()
+
+    def tearDown(self):
+        self.pool.close()
+        self.pool.join()
+
+    def submit(self, name, func, args):
+        self.scheduler.submit('extract', name, func, args, self.results.append, self.errors.append, 100)
+
+    def test_success(self):
+        '''Run tasks and verify that the return values are passed to onDone.'''
+
+        self.submit('first', add_task, (1, 2))
+        self.submit('second', add_task, (3, 4))
+        self.scheduler.run()
+        self.assertEqual(sorted(self.results), [ 3, 7 ])
+        self.assertEqual(self.errors, [])
+        self.assertEqual(len(self.scheduler.history), 2)
+
+    def test_checksum(self):
+        '''Run tasks to calculate the checksums of files and verify that the checksums are correct.'''
+
+        paths = [ 'client-tests/1_V2.fasta', 'client-tests/2_V2.fasta' ]
+        for path in paths:
+            self.scheduler.submit('checksum', path, file_checksum, (path,), self.results.append, self.errors.append, os.path.getsize(path))
+        self.scheduler.run()
+        self.assertEqual(sorted(self.results), sorted([ hashlib.md5(open(path, 'rb').read()).hexdigest() for path in paths ]))
+        self.assertEqual(self.errors, [])
+
+    def test_unpicklableError(self):
+        '''Run a task that raises an exception that cannot be pickled and verify that onError is called.'''
+
+        self.submit('http', http_error_task, ())
+        self.submit('add', add_task, (1, 2))
+        self.scheduler.run()
+        self.assertEqual(self.results, [ 3 ])
+        self.assertEqual(len(self.errors), 1)
+        self.assertTrue(isinstance(self.errors[0], TaskError))
+        self.assertEqual(str(self.errors[0]), 'HTTPError: HTTP Error 500: Internal Server Error')
+
+    def test_commandError(self):
+        '''Run a task with a command that fails and verify that the command details are kept.'''
+
+        self.submit('command', command_error_task, ())
+        self.scheduler.run()
+        self.assertEqual(len(self.errors), 1)
+        self.assertTrue(isinstance(self.errors[0], CommandError))
+        self.assertEqual(self.errors[0].cmd, 'false')
+        self.assertEqual(self.errors[0].message, "'false' failed with return code 1")
+        self.assertEqual(self.errors[0].retcode, 1)
+
+    def test_portableException(self):
+        '''Convert an exception that cannot be pickled and verify that the copy can be pickled.'''
+
+        try:
+            http_error_task()
+        except urllib2.HTTPError as e:
+            err = portable_exception(e)
+        copy = pickle.loads(pickle.dumps(err))
+        self.assertEqual(str(copy), str(err))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,294 @@
+import os
+import fcntl
+import hashlib
+import json
+import shutil
+import sqlite3
+
+# Name of file with sorted sequence reads in a cache entry.
+SortedFileName = 'reads.sorted'
+
+# Name of file with compressed sizes in a cache entry.
+SizesFileName = 'sizes.json'
+
+# Name of lock file that serializes access to the cache.
+LockFileName = '.lock'
+
+# Number of seconds to wait for another job to release the pair size database.
+PairDatabaseTimeout = 300
+
+''' Build the key for a sample in the cache.
+
+    The key identifies the contents of the sorted sequence reads so it includes the
+    checksum of the input sequence file and all of the variables that control how
+    the sequence reads are extracted.
+
+    @param checksum Checksum of input sequence file
+    @param input Dictionary of input variables for job
+    @return Key string
+'''
+
+def sample_key(checksum, input):
+    keyData = [ checksum, input['format'], input['sequence_length'], input['min_reads'], input['max_reads'] ]
+    return hashlib.sha1(json.dumps(keyData)).hexdigest()
+
+''' Calculate the md5 checksum of a file.
+
+    @param path Path to file
+    @return Checksum string
+'''
+
+def file_checksum(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(1024 * 1024)
+            if not data:
+                break
+            md5.update(data)
+    return md5.hexdigest()
+
+''' Cache of sorted sequence reads and compressed sizes shared across jobs.
+
+    Each entry is a folder named with the sample key that contains the sorted
+    sequence reads and the compressed sizes of the sorted reads.  The cache is
+    shared by all of the jobs running on the system so access to the folder is
+    serialized with a lock file.  A new entry is built in a temporary folder and
+    renamed into place so an entry is never seen partially written.  Files are
+    hard linked between the cache and the job work folder so an entry can be
+    evicted while a job is still using the sorted reads.  Because a linked file
+    shares its data with the entry, sorted files are always written to a
+    temporary file that is renamed into place and never overwritten.
+
+    When the total size of the cache is more than the limit, the least recently
+    used entries are evicted.
+'''
+
+class SampleCache:
+
+    ''' Initialize the cache.
+
+        @param cacheDirectory Path to folder for storing cache entries
+        @param maxSize Maximum size of cache in bytes
+    '''
+
+    def __init__(self, cacheDirectory, maxSize):
+        self.cacheDirectory = cacheDirectory
+        self.maxSize = maxSize
+        if not os.path.exists(self.cacheDirectory):
+            try:
+                os.makedirs(self.cacheDirectory, 0775)
+            except OSError:
+                # Another job created the folder at the same time.
+                pass
+        self.lockFile = open(os.path.join(self.cacheDirectory, LockFileName), 'a')
+
+    ''' Get a sample from the cache.
+
+        When the sample is in the cache, the sorted sequence reads are linked to the
+        specified path and the entry is marked as recently used.  The compressed
+        sizes are read and checked before the sorted sequence reads are linked so
+        there is never a link to the entry when there is an error.
+
+        @param key Sample key
+        @param sortedFile Path to output file for sorted sequence reads
+        @raise ValueError: Compressed sizes in cache entry are not valid
+        @return Dictionary of compressed sizes of sample or None if sample is not in cache
+    '''
+
+    def get(self, key, sortedFile):
+        entryDirectory = os.path.join(self.cacheDirectory, key)
+        fcntl.flock(self.lockFile, fcntl.LOCK_EX)
+        try:
+            if not os.path.exists(entryDirectory):
+                return None
+            sizes = json.load(open(os.path.join(entryDirectory, SizesFileName), 'r'))
+            if not isinstance(sizes, dict):
+                raise ValueError("Compressed sizes in cache entry '%s' are not valid" %(key))
+            try:
+                _link_or_copy(os.path.join(entryDirectory, SortedFileName), sortedFile)
+                os.utime(entryDirectory, None)
+            except:
+                if os.path.exists(sortedFile):
+                    os.remove(sortedFile)
+                raise
+            return sizes
+        finally:
+            fcntl.flock(self.lockFile, fcntl.LOCK_UN)
+
+    ''' Add a sample to the cache.
+
+        @param key Sample key
+        @param sortedFile Path to file with sorted sequence reads
+        @return Nothing
+    '''
+
+    def add(self, key, sortedFile):
+        # Build the entry in a temporary folder without holding the lock.
+        entryDirectory = os.path.join(self.cacheDirectory, key)
+        tempDirectory = '%s.%d.tmp' %(entryDirectory, os.getpid())
+        os.mkdir(tempDirectory)
+        _link_or_copy(sortedFile, os.path.join(tempDirectory, SortedFileName))
+        json.dump(dict(), open(os.path.join(tempDirectory, SizesFileName), 'w'))
+
+        fcntl.flock(self.lockFile, fcntl.LOCK_EX)
+        try:
+            if os.path.exists(entryDirectory):
+                # Another job added the sample first.
+                shutil.rmtree(tempDirectory)
+            else:
+                os.rename(tempDirectory, entryDirectory)
+            self._evict()
+        finally:
+            fcntl.flock(self.lockFile, fcntl.LOCK_UN)
+        return
+
+    ''' Save the compressed size of a sample in the cache.
+
+        @param key Sample key
+        @param extreme True when size is for extreme compression
+        @param size Size in bytes of compressed data
+        @return Nothing
+    '''
+
+    def set_size(self, key, extreme, size):
+        entryDirectory = os.path.join(self.cacheDirectory, key)
+        fcntl.flock(self.lockFile, fcntl.LOCK_EX)
+        try:
+            if not os.path.exists(entryDirectory):
+                return # Entry was evicted
+            sizesFile = os.path.join(entryDirectory, SizesFileName)
+            sizes = json.load(open(sizesFile, 'r'))
+            sizes[_size_name(extreme)] = size
+            json.dump(sizes, open(sizesFile+'.tmp', 'w'))
+            os.rename(sizesFile+'.tmp', sizesFile)
+        finally:
+            fcntl.flock(self.lockFile, fcntl.LOCK_UN)
+        return
+
+    ''' Remove least recently used entries until the cache is smaller than the limit.
+
+        @note Caller must hold the lock.
+        @return Nothing
+    '''
+
+    def _evict(self):
+        # Find the size and last use time of all of the entries.
+        entryList = list()
+        totalSize = 0
+        for name in os.listdir(self.cacheDirectory):
+            entryDirectory = os.path.join(self.cacheDirectory, name)
+            if name == LockFileName or name.endswith('.tmp'):
+                continue
+            try:
+                size = os.path.getsize(os.path.join(entryDirectory, SortedFileName))
+                entryList.append( (os.path.getmtime(entryDirectory), size, entryDirectory) )
+                totalSize += size
+            except OSError:
+                continue
+
+        # Remove the oldest entries first.
+        entryList.sort()
+        for lastUsed, size, entryDirectory in entryList:
+            if totalSize <= self.maxSize:
+                break
+            shutil.rmtree(entryDirectory, ignore_errors=True)
+            totalSize -= size
+        return
+
+''' Get the name of a compressed size in a cache entry.
+
+    @param extreme True when size is for extreme compression
+    @return Name string
+'''
+
+def _size_name(extreme):
+    if extreme:
+        return 'xz-9e'
+    return 'xz-9'
+
+''' Get the compressed size from a cache entry.
+
+    @param sizes Dictionary of compressed sizes from cache entry
+    @param extreme True to get size for extreme compression
+    @return Size in bytes of compressed data or None if size is not available
+'''
+
+def cached_size(sizes, extreme):
+    return sizes.get(_size_name(extreme))
+
+''' Hard link a file or copy it when a link cannot be created.
+
+    @param sourceFile Path to source file
+    @param destFile Path to destination file
+    @return Nothing
+'''
+
+def _link_or_copy(sourceFile, destFile):
+    try:
+        os.link(sourceFile, destFile)
+    except OSError:
+        shutil.copyfile(sourceFile, destFile)
+    return
+
+''' Persistent cache of the compressed sizes of pairs of samples.
+
+    The compressed size of a merged pair depends only on the contents of the two
+    samples and the compression settings so the size is saved in a database keyed
+    by the two sample keys and the compression settings.  The database is shared
+    by all of the jobs running on the system and SQLite serializes access to it.
+'''
+
+class PairSizeCache:
+
+    ''' Initialize the cache.
+
+        @param databasePath Path to database file
+    '''
+
+    def __init__(self, databasePath):
+        self.db = sqlite3.connect(databasePath, timeout=PairDatabaseTimeout)
+        self.db.execute('CREATE TABLE IF NOT EXISTS pair_sizes (sample1 TEXT, sample2 TEXT, settings TEXT, size INTEGER, ' +
+                        'PRIMARY KEY (sample1, sample2, settings))')
+        self.db.commit()
+
+    ''' Get the compressed size of a pair of samples from the cache.
+
+        @param key1 Sample key of first sample in pair
+        @param key2 Sample key of second sample in pair
+        @param extreme True to get size for extreme compression
+        @return Size in bytes of compressed data or None if pair is not in cache
+    '''
+
+    def get(self, key1, key2, extreme):
+        key1, key2 = sorted([ key1, key2 ]) # Merged pair is the same in either order
+        row = self.db.execute('SELECT size FROM pair_sizes WHERE sample1=? AND sample2=? AND settings=?',
+                              (key1, key2, _size_name(extreme))).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    ''' Save the compressed sizes of pairs of samples in the cache.
+
+        @param pairSizes List of tuples with sample key of first sample, sample key of second sample, and size in bytes of compressed data
+        @param extreme True when sizes are for extreme compression
+        @return Nothing
+    '''
+
+    def set_many(self, pairSizes, extreme):
+        rows = list()
+        for key1, key2, size in pairSizes:
+            key1, key2 = sorted([ key1, key2 ])
+            rows.append( (key1, key2, _size_name(extreme), size) )
+        self.db.executemany('INSERT OR REPLACE INTO pair_sizes VALUES (?, ?, ?, ?)', rows)
+        self.db.commit()
+        return
+
+    ''' Close the cache.
+
+        @return Nothing
+    '''
+
+    def close(self):
+        self.db.close()
+        return
@@ -5,11 +5,24 @@ import subprocess
 import sys
 import time
 import json
-from shock import Client as ShockClient
-from biokbase.userandjobstate.client import UserAndJobState
-from biokbase.auth import kb_config
+import heapq
+import urllib2
+import zlib
+import bz2
+from biokbase.CompressionBasedDistance.JobQueue import JobQueue
 from ConfigParser import ConfigParser
-from Bio import SeqIO
+try:
+    import lzma
+except ImportError:
+    from backports import lzma
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# The command scripts that only talk to the server import this module so the
+# modules for the user and job state service, authentication, Biopython, and
+# packed reads (numpy) are imported by the functions that use them.
 
 # Exception thrown when a command failed
 class CommandError(Exception):
@@ -18,6 +31,30 @@ class CommandError(Exception):
 # Default URL for production server
 DefaultURL = 'https://kbase.us/services/cbd/'
 
+# Number of bytes to read at a time when streaming a file into a compressor.
+ReadBlockSize = 1024 * 1024
+
+# Number of lines to collect before writing merged lines to a compressor.
+WriteBlockLines = 16384
+
+# Estimated number of bytes of memory used by each read in addition to the bases.
+ReadMemoryOverhead = 48
+
+# Number of reads to collect before packing them.
+PackBlockReads = 65536
+
+# Magic bytes at the start of compressed files for each type of compression.
+CompressionMagic = [ ('gzip', '\x1f\x8b'), ('bzip2', 'BZh'), ('xz', '\xfd7zXZ\x00'), ('zstd', '\x28\xb5\x2f\xfd') ]
+
+# Number of bytes needed to detect the type of compression.
+MagicLength = 6
+
+# File name extensions for each type of compression.
+CompressionExtensions = { 'gzip': 'gz', 'bzip2': 'bz2', 'xz': 'xz', 'zstd': 'zst' }
+
+# String used to separate components in paired file names.
+PairSeparator = '-cbdpair-'
+
 '''
 '''
 
@@ -27,6 +64,7 @@ def get_url():
         return DefaultURL
 
     # Get the URL from the config file or use the default if it is not set.
+    from biokbase.auth import kb_config
     config = get_config(kb_config)
     if 'url' in config:
         currentURL = config['url']
@@ -47,6 +85,7 @@ def set_url(newURL):
         return newURL
     
     # Save the new URL to the config file.
+    from biokbase.auth import kb_config
     config = read_config(kb_config)
     config.set('CompressionBasedDistance', 'url', newURL)
     with open(kb_config, 'w') as configfile:
@@ -98,17 +137,298 @@ def make_job_dir(workDirectory, jobID):
         os.makedirs(jobDirectory, 0775)
     return jobDirectory
 
-''' Extract sequences from a sequence file.
+''' Parse the sequences from a FASTA file.
+
+    Only the sequences are returned so no per-record objects are built.  The
+    sequence lines of a record are joined and whitespace is removed the same way
+    as Bio.SeqIO.  Lines before the first record are ignored.
+
+    @param source File object for input sequence file
+    @return Generator of sequence strings
+'''
+
+def fasta_sequences(source):
+    seqLines = None
+    for line in source:
+        if line[0] == '>':
+            if seqLines is not None:
+                seq = ''.join(seqLines)
+                if ' ' in seq:
+                    seq = seq.replace(' ', '')
+                yield seq
+            seqLines = list()
+        elif seqLines is not None:
+            seqLines.append(line.rstrip())
+    if seqLines is not None:
+        seq = ''.join(seqLines)
+        if ' ' in seq:
+            seq = seq.replace(' ', '')
+        yield seq
+
+''' Parse the sequences from a FASTQ file.
+
+    Only the sequences are returned so no per-record objects are built.  Records
+    with sequence and quality strings split over multiple lines are supported.
+    The length of the quality string is checked but the quality values are not
+    validated.
+
+    @param source File object for input sequence file
+    @raise ValueError: Input file is not a valid FASTQ file
+    @return Generator of sequence strings
+'''
+
+def fastq_sequences(source):
+    lines = iter(source)
+    try:
+        for title in lines:
+            if title[0] != '@':
+                if title.strip() == '':
+                    continue # Blank lines between records are allowed
+                raise ValueError("Records in FASTQ files should start with '@' character")
+            seq = ''
+            line = next(lines)
+            while line[0] != '+':
+                seq += line.rstrip()
+                line = next(lines)
+            if len(line) > 2:
+                caption = line[1:].rstrip()
+                if caption and caption != title[1:].rstrip():
+                    raise ValueError('Sequence and quality captions differ for %s' %(title[1:].rstrip()))
+            qualLen = len(next(lines).rstrip())
+            while qualLen < len(seq):
+                qualLen += len(next(lines).rstrip())
+            if qualLen != len(seq):
+                raise ValueError("Lengths of sequence and quality values differs for %s" %(title[1:].rstrip()))
+            yield seq
+    except StopIteration:
+        raise ValueError('End of file without quality information')
+
+# Fast parsers for sequence file formats that are used instead of Bio.SeqIO.
+SequenceParsers = { 'fasta': fasta_sequences, 'fastq': fastq_sequences, 'fastq-sanger': fastq_sequences,
+                    'fastq-solexa': fastq_sequences, 'fastq-illumina': fastq_sequences }
+
+''' Open a stream to download a file from Shock.
+
+    @param shockUrl URL of Shock server endpoint
+    @param auth Authorization token for user
+    @param nodeId Node ID of file in Shock
+    @param offset Offset in bytes to start download or None to download the whole file
+    @param length Number of bytes to download starting at the offset
+    @return File object for reading the file as it is downloaded
+'''
+
+def open_shock_download(shockUrl, auth, nodeId, offset=None, length=None):
+    url = '%s/node/%s?download' %(shockUrl.rstrip('/'), nodeId)
+    if offset is not None:
+        url += '&seek=%d&length=%d' %(offset, length)
+    request = urllib2.Request(url, headers={ 'Authorization': 'OAuth %s' %(auth) })
+    return urllib2.urlopen(request)
+
+''' Iterate over the lines in a stream.
+
+    Reading lines one at a time from a network stream is slow so the stream is
+    read in large blocks that are split into lines.
+
+    @param stream File object for stream
+    @return Generator of lines including the newline character
+'''
+
+def stream_lines(stream):
+    partial = ''
+    while True:
+        data = stream.read(ReadBlockSize)
+        if not data:
+            break
+        lines = (partial + data).split('\n')
+        partial = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    if partial:
+        yield partial
+
+''' Get the type of compression from the start of a file.
+
+    @param header First bytes of file (at least MagicLength bytes when available)
+    @return Type of compression or None when file is not compressed
+'''
+
+def compression_type(header):
+    for kind, magic in CompressionMagic:
+        if header.startswith(magic):
+            return kind
+    return None
+
+''' Get the type of compression of a file.
+
+    @param path Path to file
+    @return Type of compression or None when file is not compressed
+'''
+
+def file_compression_type(path):
+    with open(path, 'rb') as f:
+        return compression_type(f.read(MagicLength))
+
+''' Remove the compression extension from a file name.
+
+    @param filename File name
+    @return File name without compression extension
+'''
+
+def strip_compression_extension(filename):
+    root, ext = os.path.splitext(filename)
+    if ext[1:] in CompressionExtensions.values():
+        return root
+    return filename
+
+''' Build a decompressor for a type of compression.
+
+    @param kind Type of compression
+    @raise ValueError: Decompressor is not available
+    @return Decompressor object with a decompress() method
+'''
+
+def _make_decompressor(kind):
+    if kind == 'gzip':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if kind == 'bzip2':
+        return bz2.BZ2Decompressor()
+    if kind == 'xz':
+        return lzma.LZMADecompressor()
+    if zstandard is None:
+        raise ValueError('The zstandard package is needed to read zstd compressed sequence files')
+    return zstandard.ZstdDecompressor().decompressobj()
+
+''' Read a compressed stream as it is decompressed.
+
+    The data is decompressed in blocks as it is read so the decompressed file is
+    never stored.  Files with multiple compressed streams (for example from bgzip
+    or pbzip2) are supported.  A stream that is not compressed is passed through.
+'''
+
+class DecompressedStream:
+
+    ''' Initialize the stream.
+
+        @param source File object for compressed data
+        @param header Data already read from the start of the source
+        @param kind Type of compression or None when data is not compressed
+    '''
+
+    def __init__(self, source, header, kind):
+        self.source = source
+        self.kind = kind
+        self.pending = header
+        self.decompressor = None
+        self.buffer = ''
+        self.eof = False
+
+    ''' Read decompressed data.
+
+        @param size Maximum number of bytes to return
+        @return Decompressed data or an empty string at the end of the stream
+    '''
+
+    def read(self, size=ReadBlockSize):
+        while len(self.buffer) < size and not self.eof:
+            self.buffer += self._fill()
+        data = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return data
+
+    ''' Read a line of decompressed data.
+
+        @return Line including the newline character or an empty string at the end of the stream
+    '''
+
+    def readline(self):
+        while self.buffer.find('\n') < 0 and not self.eof:
+            self.buffer += self._fill()
+        end = self.buffer.find('\n') + 1
+        if end == 0:
+            end = len(self.buffer)
+        line = self.buffer[:end]
+        self.buffer = self.buffer[end:]
+        return line
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def close(self):
+        self.source.close()
+        return
+
+    ''' Decompress the next block of data from the source.
+
+        @return Decompressed data (may be empty)
+    '''
+
+    def _fill(self):
+        data = self.pending + self.source.read(ReadBlockSize)
+        self.pending = ''
+        if self.kind is None:
+            if not data:
+                self.eof = True
+            return data
+        if not data:
+            self.eof = True
+            if self.decompressor is not None and self.kind == 'gzip':
+                return self.decompressor.flush()
+            return ''
+        output = list()
+        while data:
+            if self.decompressor is None:
+                self.decompressor = _make_decompressor(self.kind)
+            try:
+                output.append(self.decompressor.decompress(data))
+            except EOFError:
+                # The previous stream ended exactly at the end of the last block.
+                self.decompressor = None
+                continue
+            # Start a new decompressor when the data has another compressed stream.
+            data = getattr(self.decompressor, 'unused_data', '')
+            if data or getattr(self.decompressor, 'eof', False):
+                if self.kind == 'gzip':
+                    output.append(self.decompressor.flush())
+                self.decompressor = None
+        return ''.join(output)
+
+''' Open a sequence file for reading and decompress it when it is compressed.
+
+    @param source File object for sequence file
+    @return File object for local uncompressed file or DecompressedStream
+'''
+
+def open_decompressed(source):
+    header = source.read(MagicLength)
+    kind = compression_type(header)
+    if kind is None and isinstance(source, file):
+        source.seek(0)
+        return source
+    return DecompressedStream(source, header, kind)
+
+''' Extract sequences from a sequence file and sort them.
+
+    A file in Shock is streamed straight into the parser so the input sequence
+    file is never written to disk.  When the maximum number of reads is reached,
+    the download is stopped.  A compressed input sequence file (gzip, bzip2, xz,
+    or zstd) is detected from the magic bytes at the start of the file and is
+    decompressed as it is read.
+
+    When packed is set and the reads are trimmed to a fixed length, the reads are
+    packed with 2 bits for each base and the output file is a packed sorted file.
+    Packed reads use about a quarter of the memory and disk space of text reads.
 
     The args dictionary includes the following keys:
 
-    sourceFile Path to input sequence file
+    sourceFile Path to input sequence file (when nodeId is not set)
     format Format of input sequence file
-    destFile Path to output file with raw sequence reads
+    destFile Path to output file with sorted sequence reads
+    sortMemory Maximum memory in bytes for sorting reads before spilling to a run file
+    packed True to pack reads when sequenceLen is set
     sequenceLen Minimum length to trim reads to (0 means to not trim)
     maxReads Maximum number of reads to include in output file (0 for no maximum)
     minReads Minimum number of reads to include in output file (0 for no minimum)
-    nodeId Node ID of sequence file in Shock (when set file is downloaded from Shock)
+    nodeId Node ID of sequence file in Shock (when set file is streamed from Shock)
     shockURL URL of Shock server endpoint
     auth Authorization token for user
 
@@ -117,52 +437,469 @@ def make_job_dir(workDirectory, jobID):
 '''
 
 def extract_seq(args):
-    # Download the file from Shock to the working directory.
+    # Open a stream to download the file from Shock or open the local file.
     if args['nodeId'] is not None:
-        shockClient = ShockClient(args['shockUrl'], args['auth'])
-        shockClient.download_to_path(args['nodeId'], args['sourceFile'])
+        source = open_shock_download(args['shockUrl'], args['auth'], args['nodeId'])
+    else:
+        source = open(args['sourceFile'], 'rb')
+    source = open_decompressed(source)
 
-    # Extract the sequences from the source file.
-    numReads = 0
-    with open(args['destFile'], 'w') as f:
-        if args['sequenceLen'] > 0: # A length to trim to was specified
-            for seqRecord in SeqIO.parse(args['sourceFile'], args['format']):
-                seq = str(seqRecord.seq)
-                if len(seq) < args['sequenceLen']:
-                    continue
-                if len(seq) > args['sequenceLen']:
-                    seq = seq[:args['sequenceLen']]
-                f.write(str(seq) + '\n')
-                numReads += 1
-                if numReads == args['maxReads']:
-                    break
-        elif args['maxReads'] > 0:
-            for seqRecord in SeqIO.parse(args['sourceFile'], args['format']):
-                f.write(str(seqRecord.seq) + '\n')
-                numReads += 1
-                if numReads == args['maxReads']:
-                    break
+    # Extract the sequences from the source file.  FASTA and FASTQ files are parsed
+    # directly and Biopython is used for all other formats.
+    try:
+        if args['format'] in SequenceParsers:
+            if isinstance(source, file):
+                sequences = SequenceParsers[args['format']](source)
+            else:
+                sequences = SequenceParsers[args['format']](stream_lines(source))
         else:
-            for seqRecord in SeqIO.parse(args['sourceFile'], args['format']):
-                f.write(str(seqRecord.seq) + '\n')
+            from Bio import SeqIO
+            sequences = ( str(seqRecord.seq) for seqRecord in SeqIO.parse(source, args['format']) )
+        _write_sorted_reads(sequences, args)
+    finally:
+        source.close()
+    return 0
 
-    # Delete the file if it does not have enough reads.
-    if args['minReads'] > 0 and numReads < args['minReads']:
-        os.remove(args['destFile'])
+''' Split a sequence file into chunks that can be extracted in parallel.
+
+    Only uncompressed FASTA and FASTQ files that are larger than the chunk size
+    can be split.  The chunks are nominal byte ranges and extract_chunk() moves
+    the start and end of each range to the start of a record.  A file is not
+    split when there is a maximum number of reads because the first reads of the
+    file are used and every chunk would need to extract up to the maximum.
+
+    The args dictionary includes the same keys as extract_seq() plus:
+
+    sourceSize Size in bytes of input sequence file
+
+    @param args Dictionary of argument values
+    @param chunkSize Size in bytes of each chunk
+    @return List of tuples with start and end offsets of chunks (empty when the file cannot be split)
+'''
+
+def split_sequence_file(args, chunkSize):
+    if chunkSize <= 0 or args['sourceSize'] <= chunkSize or args['format'] not in SequenceParsers or args['maxReads'] > 0:
+        return list()
+    source = open_sequence_range(args, 0, MagicLength)
+    try:
+        header = source.read(MagicLength)
+    finally:
+        source.close()
+    if compression_type(header) is not None:
+        return list()
+    return [ (start, min(start + chunkSize, args['sourceSize'])) for start in range(0, args['sourceSize'], chunkSize) ]
+
+''' Open a stream for a byte range of a sequence file.
+
+    @param args Dictionary of argument values (see extract_seq())
+    @param offset Offset in bytes of start of range
+    @param length Number of bytes in range
+    @return File object for reading the range
+'''
+
+def open_sequence_range(args, offset, length):
+    if args['nodeId'] is not None:
+        return open_shock_download(args['shockUrl'], args['auth'], args['nodeId'], offset, length)
+    source = open(args['sourceFile'], 'rb')
+    source.seek(offset)
+    return FileRange(source, length)
+
+''' Reader for a byte range of a local file. '''
+
+class FileRange:
+
+    def __init__(self, source, length):
+        self.source = source
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.source.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.source.close()
+        return
+
+''' Check if a group of lines is the start of a record in a sequence file.
+
+    A FASTQ record is recognized by a title line, a sequence line, a "+" line, and
+    a quality line with the same length as the sequence line followed by the title
+    line of the next record or the end of the file.  A record with the sequence
+    split over multiple lines is not recognized so it is never used as the start
+    of a chunk.
+
+    @param format Format of sequence file
+    @param lines List of lines starting at the candidate record
+    @param atEnd True when there are no lines after the lines in the list
+    @return True when the first line is the start of a record
+'''
+
+def _is_record_start(format, lines, atEnd):
+    if format == 'fasta':
+        return lines[0][0] == '>'
+    if len(lines) < 4 or (len(lines) == 4 and not atEnd):
+        return False
+    if lines[0][0] != '@' or lines[2][0] != '+' or len(lines[1].rstrip()) != len(lines[3].rstrip()):
+        return False
+    return len(lines) == 4 or lines[4][0] == '@'
+
+''' Find the start of the first record at or after an offset in a sequence file.
+
+    @param args Dictionary of argument values (see split_sequence_file())
+    @param offset Offset in bytes to start looking for a record
+    @return Offset in bytes of start of record or size of file when there are no more records
+'''
+
+def find_record_start(args, offset):
+    if offset <= 0:
+        return 0
+    if offset >= args['sourceSize']:
+        return args['sourceSize']
+
+    # Start reading at the byte before the offset so the first line that is read
+    # ends just before the first complete line at or after the offset.
+    if args['format'] == 'fasta':
+        numLines = 1
+    else:
+        numLines = 5
+    source = open_sequence_range(args, offset - 1, args['sourceSize'] - offset + 1)
+    try:
+        lines = stream_lines(source)
+        position = offset - 1 + len(next(lines))
+        window = list()
+        for line in lines:
+            window.append(line)
+            if len(window) == numLines:
+                if _is_record_start(args['format'], window, False):
+                    return position
+                position += len(window.pop(0))
+        while len(window) > 0:
+            if _is_record_start(args['format'], window, True):
+                return position
+            position += len(window.pop(0))
+    finally:
+        source.close()
+    return args['sourceSize']
+
+''' Extract sequences from a chunk of a sequence file.
+
+    The records that start in the chunk are extracted.  Both the start and end of
+    the nominal byte range of the chunk are moved to the start of a record with
+    find_record_start() so the chunks of a file cover every record exactly once.
+    The reads are sorted and written to the output file the same way as
+    extract_seq().
+
+    The args dictionary includes the same keys as split_sequence_file() plus:
+
+    chunkStart Offset in bytes of nominal start of chunk
+    chunkEnd Offset in bytes of nominal end of chunk
+
+    @param args Dictionary of argument values
+    @return Number of reads extracted from chunk
+'''
+
+def extract_chunk(args):
+    start = find_record_start(args, args['chunkStart'])
+    end = find_record_start(args, args['chunkEnd'])
+    if end > start:
+        source = open_sequence_range(args, start, end - start)
+    else:
+        source = FileRange(open(os.devnull, 'rb'), 0) # No records start in the chunk
+    try:
+        sequences = SequenceParsers[args['format']](stream_lines(source))
+        chunkArgs = dict(args)
+        chunkArgs['minReads'] = 0
+        return _write_sorted_reads(sequences, chunkArgs)
+    finally:
+        source.close()
+
+''' Combine the outputs of the chunks of a sequence file.
+
+    The sorted chunks are merged when there are enough reads and the chunk files
+    are removed.
+
+    The args dictionary includes the same keys as extract_seq() plus:
+
+    chunkFiles List of paths to output files from extract_chunk() in file order
+    numReads Total number of reads in the chunks
+
+    @param args Dictionary of argument values
+    @return 0 when successful
+'''
+
+def combine_chunks(args):
+    try:
+        if args['minReads'] == 0 or args['numReads'] >= args['minReads']:
+            _merge_sorted_files(args['chunkFiles'], args['destFile'], args.get('packed', False) and args['sequenceLen'] > 0, args['sequenceLen'])
+    finally:
+        for chunkFile in args['chunkFiles']:
+            if os.path.exists(chunkFile):
+                os.remove(chunkFile)
     return 0
 
+''' Trim sequences to a minimum length.
+
+    @param sequences Iterator of sequence strings
+    @param sequenceLen Length to trim to (0 means to not trim)
+    @return Iterator of trimmed sequences (sequences shorter than the length are skipped)
+'''
+
+def _trim_reads(sequences, sequenceLen):
+    if sequenceLen == 0:
+        return sequences
+    return ( seq[:sequenceLen] for seq in sequences if len(seq) >= sequenceLen )
+
+''' Sort sequences and write them to the output file.
+
+    The reads are sorted in memory and when the reads use more than the sort
+    memory, the sorted reads are spilled to a run file and the runs are merged at
+    the end.  No output file is written when there are not enough reads.
+
+    @param sequences Iterator of sequence strings
+    @param args Dictionary of argument values (see extract_seq())
+    @return Number of reads
+'''
+
+def _write_sorted_reads(sequences, args):
+    from biokbase.CompressionBasedDistance.Packed import pack_reads
+    numReads = 0
+    sequenceLen = args['sequenceLen']
+    maxReads = args['maxReads']
+    packed = args.get('packed', False) and sequenceLen > 0
+    reads = list()
+    readsMemory = 0
+    packedRows = list()
+    packedEscaped = list()
+    packedMemory = 0
+    runFiles = list()
+    try:
+        for seq in _trim_reads(sequences, sequenceLen):
+            reads.append(seq)
+            readsMemory += len(seq) + ReadMemoryOverhead
+            numReads += 1
+            if numReads == maxReads:
+                break
+            if packed and len(reads) == PackBlockReads:
+                rows, escaped = pack_reads(reads, sequenceLen)
+                packedRows.append(rows)
+                packedEscaped.extend(escaped)
+                packedMemory += rows.nbytes + len(escaped) * (sequenceLen + ReadMemoryOverhead)
+                reads = list()
+                readsMemory = 0
+            if readsMemory + packedMemory > args['sortMemory']:
+                runFiles.append('%s.run%d' %(args['destFile'], len(runFiles)))
+                if packed:
+                    _write_packed_run(reads, packedRows, packedEscaped, sequenceLen, runFiles[-1])
+                    packedRows = list()
+                    packedEscaped = list()
+                    packedMemory = 0
+                else:
+                    _write_sorted_run(reads, runFiles[-1])
+                reads = list()
+                readsMemory = 0
+    except:
+        for runFile in runFiles:
+            os.remove(runFile)
+        raise
+
+    # Skip the file if it does not have enough reads.
+    if args['minReads'] > 0 and numReads < args['minReads']:
+        for runFile in runFiles:
+            os.remove(runFile)
+        return numReads
+
+    # Write the sorted reads or merge the sorted runs.
+    if len(runFiles) == 0:
+        if packed:
+            _write_packed_run(reads, packedRows, packedEscaped, sequenceLen, args['destFile'])
+        else:
+            _write_sorted_run(reads, args['destFile'])
+        return numReads
+    runFiles.append('%s.run%d' %(args['destFile'], len(runFiles)))
+    if packed:
+        _write_packed_run(reads, packedRows, packedEscaped, sequenceLen, runFiles[-1])
+    else:
+        _write_sorted_run(reads, runFiles[-1])
+    del reads, packedRows, packedEscaped
+    _merge_sorted_files(runFiles, args['destFile'], packed, sequenceLen)
+    return numReads
+
+''' Merge sorted files into one sorted file and remove the input files.
+
+    @param paths List of paths to sorted files (text or packed)
+    @param destFile Path to output file
+    @param packed True to write a packed sorted file
+    @param length Length of reads when writing a packed sorted file
+    @return Nothing
+'''
+
+def _merge_sorted_files(paths, destFile, packed, length):
+    from biokbase.CompressionBasedDistance.Packed import write_packed_lines, sorted_lines
+    sources = [ sorted_lines(path) for path in paths ]
+    if packed:
+        write_packed_lines(destFile, length, heapq.merge(*sources))
+    else:
+        with open(destFile+'.tmp', 'wb') as f:
+            lines = list()
+            for line in heapq.merge(*sources):
+                lines.append(line)
+                if len(lines) == WriteBlockLines:
+                    f.write(''.join(lines))
+                    lines = list()
+            f.write(''.join(lines))
+        os.rename(destFile+'.tmp', destFile)
+    for source in sources:
+        source.close()
+    for path in paths:
+        os.remove(path)
+    return
+
+''' Sort reads and write them to a file.
+
+    Reads are sorted by byte value which is the same order as "sort" with LC_ALL=C
+    so sorted files can be merged by merge_compress_seq().  Like all of the
+    writers of sorted files, the reads are written to a temporary file that is
+    renamed to the output file so an output file that is linked to an entry in
+    the sample cache is replaced instead of overwritten.
+
+    @param reads List of reads (sorted in place)
+    @param path Path to output file
+    @return Nothing
+'''
+
+def _write_sorted_run(reads, path):
+    reads.sort()
+    with open(path+'.tmp', 'wb') as f:
+        for start in range(0, len(reads), WriteBlockLines):
+            block = reads[start:start+WriteBlockLines]
+            block.append('')
+            f.write('\n'.join(block))
+    os.rename(path+'.tmp', path)
+    return
+
+''' Pack and sort reads and write them to a packed sorted file.
+
+    @param reads List of reads that are not packed yet
+    @param packedRows List of arrays of packed reads
+    @param packedEscaped List of reads that could not be packed (sorted in place)
+    @param length Length of reads
+    @param path Path to output file
+    @return Nothing
+'''
+
+def _write_packed_run(reads, packedRows, packedEscaped, length, path):
+    import numpy
+    from biokbase.CompressionBasedDistance.Packed import pack_reads, sort_rows, write_packed
+    rows, escaped = pack_reads(reads, length)
+    packedRows.append(rows)
+    packedEscaped.extend(escaped)
+    packedEscaped.sort()
+    write_packed(path, length, sort_rows(numpy.concatenate(packedRows)), packedEscaped)
+    return
+
+''' Sink that compresses data and only counts the compressed bytes.
+
+    Data written to the sink is compressed in-process with liblzma using the
+    same settings as the xz command ("xz -9" or "xz -9e" for extreme
+    compression).  The compressed data is discarded so nothing is written to
+    disk and the final size matches the size of the .xz file created by a
+    single-threaded xz command.
+'''
+
+class CompressedSizeSink:
+
+    def __init__(self, extreme):
+        preset = 9
+        if extreme:
+            preset |= lzma.PRESET_EXTREME
+        self.compressor = lzma.LZMACompressor(format=lzma.FORMAT_XZ, check=lzma.CHECK_CRC64, preset=preset)
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(self.compressor.compress(data))
+        return
+
+    def close(self):
+        self.size += len(self.compressor.flush())
+        return self.size
+
+''' Calculate the compressed size of a sequence file.
+
+    The args dictionary includes the following keys:
+
+    sourceFile Path to input file with sorted sequence reads (text or packed)
+    extreme True to use extreme compression
+
+    @param args Dictionary of argument values
+    @return Size in bytes of compressed data
+'''
+
+def compress_seq(args):
+    from biokbase.CompressionBasedDistance.Packed import is_packed, packed_text_blocks
+    sink = CompressedSizeSink(args['extreme'])
+    if is_packed(args['sourceFile']):
+        for block in packed_text_blocks([ args['sourceFile'] ]):
+            sink.write(block)
+        return sink.close()
+    with open(args['sourceFile'], 'rb') as f:
+        while True:
+            data = f.read(ReadBlockSize)
+            if not data:
+                break
+            sink.write(data)
+    return sink.close()
+
+''' Calculate the compressed size of the merge of two sorted sequence files.
+
+    The two files are merged line by line and the merged reads are streamed
+    directly into the compressor so the merged file is never written to disk.
+    Both files must be sorted by byte value (i.e. sorted with LC_ALL=C) so the
+    merged reads are in the same order as "sort -m".  When both files are packed,
+    the memory mapped packed reads are merged a block at a time and the text is
+    only generated as it is fed to the compressor.
+
+    The args dictionary includes the following keys:
+
+    sourceFile1 Path to first input file with sorted sequence reads (text or packed)
+    sourceFile2 Path to second input file with sorted sequence reads (text or packed)
+    extreme True to use extreme compression
+
+    @param args Dictionary of argument values
+    @return Size in bytes of compressed data
+'''
+
+def merge_compress_seq(args):
+    from biokbase.CompressionBasedDistance.Packed import is_packed, packed_text_blocks, sorted_lines
+    sink = CompressedSizeSink(args['extreme'])
+    if is_packed(args['sourceFile1']) and is_packed(args['sourceFile2']):
+        for block in packed_text_blocks([ args['sourceFile1'], args['sourceFile2'] ]):
+            sink.write(block)
+        return sink.close()
+    lines = list()
+    for line in heapq.merge(sorted_lines(args['sourceFile1']), sorted_lines(args['sourceFile2'])):
+        lines.append(line)
+        if len(lines) == WriteBlockLines:
+            sink.write(''.join(lines))
+            lines = list()
+    sink.write(''.join(lines))
+    return sink.close()
+
 ''' Run a command in a new process.
 
     @param args List of arguments for command where the first element is the path to the command
+    @param env Dictionary of environment variables for command (None to use current environment)
     @raise CommandError: Error running command
     @raise OSError: Error starting command
     @return 0 when successful
 '''
 
-def run_command(args):
+def run_command(args, env=None):
     err = CommandError()
     try:
-        proc = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        proc = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE, env = env)
         (err.stdout, err.stderr) = proc.communicate()
         err.retcode = proc.returncode
         if err.retcode < 0:
@@ -241,7 +978,11 @@ def parse_input_file(inputPath):
             filename = fields[0]
             if os.path.isfile(filename):
                 fileList.append(filename)
-                ext = os.path.splitext(filename)[1].split('.')[-1]
+                # The format of a compressed file is from the extension before the compression extension.
+                if file_compression_type(filename) is not None:
+                    ext = os.path.splitext(strip_compression_extension(filename))[1].split('.')[-1]
+                else:
+                    ext = os.path.splitext(filename)[1].split('.')[-1]
                 extensions[ext] = 1
             else:
                 print "'%s' does not exist" %(filename)
@@ -262,11 +1003,16 @@ def parse_input_file(inputPath):
 
 def start_job(config, context, input):
     # Create a user and job state client and authenticate as the user.
+    from biokbase.userandjobstate.client import UserAndJobState
     ujsClient = UserAndJobState(config['userandjobstate_url'], token=context['token'])
 
     # Create a job to track building the distance matrix.
     status = 'initializing'
-    description = 'cbd-buildmatrix with %d files for user %s' %(len(input['node_ids'])+len(input['file_paths']), context['user_id'])
+    if 'sizes_node_id' in input:
+        command = 'cbd-extendmatrix'
+    else:
+        command = 'cbd-buildmatrix'
+    description = '%s with %d files for user %s' %(command, len(input['node_ids'])+len(input['file_paths']), context['user_id'])
     progress = { 'ptype': 'task', 'max': 6 }
     job_id = ujsClient.create_and_start_job(context['token'], status, description, progress, timestamp(3600))
 
@@ -281,6 +1027,13 @@ def start_job(config, context, input):
     jobData = { 'id': job_id, 'input': input, 'context': context, 'config': config }
     json.dump(jobData, open(jobDataFilename, "w"), indent=4)
 
+    # Add the job to the queue for the cbd-workerd daemon when there is a queue.
+    if config.get('job_queue_path', ''):
+        queue = JobQueue(config['job_queue_path'])
+        queue.add(job_id, context['user_id'], jobDataFilename)
+        queue.close()
+        return job_id
+
     # Start worker to run the job.
     jobScript = os.path.join(os.environ['KB_TOP'], 'bin/cbd-runjob')
     cmdline = "nohup %s %s >%s 2>%s &" %(jobScript, jobDataFilename, outputFilename, errorFilename)
@@ -112,3 +112,28 @@ the communities are completely different.
                              'job_id is not type basestring as required.')
         # return the results
         return [job_id]
+
+    def extend_matrix(self, ctx, input):
+        # ctx is the context object
+        # return variables are: job_id
+        #BEGIN extend_matrix
+        ''' Submit a job to extend a distance matrix with new sequence files.
+
+            @param ctx: Current context object
+            @param input: Dictionary of input variables (see spec file for valid keys)
+            @return Job ID
+        '''
+        
+        if 'file_paths' not in input:
+            input['file_paths'] = list()
+        job_id = start_job(self.config, ctx, input)
+        ctx.log_info('Started job '+job_id+' to extend a matrix')
+        
+        #END extend_matrix
+
+        # At some point might do deeper type checking...
+        if not isinstance(job_id, basestring):
+            raise ValueError('Method extend_matrix return value ' +
+                             'job_id is not type basestring as required.')
+        # return the results
+        return [job_id]
@@ -0,0 +1,136 @@
+import sqlite3
+import time
+
+# Number of seconds to wait for another process to release the job queue database.
+QueueDatabaseTimeout = 300
+
+''' Durable queue of jobs waiting to run on the system.
+
+    The server adds a job to the queue when the job is started and the cbd-workerd
+    daemon takes jobs from the queue and runs them.  The queue is a SQLite database
+    so a job is not lost when the server or the daemon is restarted.  A job stays in
+    the queue while it is running and is removed when it is done.
+
+    Jobs are taken from the queue with per-user fair share.  The next job is the
+    oldest queued job of the user with the fewest running jobs so a user that
+    submits a burst of jobs does not block the jobs of other users.
+
+    A job whose process died before the job was done is put back in the queue with
+    requeue() and the number of times each job was restarted is kept in the queue.
+'''
+
+class JobQueue:
+
+    ''' Initialize the queue.
+
+        @param databasePath Path to database file
+    '''
+
+    def __init__(self, databasePath):
+        self.db = sqlite3.connect(databasePath, timeout=QueueDatabaseTimeout, isolation_level=None)
+        self.db.execute('CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, user_id TEXT, job_data_path TEXT, ' +
+                        'submitted REAL, state TEXT, restarts INTEGER DEFAULT 0)')
+
+        # Add the restarts column to a queue created by an earlier version.
+        columns = [ row[1] for row in self.db.execute('PRAGMA table_info(jobs)') ]
+        if 'restarts' not in columns:
+            self.db.execute('ALTER TABLE jobs ADD COLUMN restarts INTEGER DEFAULT 0')
+
+    ''' Add a job to the queue.
+
+        @param jobId Job ID
+        @param userId User ID of owner of job
+        @param jobDataPath Path to job data file
+        @return Nothing
+    '''
+
+    def add(self, jobId, userId, jobDataPath):
+        self.db.execute("INSERT INTO jobs (job_id, user_id, job_data_path, submitted, state) VALUES (?, ?, ?, ?, 'queued')",
+                        (jobId, userId, jobDataPath, time.time()))
+        return
+
+    ''' Take the next job to run from the queue.
+
+        The job is marked as running and stays in the queue until finish() is called.
+
+        @param maxRunning Maximum number of jobs running on the system
+        @param maxUserRunning Maximum number of jobs running for one user (0 for no maximum)
+        @return Tuple with job ID and path to job data file or None if no job can run now
+    '''
+
+    def next_job(self, maxRunning, maxUserRunning):
+        # Hold a write lock so the counts do not change before the job is marked.
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            userRunning = dict()
+            for userId, count in self.db.execute("SELECT user_id, COUNT(*) FROM jobs WHERE state='running' GROUP BY user_id"):
+                userRunning[userId] = count
+            if sum(userRunning.values()) >= maxRunning:
+                return None
+
+            # Pick the oldest job of the user with the fewest running jobs.
+            bestJob = None
+            for jobId, userId, jobDataPath in self.db.execute("SELECT job_id, user_id, job_data_path FROM jobs WHERE state='queued' ORDER BY submitted"):
+                running = userRunning.get(userId, 0)
+                if maxUserRunning > 0 and running >= maxUserRunning:
+                    continue
+                if bestJob is None or running < bestJob[0]:
+                    bestJob = (running, jobId, jobDataPath)
+            if bestJob is None:
+                return None
+            self.db.execute("UPDATE jobs SET state='running' WHERE job_id=?", (bestJob[1],))
+            return (bestJob[1], bestJob[2])
+        finally:
+            self.db.execute('COMMIT')
+
+    ''' Remove a job from the queue when it is done.
+
+        @param jobId Job ID
+        @return Nothing
+    '''
+
+    def finish(self, jobId):
+        self.db.execute('DELETE FROM jobs WHERE job_id=?', (jobId,))
+        return
+
+    ''' Put a running job whose process died back in the queue.
+
+        The job keeps its place in the queue so it is the next job started for the user.
+
+        @param jobId Job ID
+        @return Number of times the job has been restarted including this time
+    '''
+
+    def requeue(self, jobId):
+        self.db.execute("UPDATE jobs SET state='queued', restarts=restarts+1 WHERE job_id=?", (jobId,))
+        row = self.db.execute('SELECT restarts FROM jobs WHERE job_id=?', (jobId,)).fetchone()
+        if row is None:
+            return 0
+        return row[0]
+
+    ''' Put the jobs that were running when the daemon stopped back in the queue.
+
+        @return Number of jobs put back in the queue
+    '''
+
+    def requeue_running(self):
+        cursor = self.db.execute("UPDATE jobs SET state='queued' WHERE state='running'")
+        return cursor.rowcount
+
+    ''' Get the number of queued and running jobs.
+
+        @return Tuple with number of queued jobs and number of running jobs
+    '''
+
+    def counts(self):
+        counts = dict(self.db.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+        return (counts.get('queued', 0), counts.get('running', 0))
+
+    ''' Close the queue.
+
+        @return Nothing
+    '''
+
+    def close(self):
+        self.db.close()
+        return
@@ -0,0 +1,111 @@
+import os
+import json
+
+# Name of journal file in the work directory of a job.
+JournalFileName = 'journal.log'
+
+''' Append-only journal of the completed units of work in a job.
+
+    Each line in the journal is a JSON list with the kind of event, the name of a
+    sample or pair, and a size.  The events are:
+
+    sorted    Sequence reads were extracted and sorted for a sample (size of sorted
+              file or None when the sample did not have the minimum number of reads)
+    size      Compressed size of a sample or pair was calculated (compressed size)
+
+    There is no event for extracting reads because the reads of a sample are
+    extracted and sorted by the same task (or by the chunk tasks and the task that
+    merges the chunks).  When a job is resumed, a sample whose sorted file still
+    has the recorded size is not extracted again and a recorded compressed size is
+    not calculated again.  A sample that was not sorted when the job was
+    interrupted is extracted again from the start of its input sequence file,
+    including all of its chunks.
+
+    Every line is flushed to disk before the journal returns so a job that is
+    interrupted can be resumed from the last completed unit of work.  When a job
+    is resumed, the journal is replayed and a line that was only partially written
+    when the job was interrupted is discarded.
+'''
+
+class Journal:
+
+    ''' Initialize the journal.
+
+        @param journalPath Path to journal file
+        @param resume True to replay an existing journal and append to it
+    '''
+
+    def __init__(self, journalPath, resume):
+        self.sorted = dict()
+        self.sizes = dict()
+        if resume and os.path.exists(journalPath):
+            self._replay(journalPath)
+            self.journalFile = open(journalPath, 'a')
+        else:
+            self.journalFile = open(journalPath, 'w')
+
+    ''' Record a completed unit of work.
+
+        @param event Kind of event ('sorted' or 'size')
+        @param name Name of sample or pair
+        @param size Size for event
+        @return Nothing
+    '''
+
+    def record(self, event, name, size):
+        self.journalFile.write(json.dumps([ event, name, size ]) + '\n')
+        self.journalFile.flush()
+        os.fsync(self.journalFile.fileno())
+        return
+
+    ''' Check if a file from a completed unit of work is still available.
+
+        @param event Kind of event ('sorted')
+        @param name Name of sample
+        @param path Path to file
+        @return True when the event is in the journal and the file has the recorded size
+    '''
+
+    def completed(self, event, name, path):
+        events = getattr(self, event)
+        if name not in events:
+            return False
+        if events[name] is None:
+            return not os.path.exists(path)
+        return os.path.exists(path) and os.path.getsize(path) == events[name]
+
+    ''' Close the journal.
+
+        @return Nothing
+    '''
+
+    def close(self):
+        self.journalFile.close()
+        return
+
+    ''' Replay the events in an existing journal.
+
+        @param journalPath Path to journal file
+        @return Nothing
+    '''
+
+    def _replay(self, journalPath):
+        validLength = 0
+        with open(journalPath, 'r') as f:
+            for line in f:
+                try:
+                    event, name, size = json.loads(line)
+                except ValueError:
+                    break # Partial line from an interrupted job
+                if not line.endswith('\n'):
+                    break
+                if event == 'sorted':
+                    self.sorted[name] = size
+                elif event == 'size':
+                    self.sizes[name] = size
+                validLength += len(line)
+
+        # Remove the partial line so new events start on a new line.
+        with open(journalPath, 'r+') as f:
+            f.truncate(validLength)
+        return
@@ -0,0 +1,288 @@
+import json
+import struct
+import numpy
+
+# Magic string at the start of a binary distance matrix file.
+BinaryMagic = 'CBDMAT01'
+
+# Format of the length of the JSON header that follows the magic string.
+HeaderLengthFormat = '<I'
+
+# Alignment in bytes of the start of the distance values.
+DataAlignment = 8
+
+# Types of values supported in a binary distance matrix file.
+BinaryValueTypes = { 'float64': '<f8', 'float32': '<f4' }
+
+''' Get the index of a pair of samples in a condensed distance matrix.
+
+    The condensed matrix is the upper triangle of the square matrix without the
+    diagonal in row order, which is the same layout used by scipy.spatial.distance.
+
+    @param numSamples Number of samples in matrix
+    @param i Index of first sample
+    @param j Index of second sample (must be greater than i)
+    @return Index in condensed matrix
+'''
+
+def condensed_index(numSamples, i, j):
+    return i * numSamples - (i * (i + 1)) // 2 + (j - i - 1)
+
+''' Write a distance matrix to a binary file.
+
+    The file has the magic string, the length of a JSON header, the JSON header
+    with the list of IDs and the type of the values, padding to align the values,
+    and then the condensed upper triangle of the matrix in little-endian order.
+
+    @param path Path to output file
+    @param idList List of IDs in the same order as the rows of the matrix
+    @param distances Square array of distance values
+    @param valueType Type of values in file ('float64' or 'float32')
+    @return Nothing
+'''
+
+def write_binary_matrix(path, idList, distances, valueType='float64'):
+    if valueType not in BinaryValueTypes:
+        raise ValueError("Value type '%s' is not supported for binary distance matrix files" %(valueType))
+    header = json.dumps({ 'ids': idList, 'dtype': BinaryValueTypes[valueType] })
+    prefixLength = len(BinaryMagic) + struct.calcsize(HeaderLengthFormat) + len(header)
+    header += ' ' * (-prefixLength % DataAlignment)
+    with open(path, 'wb') as f:
+        f.write(BinaryMagic + struct.pack(HeaderLengthFormat, len(header)) + header)
+        for row in range(len(idList) - 1):
+            f.write(numpy.asarray(distances[row, row+1:], dtype=BinaryValueTypes[valueType]).tostring())
+    return
+
+''' Check if a file is a binary distance matrix file.
+
+    @param path Path to distance matrix file
+    @return True when the file is a binary distance matrix file
+'''
+
+def is_binary_matrix(path):
+    with open(path, 'rb') as f:
+        return f.read(len(BinaryMagic)) == BinaryMagic
+
+''' Open a binary distance matrix file.
+
+    The distance values are memory mapped so the file opens almost instantly and
+    only the values that are used are read from disk.
+
+    @param path Path to binary distance matrix file
+    @raise ValueError: File is not a valid binary distance matrix file
+    @return Tuple with list of IDs and memory mapped condensed array of distance values
+'''
+
+def open_binary_matrix(path):
+    with open(path, 'rb') as f:
+        if f.read(len(BinaryMagic)) != BinaryMagic:
+            raise ValueError("File '%s' is not a binary distance matrix file" %(path))
+        lengthData = f.read(struct.calcsize(HeaderLengthFormat))
+        if len(lengthData) != struct.calcsize(HeaderLengthFormat):
+            raise ValueError("Binary distance matrix file '%s' is truncated" %(path))
+        headerLength = struct.unpack(HeaderLengthFormat, lengthData)[0]
+        try:
+            header = json.loads(f.read(headerLength))
+        except ValueError:
+            raise ValueError("Binary distance matrix file '%s' has an invalid header" %(path))
+        f.seek(0, 2)
+        fileSize = f.tell()
+    idList = [ str(id) for id in header['ids'] ]
+    dtype = numpy.dtype(str(header['dtype']))
+    offset = len(BinaryMagic) + struct.calcsize(HeaderLengthFormat) + headerLength
+    numValues = len(idList) * (len(idList) - 1) // 2
+    if fileSize != offset + numValues * dtype.itemsize:
+        raise ValueError("Binary distance matrix file '%s' has %d bytes of values but %d samples need %d bytes"
+                         %(path, fileSize - offset, len(idList), numValues * dtype.itemsize))
+    if numValues == 0:
+        return idList, numpy.zeros(0, dtype=dtype)
+    return idList, numpy.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(numValues,))
+
+''' Convert a condensed distance matrix to a square matrix.
+
+    @param condensed Condensed array of distance values
+    @param numSamples Number of samples in matrix
+    @param indices List of indices of samples to include or None for all samples
+    @return Square array of distance values
+'''
+
+def condensed_to_square(condensed, numSamples, indices=None):
+    if indices is None:
+        # The values of a row are contiguous when all of the samples are included.
+        square = numpy.zeros((numSamples, numSamples), dtype=float)
+        for i in range(numSamples - 1):
+            start = condensed_index(numSamples, i, i + 1)
+            square[i, i+1:] = condensed[start:start+numSamples-i-1]
+            square[i+1:, i] = square[i, i+1:]
+        return square
+    indices = numpy.asarray(indices, dtype=numpy.int64)
+    square = numpy.zeros((len(indices), len(indices)), dtype=float)
+    for row in range(len(indices) - 1):
+        others = indices[row+1:]
+        low = numpy.minimum(others, indices[row])
+        high = numpy.maximum(others, indices[row])
+        square[row, row+1:] = condensed[low * numSamples - (low * (low + 1)) // 2 + (high - low - 1)]
+        square[row+1:, row] = square[row, row+1:]
+    return square
+
+''' Load a distance matrix from a csv or binary file in condensed form.
+
+    The values in a binary file are memory mapped and are not copied.  The values
+    in a csv file are parsed a row at a time directly into the condensed array so
+    the square matrix is never in memory.  The values below the diagonal in each
+    row are checked against the values already saved from the earlier rows.
+
+    @param path Path to distance matrix file
+    @raise IOError: Error opening the file
+    @raise ValueError: File is not a valid distance matrix
+    @return Tuple with list of IDs and condensed array of distance values
+'''
+
+def load_condensed_matrix(path):
+    if is_binary_matrix(path):
+        return open_binary_matrix(path)
+    with open(path, 'r') as f:
+        idList = _read_csv_ids(f, path)
+        numSamples = len(idList)
+        condensed = numpy.zeros(numSamples * (numSamples - 1) // 2, dtype=float)
+        rowStart = condensed_index(numSamples, numpy.arange(numSamples, dtype=numpy.int64), numpy.arange(numSamples, dtype=numpy.int64) + 1)
+        for row, rowId, values in _csv_rows(f, path, idList):
+            if row > 0:
+                earlier = condensed[rowStart[:row] + (row - numpy.arange(row) - 1)]
+                if not numpy.allclose(values[:row], earlier, equal_nan=True):
+                    raise ValueError("Distance matrix file '%s' is not symmetric" %(path))
+            condensed[rowStart[row]:rowStart[row]+numSamples-row-1] = values[row+1:]
+    return idList, condensed
+
+''' Load a distance matrix from a csv or binary file.
+
+    A binary file is detected from the magic string at the start of the file and
+    its values are memory mapped.  The values in a csv file are parsed a row at a
+    time in bulk.  The matrix must be square with the same IDs in the rows and
+    columns and must be symmetric.
+
+    @param path Path to distance matrix file
+    @param ids List of IDs to load or None to load all of the IDs
+    @raise IOError: Error opening the file
+    @raise ValueError: File is not a valid distance matrix or an ID is not in the matrix
+    @return Tuple with list of IDs and square array of distance values
+'''
+
+def load_matrix(path, ids=None):
+    if is_binary_matrix(path):
+        idList, condensed = open_binary_matrix(path)
+        if ids is None:
+            return idList, condensed_to_square(condensed, len(idList))
+        return list(ids), condensed_to_square(condensed, len(idList), _id_indices(idList, ids, path))
+    idList, distances = _load_csv_matrix(path, ids)
+    _check_symmetric(distances, path)
+    return idList, distances
+
+''' Get the indices of a list of IDs in a distance matrix.
+
+    @param idList List of IDs in distance matrix
+    @param ids List of IDs to find
+    @param path Path to distance matrix file for error messages
+    @raise ValueError: An ID is not in the matrix or is repeated
+    @return List of indices
+'''
+
+def _id_indices(idList, ids, path):
+    idToIndex = dict(zip(idList, range(len(idList))))
+    if len(set(ids)) != len(ids):
+        raise ValueError('List of IDs to load has duplicate IDs')
+    for id in ids:
+        if id not in idToIndex:
+            raise ValueError("ID '%s' is not in distance matrix file '%s'" %(id, path))
+    return [ idToIndex[id] for id in ids ]
+
+''' Load a distance matrix from a csv file.
+
+    @param path Path to csv file
+    @param ids List of IDs to load or None to load all of the IDs
+    @raise ValueError: File is not a valid distance matrix or an ID is not in the matrix
+    @return Tuple with list of IDs and square array of distance values
+'''
+
+def _load_csv_matrix(path, ids):
+    with open(path, 'r') as f:
+        idList = _read_csv_ids(f, path)
+        if ids is None:
+            columns = None
+            ids = idList
+        else:
+            columns = _id_indices(idList, ids, path)
+        rowIndex = dict(zip(ids, range(len(ids))))
+
+        # Keep the rows and columns that are selected.
+        distances = numpy.zeros((len(ids), len(ids)), dtype=float)
+        for row, rowId, values in _csv_rows(f, path, idList, rowIndex):
+            if columns is None:
+                distances[rowIndex[rowId]] = values
+            else:
+                distances[rowIndex[rowId]] = values[columns]
+    return list(ids), distances
+
+''' Read the list of IDs from the first line of a csv file.
+
+    @param f File object positioned at the start of the file
+    @param path Path to csv file for error messages
+    @raise ValueError: First line is not a valid header
+    @return List of IDs
+'''
+
+def _read_csv_ids(f, path):
+    idList = f.readline().rstrip('\n\r').split(',')
+    if idList[0] != 'ID':
+        raise ValueError("Distance matrix file '%s' does not start with an 'ID' column" %(path))
+    idList.pop(0)
+    return idList
+
+''' Parse the rows of a csv file in bulk.
+
+    The ID of each row must match the ID of the column with the same index.
+
+    @param f File object positioned after the header line
+    @param path Path to csv file for error messages
+    @param idList List of IDs from the header line
+    @param rowIds Collection of IDs of the rows to parse or None to parse all of the rows
+    @raise ValueError: File is not a valid distance matrix
+    @return Generator of tuples with row index, row ID, and array of values
+'''
+
+def _csv_rows(f, path, idList, rowIds=None):
+    numSamples = len(idList)
+    row = 0
+    for line in f:
+        line = line.rstrip('\n\r')
+        if not line:
+            continue
+        if row >= numSamples:
+            raise ValueError("Distance matrix file '%s' has more rows than columns" %(path))
+        rowId, values = line.split(',', 1) if ',' in line else (line, '')
+        if rowId != idList[row]:
+            raise ValueError("Row %d of distance matrix file '%s' has ID '%s' but column %d has ID '%s'" %(row + 1, path, rowId, row + 1, idList[row]))
+        row += 1
+        if rowIds is not None and rowId not in rowIds:
+            continue
+        values = numpy.fromstring(values, dtype=float, sep=',')
+        if len(values) != numSamples:
+            raise ValueError("Row %d of distance matrix file '%s' has %d values but there are %d IDs" %(row, path, len(values), numSamples))
+        yield row - 1, rowId, values
+    if row != numSamples:
+        raise ValueError("Distance matrix file '%s' has %d rows but there are %d IDs" %(path, row, numSamples))
+
+''' Check that a distance matrix is symmetric.
+
+    @param distances Square array of distance values
+    @param path Path to distance matrix file for error messages
+    @raise ValueError: Distance matrix is not symmetric
+    @return Nothing
+'''
+
+def _check_symmetric(distances, path):
+    for start in range(0, distances.shape[0], 256):
+        end = min(start + 256, distances.shape[0])
+        if not numpy.allclose(distances[start:end], distances[:, start:end].T, equal_nan=True):
+            raise ValueError("Distance matrix file '%s' is not symmetric" %(path))
+    return
@@ -0,0 +1,324 @@
+import heapq
+import os
+import struct
+import numpy
+
+# Magic string at the start of a packed sorted file.
+PackedMagic = 'CBDPACK1'
+
+# Format of the header of a packed sorted file after the magic string with the
+# read length, number of packed reads, and number of escaped reads.
+HeaderFormat = '<QQQ'
+
+# Size in bytes of the header of a packed sorted file.
+HeaderSize = len(PackedMagic) + struct.calcsize(HeaderFormat)
+
+# Number of reads to decode to text at a time.
+DecodeBlockReads = 65536
+
+# Bases in order of their 2-bit codes.  The codes are in the same order as the
+# byte values of the bases so packed reads sort in the same order as text reads.
+Bases = 'ACGT'
+
+# Table to convert a byte value to the 2-bit code of a base (255 for bytes that
+# are not one of the bases).
+BaseCodes = numpy.empty(256, dtype=numpy.uint8)
+BaseCodes.fill(255)
+for _code, _base in enumerate(Bases):
+    BaseCodes[ord(_base)] = _code
+
+# Table to convert a packed byte to the text of the four bases in the byte.
+DecodeTable = numpy.array([ [ ord(Bases[(value >> shift) & 3]) for shift in (6, 4, 2, 0) ] for value in range(256) ], dtype=numpy.uint8)
+
+''' Pack reads of the same length with 2 bits for each base.
+
+    Reads with a character other than A, C, G, or T (for example N or another
+    IUPAC code) cannot be packed and are returned as escaped reads.  Four bases
+    are packed in each byte with the first base in the high bits so comparing
+    packed reads byte by byte gives the same order as comparing the text.
+
+    @param reads List of reads that all have the specified length
+    @param length Length of reads
+    @return Tuple with array of packed reads (one row per read) and list of escaped reads
+'''
+
+def pack_reads(reads, length):
+    numReads = len(reads)
+    width = (length + 3) // 4
+    if numReads == 0:
+        return numpy.empty((0, width), dtype=numpy.uint8), list()
+    codes = BaseCodes[numpy.frombuffer(''.join(reads), dtype=numpy.uint8).reshape(numReads, length)]
+    escapedRows = (codes == 255).any(axis=1)
+    escaped = list()
+    if escapedRows.any():
+        escaped = [ reads[index] for index in numpy.flatnonzero(escapedRows) ]
+        codes = codes[~escapedRows]
+    padded = numpy.zeros((codes.shape[0], width * 4), dtype=numpy.uint8)
+    padded[:, :length] = codes
+    padded = padded.reshape(codes.shape[0], width, 4)
+    rows = (padded[:, :, 0] << 6) | (padded[:, :, 1] << 4) | (padded[:, :, 2] << 2) | padded[:, :, 3]
+    return rows, escaped
+
+''' Sort packed reads.
+
+    Each row is viewed as a single opaque value so numpy compares the rows byte by
+    byte, which is the same order as comparing the text of the reads.
+
+    @param rows Array of packed reads
+    @return Array of packed reads in sorted order
+'''
+
+def sort_rows(rows):
+    numRows, width = rows.shape
+    if numRows < 2:
+        return rows
+    values = numpy.ascontiguousarray(rows).view('V%d' %(width)).ravel()
+    return numpy.sort(values).view(numpy.uint8).reshape(numRows, width)
+
+''' Decode packed reads to text.
+
+    @param rows Array of packed reads
+    @param length Length of reads
+    @return String with one read on each line
+'''
+
+def decode_rows(rows, length):
+    text = numpy.empty((rows.shape[0], length + 1), dtype=numpy.uint8)
+    text[:, :length] = DecodeTable[rows].reshape(rows.shape[0], -1)[:, :length]
+    text[:, length] = ord('\n')
+    return text.tostring()
+
+''' Write sorted packed reads to a file.
+
+    The file has a header followed by the packed reads and then the escaped reads
+    with one read on each line.  The file is written to a temporary file that is
+    renamed to the output file so a file linked from the sample cache is replaced
+    instead of overwritten.
+
+    @param path Path to output file
+    @param length Length of reads
+    @param rows Array of packed reads in sorted order
+    @param escaped List of escaped reads in sorted order
+    @return Nothing
+'''
+
+def write_packed(path, length, rows, escaped):
+    with open(path+'.tmp', 'wb') as f:
+        f.write(PackedMagic + struct.pack(HeaderFormat, length, rows.shape[0], len(escaped)))
+        f.write(rows.tostring())
+        for read in escaped:
+            f.write(read + '\n')
+    os.rename(path+'.tmp', path)
+    return
+
+''' Write sorted text reads to a packed file.
+
+    The reads are packed in blocks so the reads do not need to fit in memory.  The
+    file is replaced the same way as write_packed().
+
+    @param path Path to output file
+    @param length Length of reads
+    @param lines Iterator of reads in sorted order with one read on each line
+    @return Nothing
+'''
+
+def write_packed_lines(path, length, lines):
+    numPacked = 0
+    escaped = list()
+    with open(path+'.tmp', 'wb') as f:
+        f.write('\0' * HeaderSize) # Header is written when the number of reads is known
+        reads = list()
+        for line in lines:
+            reads.append(line[:-1])
+            if len(reads) == DecodeBlockReads:
+                rows, blockEscaped = pack_reads(reads, length)
+                f.write(rows.tostring())
+                numPacked += rows.shape[0]
+                escaped.extend(blockEscaped)
+                reads = list()
+        rows, blockEscaped = pack_reads(reads, length)
+        f.write(rows.tostring())
+        numPacked += rows.shape[0]
+        escaped.extend(blockEscaped)
+        for read in escaped:
+            f.write(read + '\n')
+        f.seek(0)
+        f.write(PackedMagic + struct.pack(HeaderFormat, length, numPacked, len(escaped)))
+    os.rename(path+'.tmp', path)
+    return
+
+''' Check if a sorted file is packed.
+
+    @param path Path to sorted file
+    @return True when the file is packed
+'''
+
+def is_packed(path):
+    with open(path, 'rb') as f:
+        return f.read(len(PackedMagic)) == PackedMagic
+
+''' Sorted reads from a packed file.
+
+    The packed reads are memory mapped so only the parts of the file that are
+    used are read into memory.
+'''
+
+class PackedFile:
+
+    ''' Open a packed file.
+
+        @param path Path to packed file
+        @raise ValueError: File is not a packed sorted file
+    '''
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            header = f.read(HeaderSize)
+            if len(header) != HeaderSize or header[:len(PackedMagic)] != PackedMagic:
+                raise ValueError("File '%s' is not a packed sorted file" %(path))
+            self.length, numPacked, numEscaped = struct.unpack(HeaderFormat, header[len(PackedMagic):])
+            width = (self.length + 3) // 4
+            if numPacked > 0:
+                self.rows = numpy.memmap(path, dtype=numpy.uint8, mode='r', offset=HeaderSize, shape=(numPacked, width))
+            else:
+                self.rows = numpy.empty((0, width), dtype=numpy.uint8)
+            f.seek(HeaderSize + numPacked * width)
+            self.escaped = f.read().splitlines(True)
+
+    ''' Get the size of the reads as text.
+
+        @return Size in bytes of the reads with one read on each line
+    '''
+
+    def text_size(self):
+        return self.rows.shape[0] * (self.length + 1) + sum([ len(line) for line in self.escaped ])
+
+''' Get the size of the reads in a sorted file as text.
+
+    @param path Path to sorted file
+    @return Size in bytes of the reads with one read on each line
+'''
+
+def text_size(path):
+    if is_packed(path):
+        return PackedFile(path).text_size()
+    return os.path.getsize(path)
+
+''' Iterate over the reads in packed files as text in sorted order.
+
+    When all of the reads are packed the text is generated in large blocks.
+    Otherwise the packed reads are merged line by line with the escaped reads.
+
+    @param paths List of paths to packed files with reads of the same length
+    @raise ValueError: Packed files have different read lengths
+    @return Generator of strings with one read on each line
+'''
+
+def packed_text_blocks(paths):
+    files = [ PackedFile(path) for path in paths ]
+    length = files[0].length
+    for packedFile in files:
+        if packedFile.length != length:
+            raise ValueError('Packed files have reads with different lengths')
+    blocks = _merge_rows([ packedFile.rows for packedFile in files ])
+    escaped = list(heapq.merge(*[ packedFile.escaped for packedFile in files ]))
+    del files
+
+    # Generate the text in blocks when there are no escaped reads.
+    if len(escaped) == 0:
+        for rows in blocks:
+            yield decode_rows(rows, length)
+        return
+
+    # Merge the packed reads with the escaped reads.
+    lines = list()
+    for line in heapq.merge(_packed_lines(blocks, length), escaped):
+        lines.append(line)
+        if len(lines) == DecodeBlockReads:
+            yield ''.join(lines)
+            lines = list()
+    yield ''.join(lines)
+
+''' Merge arrays of sorted packed reads a block at a time.
+
+    A block of reads is taken from each array and all of the reads up to the
+    smallest last read of the blocks are merged and returned.  Those are all of
+    the reads up to that value in every array, so the merged blocks are in sorted
+    order.  Only one block from each array is in memory at a time and the arrays
+    are memory mapped so the merge never holds all of the reads.
+
+    @param rowsList List of arrays of packed reads in sorted order
+    @return Generator of arrays of packed reads in sorted order
+'''
+
+def _merge_rows(rowsList):
+    width = rowsList[0].shape[1]
+    if len(rowsList) == 1:
+        for start in range(0, rowsList[0].shape[0], DecodeBlockReads):
+            yield rowsList[0][start:start+DecodeBlockReads]
+        return
+
+    # Each row is viewed as a single opaque value so the rows can be compared and searched.
+    values = [ numpy.ascontiguousarray(rows).view('V%d' %(width)).ravel() for rows in rowsList if rows.shape[0] > 0 ]
+    offsets = [ 0 ] * len(values)
+    while len(values) > 0:
+        blocks = [ values[index][offsets[index]:offsets[index]+DecodeBlockReads] for index in range(len(values)) ]
+        cutoff = numpy.sort(numpy.concatenate([ block[-1:] for block in blocks ]))[0]
+        merged = None
+        for index in range(len(values)):
+            count = numpy.searchsorted(blocks[index], cutoff, 'right')
+            offsets[index] += count
+            if merged is None:
+                merged = blocks[index][:count]
+            else:
+                merged = _merge_values(merged, blocks[index][:count])
+        yield merged.view(numpy.uint8).reshape(merged.shape[0], width)
+
+        # Stop merging the arrays that have no more reads.
+        remaining = [ index for index in range(len(values)) if offsets[index] < values[index].shape[0] ]
+        values = [ values[index] for index in remaining ]
+        offsets = [ offsets[index] for index in remaining ]
+    return
+
+''' Merge two sorted arrays of packed reads viewed as opaque values.
+
+    @param first Array of values in sorted order
+    @param second Array of values in sorted order
+    @return Array with all of the values in sorted order
+'''
+
+def _merge_values(first, second):
+    if second.shape[0] == 0:
+        return first
+    # Each value from the second array goes after the values from the first array that are not larger.
+    positions = numpy.searchsorted(first, second, 'right') + numpy.arange(second.shape[0])
+    merged = numpy.empty(first.shape[0] + second.shape[0], dtype=first.dtype)
+    fromSecond = numpy.zeros(merged.shape[0], dtype=bool)
+    fromSecond[positions] = True
+    merged[positions] = second
+    merged[~fromSecond] = first
+    return merged
+
+''' Iterate over packed reads as lines of text.
+
+    @param blocks Iterator of arrays of packed reads in sorted order
+    @param length Length of reads
+    @return Generator of reads with one read on each line
+'''
+
+def _packed_lines(blocks, length):
+    for rows in blocks:
+        for line in decode_rows(rows, length).splitlines(True):
+            yield line
+
+''' Iterate over the reads in a sorted file as lines of text.
+
+    @param path Path to sorted file (packed or text)
+    @return Iterator of reads with one read on each line
+'''
+
+def sorted_lines(path):
+    if is_packed(path):
+        packedFile = PackedFile(path)
+        return heapq.merge(_packed_lines(_merge_rows([ packedFile.rows ]), packedFile.length), packedFile.escaped)
+    return open(path, 'rb')
@@ -0,0 +1,64 @@
+import numpy
+
+# Largest number of samples where all of the eigenvalues are computed with a dense
+# solver.  Larger matrices use a partial solver that only finds the top eigenvalues.
+DenseEigenLimit = 500
+
+# Number of rows of the matrix that are centered at a time.
+CenterBlockRows = 256
+
+''' Compute the coordinates of samples with classical multidimensional scaling.
+
+    The squared distances are double centered and the coordinates are the top
+    eigenvectors scaled by the square root of their eigenvalues, which is the
+    same as the cmdscale() function in R.  The distance matrix is updated in place
+    when overwrite is True so no other square array is needed.  For large matrices
+    only the top eigenvalues are found with the Lanczos method so each iteration
+    costs one product of the matrix and a vector.  The sign of each coordinate is
+    chosen so the largest value is positive.
+
+    @param distances Square array of distance values
+    @param numDimensions Number of dimensions for coordinates
+    @param overwrite True to use the distance array as working space
+    @return Tuple with array of coordinates (one row per sample) and array of eigenvalues
+'''
+
+def classical_mds(distances, numDimensions=2, overwrite=False):
+    numSamples = distances.shape[0]
+    if overwrite and distances.dtype == numpy.float64:
+        centered = distances
+    else:
+        centered = numpy.array(distances, dtype=numpy.float64)
+
+    # Double center the squared distances.
+    numpy.square(centered, out=centered)
+    rowMeans = centered.mean(axis=1)
+    grandMean = rowMeans.mean()
+    for start in range(0, numSamples, CenterBlockRows):
+        end = min(start + CenterBlockRows, numSamples)
+        block = centered[start:end]
+        block -= rowMeans[start:end, numpy.newaxis]
+        block -= rowMeans
+        block += grandMean
+        block *= -0.5
+
+    # Find the top eigenvalues and eigenvectors.
+    numFound = min(numDimensions, numSamples)
+    if numSamples <= DenseEigenLimit or numFound >= numSamples - 1:
+        eigenvalues, eigenvectors = numpy.linalg.eigh(centered)
+    else:
+        from scipy.sparse.linalg import eigsh # Only needed for large matrices
+        start = numpy.random.RandomState(1).uniform(-1.0, 1.0, numSamples)
+        eigenvalues, eigenvectors = eigsh(centered, k=numFound, which='LA', v0=start)
+    order = numpy.argsort(eigenvalues)[::-1][:numFound]
+    eigenvalues = eigenvalues[order]
+    eigenvectors = eigenvectors[:, order]
+
+    # Scale the eigenvectors to get the coordinates.
+    coordinates = numpy.zeros((numSamples, numDimensions), dtype=numpy.float64)
+    coordinates[:, :numFound] = eigenvectors * numpy.sqrt(numpy.maximum(eigenvalues, 0.0))
+    for dimension in range(numFound):
+        column = coordinates[:, dimension]
+        if column[numpy.abs(column).argmax()] < 0:
+            column *= -1.0
+    return coordinates, eigenvalues
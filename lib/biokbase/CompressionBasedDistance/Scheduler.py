@@ -0,0 +1,402 @@
+import os
+import errno
+import fcntl
+import heapq
+import Queue
+import time
+from biokbase.CompressionBasedDistance.Helpers import CommandError
+
+# Number of tasks submitted to the process pool for each process in the pool.
+TasksPerProcess = 2
+
+# Estimated number of input bytes processed per second by each kind of task.
+TaskThroughput = { 'checksum': 200.0e6, 'extract': 5.0e6, 'combine': 20.0e6, 'compress': 2.0e6, 'merge': 2.0e6 }
+
+# Factor applied to the estimated time of compression tasks when using extreme compression.
+ExtremeFactor = 1.5
+
+# Memory in bytes used by the xz compressor for each byte of the dictionary.  The
+# dictionary for "xz -9" is 64 MiB and the compressor needs about 674 MiB.
+XzMemoryPerByte = 10.5
+
+# Size in bytes of the dictionary for "xz -9" and "xz -9e".
+XzDictionarySize = 64 * 1024 * 1024
+
+# Estimated memory in bytes used by a merge task for each byte of input data in the
+# blocks of reads that are merged and decoded at one time.
+MergeMemoryPerByte = 2.0
+
+# Maximum memory in bytes used by a merge task for the blocks of reads.  A block of
+# 65536 reads is taken from each file so the blocks are bounded for reads up to
+# about 300 bases.
+MergeBlockMemory = 128 * 1024 * 1024
+
+# Estimated memory in bytes used by a task in addition to the task's data.
+TaskBaseMemory = 32 * 1024 * 1024
+
+# Number of seconds to wait before checking again if a task can be admitted.
+AdmissionInterval = 5
+
+# Order for running each kind of task.  Checksum, extract, and combine tasks run first
+# because the compress and merge tasks depend on them.
+TaskStage = { 'checksum': 0, 'extract': 0, 'combine': 0, 'compress': 1, 'merge': 1 }
+
+# Exception returned in place of an exception from a failed task
+class TaskError(Exception):
+    pass
+
+''' Copy an exception from a task into an exception that can be pickled.
+
+    The result of a task is pickled to send it back from the pool process and an
+    exception that cannot be pickled or unpickled (for example urllib2.HTTPError)
+    stops the pool from calling the callback for the task.  A CommandError is
+    copied with its details and all other exceptions are replaced by a TaskError
+    with the name of the exception class and the message.
+
+    @param e Exception raised by a task function
+    @return CommandError or TaskError with only string values
+'''
+
+def portable_exception(e):
+    if isinstance(e, CommandError):
+        err = CommandError()
+        err.message = str(getattr(e, 'message', ''))
+        err.cmd = str(getattr(e, 'cmd', ''))
+        err.stdout = str(getattr(e, 'stdout', ''))
+        err.stderr = str(getattr(e, 'stderr', ''))
+        err.retcode = getattr(e, 'retcode', 255)
+        return err
+    try:
+        message = str(e)
+    except Exception:
+        message = repr(e)
+    return TaskError('%s: %s' %(e.__class__.__name__, message))
+
+''' Run a task function in a pool process.
+
+    Exceptions are returned instead of raised so the scheduler is always notified
+    when a task finishes.
+
+    @param func Task function
+    @param args Tuple of arguments for task function
+    @return Tuple with success flag, return value or exception, and elapsed time in seconds
+'''
+
+def run_task(func, args):
+    start = time.time()
+    try:
+        value = func(*args)
+        return (True, value, time.time() - start)
+    except Exception as e:
+        return (False, portable_exception(e), time.time() - start)
+
+''' Estimate the time in seconds to run a task.
+
+    @param kind Kind of task ('checksum', 'extract', 'combine', 'compress', or 'merge')
+    @param size Number of bytes of input data for task
+    @param extreme True when using extreme compression
+    @return Estimated time in seconds
+'''
+
+def estimate_cost(kind, size, extreme):
+    cost = size / TaskThroughput[kind]
+    if extreme and (kind == 'compress' or kind == 'merge'):
+        cost *= ExtremeFactor
+    return cost
+
+''' Estimate the memory in bytes used by a task.
+
+    @param kind Kind of task ('checksum', 'extract', 'combine', 'compress', or 'merge')
+    @param size Number of bytes of input data for task
+    @param extreme True when using extreme compression
+    @param sortMemory Maximum memory in bytes for sorting reads in an extract task
+    @return Estimated memory in bytes
+'''
+
+def estimate_memory(kind, size, extreme, sortMemory):
+    if kind == 'compress' or kind == 'merge':
+        # The compressor only touches as much of the dictionary as there is input data.
+        memory = int(XzMemoryPerByte * min(size, XzDictionarySize)) + TaskBaseMemory
+        if kind == 'merge':
+            # The sorted files are merged a block of reads at a time.
+            memory += int(min(MergeMemoryPerByte * size, MergeBlockMemory))
+        return memory
+    if kind == 'checksum':
+        # The input file is read in small blocks.
+        return TaskBaseMemory
+    # The extracted reads are sorted in memory until they reach the sort memory.
+    return int(min(1.5 * size, sortMemory)) + TaskBaseMemory
+
+''' Limit the memory used by tasks across all jobs running on the system.
+
+    Each admitted task has a reservation for its estimated memory in a ledger file
+    that is shared by all of the jobs on the system.  Access to the ledger is
+    serialized by locking the file.  Reservations from processes that are no longer
+    running are removed so a job that was killed does not hold memory forever.  A
+    task is always admitted when there are no other reservations so a task that is
+    larger than the budget can still run by itself.
+'''
+
+class MemoryLimiter:
+
+    ''' Initialize the limiter.
+
+        @param ledgerPath Path to ledger file with memory reservations
+        @param budget Maximum memory in bytes for all tasks on the system
+    '''
+
+    def __init__(self, ledgerPath, budget):
+        self.ledgerPath = ledgerPath
+        self.budget = budget
+        self.pid = os.getpid()
+        self.sequence = 0
+        self.reservations = set()
+
+    ''' Reserve memory for a task if there is enough memory available.
+
+        @param amount Memory in bytes needed by task
+        @return Reservation ID or None if there is not enough memory available
+    '''
+
+    def acquire(self, amount):
+        with open(self.ledgerPath, 'a+') as ledger:
+            fcntl.flock(ledger, fcntl.LOCK_EX)
+            entries = self._read(ledger)
+            used = sum([ entry[2] for entry in entries ])
+            if used > 0 and used + amount > self.budget:
+                return None
+            self.sequence += 1
+            reservation = '%d-%d' %(self.pid, self.sequence)
+            entries.append( (self.pid, reservation, amount) )
+            self._write(ledger, entries)
+        self.reservations.add(reservation)
+        return reservation
+
+    ''' Release the memory reserved for a task.
+
+        @param reservation Reservation ID returned by acquire()
+        @return Nothing
+    '''
+
+    def release(self, reservation):
+        with open(self.ledgerPath, 'a+') as ledger:
+            fcntl.flock(ledger, fcntl.LOCK_EX)
+            entries = [ entry for entry in self._read(ledger) if entry[1] != reservation ]
+            self._write(ledger, entries)
+        self.reservations.discard(reservation)
+        return
+
+    ''' Release all of the memory reserved by this limiter.
+
+        @return Nothing
+    '''
+
+    def release_all(self):
+        for reservation in list(self.reservations):
+            self.release(reservation)
+        return
+
+    ''' Read the reservations from the ledger and remove reservations from dead processes.
+
+        @param ledger Ledger file object (caller must hold the lock)
+        @return List of tuples with process ID, reservation ID, and amount
+    '''
+
+    def _read(self, ledger):
+        ledger.seek(0)
+        entries = list()
+        for line in ledger:
+            fields = line.split()
+            if len(fields) != 3:
+                continue
+            pid = int(fields[0])
+            if pid != self.pid and not _pid_exists(pid):
+                continue
+            entries.append( (pid, fields[1], int(fields[2])) )
+        return entries
+
+    ''' Replace the reservations in the ledger.
+
+        @param ledger Ledger file object (caller must hold the lock)
+        @param entries List of tuples with process ID, reservation ID, and amount
+        @return Nothing
+    '''
+
+    def _write(self, ledger, entries):
+        ledger.seek(0)
+        ledger.truncate()
+        for pid, reservation, amount in entries:
+            ledger.write('%d %s %d\n' %(pid, reservation, amount))
+        ledger.flush()
+        return
+
+''' Check if a process is running.
+
+    @param pid Process ID
+    @return True when the process is running
+'''
+
+def _pid_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+''' A unit of work for the scheduler. '''
+
+class Task:
+
+    def __init__(self, kind, name, func, args, onDone, onError, cost, memory):
+        self.kind = kind
+        self.name = name
+        self.func = func
+        self.args = args
+        self.onDone = onDone
+        self.onError = onError
+        self.cost = cost
+        self.memory = memory
+        self.reservation = None
+
+''' Schedule dependent tasks on a process pool.
+
+    Tasks are run as soon as they are submitted instead of in global stages.  When
+    a task finishes its onDone function is called with the return value of the task
+    and it can submit the tasks that depend on the result.  Only a bounded number
+    of tasks are submitted to the pool at one time and the rest wait in a queue.
+
+    Waiting tasks are run longest processing time first using the estimated cost
+    of each task so the largest tasks do not end up in a long tail at the end of a
+    job.  The estimated and actual time of every task are recorded so the cost
+    model can be checked.  When there is a memory limiter, a task is only
+    submitted to the pool after memory is reserved for it.
+
+    When a task fails, its onError function is called with the exception which
+    usually raises an exception to stop the scheduler.
+'''
+
+class TaskScheduler:
+
+    ''' Initialize the scheduler.
+
+        @param pool Process pool for running tasks
+        @param numProcesses Number of processes in process pool
+        @param extreme True when using extreme compression
+        @param sortMemory Maximum memory in bytes for sorting reads in an extract task
+        @param limiter Memory limiter for admitting tasks or None for no limit
+    '''
+
+    def __init__(self, pool, numProcesses, extreme, sortMemory, limiter=None):
+        self.pool = pool
+        self.extreme = extreme
+        self.sortMemory = sortMemory
+        self.limiter = limiter
+        self.maxInFlight = numProcesses * TasksPerProcess
+        self.ready = list()
+        self.sequence = 0
+        self.inFlight = 0
+        self.finished = Queue.Queue()
+        self.history = list()
+
+    ''' Submit a task to run when there is room in the process pool.
+
+        @param kind Kind of task ('checksum', 'extract', 'combine', 'compress', or 'merge')
+        @param name Name of task for messages
+        @param func Task function which must be picklable
+        @param args Tuple of arguments for task function
+        @param onDone Function called with return value when task is successful
+        @param onError Function called with exception when task failed
+        @param size Number of bytes of input data for task
+        @return Nothing
+    '''
+
+    def submit(self, kind, name, func, args, onDone, onError, size):
+        # The sequence number keeps the order stable for tasks with the same cost.
+        task = Task(kind, name, func, args, onDone, onError,
+                    estimate_cost(kind, size, self.extreme), estimate_memory(kind, size, self.extreme, self.sortMemory))
+        heapq.heappush(self.ready, (TaskStage[kind], -task.cost, self.sequence, task))
+        self.sequence += 1
+        self._dispatch()
+        return
+
+    ''' Run tasks until all submitted tasks and the tasks they submit are done.
+
+        @return Nothing
+    '''
+
+    def run(self):
+        while self.inFlight > 0 or len(self.ready) > 0:
+            # When waiting for memory to be available, check again after an interval.
+            try:
+                if self.inFlight == 0:
+                    time.sleep(AdmissionInterval)
+                    raise Queue.Empty
+                task, (success, value, elapsed) = self.finished.get(True, AdmissionInterval)
+            except Queue.Empty:
+                self._dispatch()
+                continue
+            self.inFlight -= 1
+            if task.reservation is not None:
+                self.limiter.release(task.reservation)
+            self.history.append( (task.kind, task.name, task.cost, elapsed) )
+            if success:
+                task.onDone(value)
+            else:
+                task.onError(value)
+            self._dispatch()
+        return
+
+    ''' Summarize the estimated and actual time of the finished tasks.
+
+        @return Dictionary keyed by kind of task with tuple of number of tasks, estimated time, and actual time
+    '''
+
+    def summary(self):
+        totals = dict()
+        for kind, name, cost, elapsed in self.history:
+            count, estimated, actual = totals.get(kind, (0, 0.0, 0.0))
+            totals[kind] = (count + 1, estimated + cost, actual + elapsed)
+        return totals
+
+    ''' Save the estimated and actual time of the finished tasks to a file.
+
+        @param path Path to output file in tab delimited format
+        @return Nothing
+    '''
+
+    def save_history(self, path):
+        with open(path, 'w') as f:
+            f.write('kind\tname\testimated\tactual\n')
+            for kind, name, cost, elapsed in self.history:
+                f.write('%s\t%s\t%f\t%f\n' %(kind, name, cost, elapsed))
+        return
+
+    ''' Submit waiting tasks to the process pool up to the limit.
+
+        @return Nothing
+    '''
+
+    def _dispatch(self):
+        while self.inFlight < self.maxInFlight and len(self.ready) > 0:
+            # Keep the order of the tasks by waiting when the next task is not admitted.
+            task = self.ready[0][3]
+            if self.limiter is not None:
+                task.reservation = self.limiter.acquire(task.memory)
+                if task.reservation is None:
+                    break
+            heapq.heappop(self.ready)
+            self.pool.apply_async(run_task, (task.func, task.args), callback=self._callback(task))
+            self.inFlight += 1
+        return
+
+    ''' Build the callback that queues the result of a task for the scheduler.
+
+        @note The callback runs in the result handler thread of the process pool.
+        @param task Task that was submitted
+        @return Callback function
+    '''
+
+    def _callback(self, task):
+        def callback(result):
+            self.finished.put( (task, result) )
+        return callback
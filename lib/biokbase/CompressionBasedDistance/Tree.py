@@ -0,0 +1,357 @@
+import numpy
+from biokbase.CompressionBasedDistance.Matrix import condensed_to_square
+
+# Width of each level of a tree drawn as ASCII art.
+ArtLevelWidth = 10
+
+# Number of rows of the Q matrix computed at a time for neighbor joining.
+QBlockRows = 64
+
+# Characters that require a name to be quoted in a Newick string.
+NewickSpecialChars = set(" \t\n()[]':;,")
+
+''' A node in a tree built from a distance matrix.
+
+    Leaf nodes have the sample ID as the name and internal nodes have no name.
+    The length is the length of the branch from the parent node.  The tree is
+    traversed without recursion so deep trees with thousands of samples can be
+    converted to text.
+'''
+
+class TreeNode:
+
+    ''' Initialize the node.
+
+        @param name Name of node or None for an internal node
+        @param children List of child nodes
+        @param length Length of branch from parent node or None for the root
+    '''
+
+    def __init__(self, name=None, children=None, length=None):
+        self.name = name
+        self.children = children if children is not None else list()
+        self.length = length
+
+    ''' Get the tree rooted at this node in Newick format.
+
+        @return String with tree in Newick format
+    '''
+
+    def newick(self):
+        parts = list()
+        stack = [ self ]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, str):
+                parts.append(item)
+            elif item.children:
+                parts.append('(')
+                stack.append(')' + item._newickLabel())
+                for index in range(len(item.children) - 1, -1, -1):
+                    stack.append(item.children[index])
+                    if index > 0:
+                        stack.append(',')
+            else:
+                parts.append(item._newickLabel())
+        return ''.join(parts) + ';'
+
+    ''' Get the tree rooted at this node drawn as ASCII art.
+
+        The drawing has the same layout as the asciiArt() method of PyCogent trees
+        which were used before the tree was built from arrays.  The number of lines
+        used by each node and the position of its stem are found from the bottom of
+        the tree up and then each node adds its part of the prefix of every line
+        from the top of the tree down.
+
+        @return String with tree drawn as ASCII art
+    '''
+
+    def ascii_art(self):
+        # Find the number of lines and the line with the stem of each node.
+        numLines = dict()
+        stemLine = dict()
+        childStart = dict()
+        for node in self._postorder():
+            if not node.children:
+                numLines[id(node)] = 1
+                stemLine[id(node)] = 0
+                continue
+            starts = list()
+            start = 0
+            for child in node.children:
+                starts.append(start)
+                start += numLines[id(child)] + 1 # Children are separated by an empty line
+            numLines[id(node)] = start - 1
+            childStart[id(node)] = starts
+            first = starts[0] + stemLine[id(node.children[0])]
+            last = starts[-1] + stemLine[id(node.children[-1])]
+            stemLine[id(node)] = (first + last) // 2
+
+        # Add the part of each line drawn by each node starting from the root.
+        pad = ' ' * ArtLevelWidth
+        bar = ' ' * (ArtLevelWidth - 1) + '|'
+        lines = [ list() for index in range(numLines[id(self)]) ]
+        stack = [ (self, 0, '-') ]
+        while stack:
+            node, start, char = stack.pop()
+            if not node.children:
+                lines[start].append(char + '-' + (node.name or ''))
+                continue
+            starts = childStart[id(node)]
+            first = starts[0] + stemLine[id(node.children[0])]
+            last = starts[-1] + stemLine[id(node.children[-1])]
+            mid = stemLine[id(node)]
+            for line in range(numLines[id(node)]):
+                prefix = bar if first < line < last else pad
+                if line == mid:
+                    prefix = char + '-' * (ArtLevelWidth - 2) + prefix[-1]
+                lines[start + line].append(prefix)
+            for index in range(len(node.children)):
+                if index == 0:
+                    childChar = '/'
+                elif index == len(node.children) - 1:
+                    childChar = '\\'
+                else:
+                    childChar = '-'
+                stack.append( (node.children[index], start + starts[index], childChar) )
+        return '\n'.join([ ''.join(line) for line in lines ])
+
+    ''' Get the label of the node in a Newick string.
+
+        @return String with name and branch length
+    '''
+
+    def _newickLabel(self):
+        label = ''
+        if self.name is not None:
+            if NewickSpecialChars.intersection(self.name):
+                label = "'" + self.name.replace("'", "''") + "'"
+            else:
+                label = self.name
+        if self.length is not None:
+            label += ':%g' %(self.length)
+        return label
+
+    ''' Get the nodes of the tree with the children before the parent.
+
+        @return List of nodes
+    '''
+
+    def _postorder(self):
+        nodes = list()
+        stack = [ self ]
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            stack.extend(node.children)
+        nodes.reverse()
+        return nodes
+
+''' Build a tree from a linkage matrix.
+
+    The height of each internal node is the distance in the linkage matrix times
+    the height factor and the length of each branch is the difference between the
+    heights of the parent and the child.
+
+    @param linkageMatrix Linkage matrix in the format used by scipy.cluster.hierarchy
+    @param idList List of IDs in the same order as the distance matrix
+    @param heightFactor Factor to convert a distance to the height of a node
+    @return TreeNode at the root of the tree
+'''
+
+def tree_from_linkage(linkageMatrix, idList, heightFactor=0.5):
+    nodes = [ TreeNode(name=id) for id in idList ]
+    heights = [ 0.0 ] * len(idList)
+    for first, second, distance, count in linkageMatrix.tolist():
+        height = distance * heightFactor
+        children = [ nodes[int(first)], nodes[int(second)] ]
+        children[0].length = height - heights[int(first)]
+        children[1].length = height - heights[int(second)]
+        nodes.append(TreeNode(children=children))
+        heights.append(height)
+    return nodes[-1]
+
+''' Build the linkage matrix for UPGMA clustering of a condensed distance matrix.
+
+    The clusters are found with the nearest-neighbor chain algorithm which does
+    O(N^2) work and updates a copy of the condensed matrix in place.  The distance
+    from the merged cluster to every other cluster is the average of the distances
+    weighted by the size of the clusters.
+
+    @param condensed Condensed array of distance values
+    @param numSamples Number of samples in matrix
+    @raise ValueError: Distance matrix has no samples
+    @return Linkage matrix in the format used by scipy.cluster.hierarchy
+'''
+
+def upgma_linkage(condensed, numSamples):
+    if numSamples < 1:
+        raise ValueError('Distance matrix has no samples')
+    distances = numpy.array(condensed, dtype=numpy.float64)
+    slots = numpy.arange(numSamples, dtype=numpy.int64)
+    # Index in the condensed array of the pair (i, j) with i < j is rowStart[i] + j.
+    rowStart = slots * numSamples - (slots * (slots + 1)) // 2 - slots - 1
+    sizes = numpy.ones(numSamples)
+    active = slots.copy()
+    merges = list()
+    chain = list()
+
+    while len(active) > 1:
+        if len(chain) == 0:
+            chain.append(int(active[0]))
+
+        # Follow the chain of nearest neighbors until two clusters are each
+        # other's nearest neighbor.
+        while True:
+            x = chain[-1]
+            others = active[active != x]
+            indices = numpy.where(others < x, rowStart[others] + x, rowStart[x] + others)
+            values = distances[indices]
+            best = int(values.argmin())
+            y = int(others[best])
+            distance = values[best]
+            if len(chain) > 1:
+                previous = chain[-2]
+                previousDistance = distances[rowStart[min(x, previous)] + max(x, previous)]
+                if previousDistance <= distance:
+                    y = previous
+                    distance = previousDistance
+                    break
+            chain.append(y)
+        chain.pop()
+        chain.pop()
+
+        # Merge cluster x into cluster y and update the distances to cluster y.
+        others = active[(active != x) & (active != y)]
+        xIndices = numpy.where(others < x, rowStart[others] + x, rowStart[x] + others)
+        yIndices = numpy.where(others < y, rowStart[others] + y, rowStart[y] + others)
+        distances[yIndices] = (sizes[x] * distances[xIndices] + sizes[y] * distances[yIndices]) / (sizes[x] + sizes[y])
+        sizes[y] += sizes[x]
+        active = active[active != x]
+        merges.append( (x, y, distance, sizes[y]) )
+
+    return _label_merges(merges, numSamples)
+
+''' Convert a list of merges to a linkage matrix.
+
+    The merges are sorted by distance and each cluster is given the label used
+    in a linkage matrix by scipy.cluster.hierarchy where the samples are numbered
+    from 0 to N-1 and the cluster made by the k-th merge is numbered N+k.
+
+    @param merges List of tuples with the samples in two clusters, distance, and size
+    @param numSamples Number of samples in matrix
+    @return Linkage matrix
+'''
+
+def _label_merges(merges, numSamples):
+    linkageMatrix = numpy.zeros((len(merges), 4), dtype=numpy.float64)
+    parent = range(2 * numSamples - 1)
+
+    def find(label):
+        root = label
+        while parent[root] != root:
+            root = parent[root]
+        while parent[label] != root:
+            parent[label], label = root, parent[label]
+        return root
+
+    order = sorted(range(len(merges)), key=lambda index: merges[index][2])
+    for row in range(len(order)):
+        x, y, distance, size = merges[order[row]]
+        first = find(x)
+        second = find(y)
+        linkageMatrix[row] = [ min(first, second), max(first, second), distance, size ]
+        parent[first] = parent[second] = numSamples + row
+    return linkageMatrix
+
+''' Build a tree with UPGMA clustering of a condensed distance matrix.
+
+    @param idList List of IDs in the same order as the distance matrix
+    @param condensed Condensed array of distance values
+    @raise ValueError: Distance matrix has no samples
+    @return TreeNode at the root of the tree
+'''
+
+def upgma(idList, condensed):
+    return tree_from_linkage(upgma_linkage(condensed, len(idList)), idList)
+
+''' Build a tree with neighbor joining of a condensed distance matrix.
+
+    The active clusters are kept in the leading rows and columns of a square
+    working array so the Q matrix for each step is computed with a few vectorized
+    operations on blocks of rows.  When two clusters are joined the new
+    cluster takes the place of the first one and the last active cluster is moved
+    into the place of the second one.  The tree is unrooted with the last three
+    clusters joined at the root.
+
+    @param idList List of IDs in the same order as the distance matrix
+    @param condensed Condensed array of distance values
+    @raise ValueError: Distance matrix has no samples
+    @return TreeNode at the root of the tree
+'''
+
+def nj(idList, condensed):
+    numSamples = len(idList)
+    if numSamples < 1:
+        raise ValueError('Distance matrix has no samples')
+    nodes = [ TreeNode(name=id) for id in idList ]
+    if numSamples == 1:
+        return nodes[0]
+    distances = condensed_to_square(condensed, numSamples)
+    if numSamples == 2:
+        nodes[0].length = nodes[1].length = distances[0,1] / 2.0
+        return TreeNode(children=nodes)
+
+    rowSums = distances.sum(axis=1)
+    qBuffer = numpy.empty(QBlockRows * numSamples, dtype=numpy.float64)
+    lowerTriangle = numpy.tri(QBlockRows, QBlockRows, dtype=bool)
+    num = numSamples
+    while num > 3:
+        # Find the pair of clusters with the smallest value in the upper triangle
+        # of the Q matrix.  The Q matrix is computed in blocks of rows so the
+        # working values stay in the cache.
+        active = distances[:num, :num]
+        bestValue = numpy.inf
+        for start in range(0, num - 1, QBlockRows):
+            end = min(start + QBlockRows, num - 1)
+            q = qBuffer[:(end - start) * (num - start)].reshape(end - start, num - start)
+            numpy.multiply(active[start:end, start:], num - 2, out=q)
+            q -= rowSums[start:end, numpy.newaxis]
+            q -= rowSums[start:num]
+            numpy.putmask(q[:, :end-start], lowerTriangle[:end-start, :end-start], numpy.inf) # Skip the diagonal and lower triangle
+            index = q.argmin()
+            if q.flat[index] < bestValue:
+                bestValue = q.flat[index]
+                i = start + index // (num - start)
+                j = start + index % (num - start)
+
+        # Join the two clusters.
+        distance = active[i, j]
+        nodes[i].length = 0.5 * distance + (rowSums[i] - rowSums[j]) / (2.0 * (num - 2))
+        nodes[j].length = distance - nodes[i].length
+        joined = 0.5 * (active[i] + active[j] - distance)
+        joined[i] = joined[j] = 0.0
+        rowSums[:num] += joined - active[:, i] - active[:, j]
+        rowSums[i] = joined.sum()
+        active[i, :] = joined
+        active[:, i] = joined
+        nodes[i] = TreeNode(children=[ nodes[i], nodes[j] ])
+
+        # Move the last active cluster into the place of the second cluster.
+        last = num - 1
+        if j != last:
+            active[j, :] = active[last, :]
+            active[:, j] = active[:, last]
+            active[j, j] = 0.0
+            rowSums[j] = rowSums[last]
+            nodes[j] = nodes[last]
+        num -= 1
+
+    # Join the last three clusters at the root.
+    d01 = distances[0,1]
+    d02 = distances[0,2]
+    d12 = distances[1,2]
+    nodes[0].length = 0.5 * (d01 + d02 - d12)
+    nodes[1].length = 0.5 * (d01 + d12 - d02)
+    nodes[2].length = 0.5 * (d02 + d12 - d01)
+    return TreeNode(children=nodes[:3])
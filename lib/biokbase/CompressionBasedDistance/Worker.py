@@ -3,23 +3,35 @@ import numpy
 import shutil
 import json
 from shock import Client as ShockClient
-from biokbase.CompressionBasedDistance.Helpers import extract_seq, run_command, make_job_dir, timestamp, CommandError
+from biokbase.CompressionBasedDistance.Helpers import extract_seq, split_sequence_file, extract_chunk, combine_chunks, compress_seq, merge_compress_seq, make_job_dir, timestamp, strip_compression_extension, CommandError, PairSeparator
+from biokbase.CompressionBasedDistance.Cache import SampleCache, PairSizeCache, sample_key, file_checksum, cached_size
+from biokbase.CompressionBasedDistance.Scheduler import TaskScheduler, MemoryLimiter
+from biokbase.CompressionBasedDistance.Journal import Journal, JournalFileName
+from biokbase.CompressionBasedDistance.Packed import text_size
+from biokbase.CompressionBasedDistance.Matrix import write_binary_matrix
 from biokbase.userandjobstate.client import UserAndJobState
 from multiprocessing import Pool
-from itertools import combinations
 from biokbase import log
 
-# String used to separate components in paired file names.
-PairSeparator = '-cbdpair-'
+# Default maximum memory in MB for sorting the reads of a sample in memory.
+DefaultSortMemory = 1024
+
+# Default size in MB of the chunks of a large sequence file that are extracted in parallel.
+DefaultExtractChunkSize = 1024
+
+# Number of rows of the distance matrix to calculate and write at a time.
+RowBlockSize = 256
+
+# Number of pair sizes to add to the array of pair sizes at a time.
+PairBlockSize = 1000000
+
+# Number of rows of pair sizes to write to the compressed sizes file at a time.
+SizesBlockRows = 64
 
 # Exception thrown when extract sequences failed
 class ExtractError(Exception):
     pass
 
-# Exception thrown when sorting a sequence file failed
-class SortError(Exception):
-    pass
-
 # Exception thrown when merging sequence files failed
 class MergeError(Exception):
     pass
@@ -36,64 +48,106 @@ class SeqLenError(Exception):
 class ShockError(Exception):
     pass
 
+# Exception thrown when the compressed sizes from a previous job cannot be used.
+class SizesError(Exception):
+    pass
+
+# Input variables that must match the previous job when extending a distance matrix.
+SizesSettings = [ 'sequence_length', 'max_reads', 'extreme' ]
+
 class CompressionBasedDistance:
     
+    ''' Convert compressed sizes keyed by file name to arrays indexed by sample number.
+
+        The samples are numbered in sorted order of their names.  A job saves its
+        compressed sizes straight into the arrays so this is only used when the
+        sizes are found from the names of compressed files.
+
+        @param sizes Dictionary mapping file names to compressed sizes, names of pairs contain PairSeparator
+        @return Tuple with list of sample names, array of compressed sizes of samples, and square
+                array of compressed sizes of pairs (NaN when a pair does not have a size)
+    '''
+
+    def _sizeArrays(self, sizes):
+        names = sorted([ name for name in sizes if PairSeparator not in name ])
+        indices = dict(zip(names, range(len(names))))
+        singleSizes = numpy.array([ sizes[name] for name in names ], dtype=float)
+
+        # Fill in the pair sizes in blocks to limit the memory used by the index lists.
+        pairSizes = numpy.empty((len(names), len(names)), dtype=float)
+        pairSizes.fill(numpy.nan)
+        rows = list()
+        columns = list()
+        values = list()
+        for name in sizes:
+            if PairSeparator in name:
+                name1, name2 = name.split(PairSeparator)
+                rows.append(indices[name1])
+                columns.append(indices[name2])
+                values.append(sizes[name])
+                if len(values) == PairBlockSize:
+                    pairSizes[rows, columns] = values
+                    pairSizes[columns, rows] = values
+                    rows = list()
+                    columns = list()
+                    values = list()
+        pairSizes[rows, columns] = values
+        pairSizes[columns, rows] = values
+        return names, singleSizes, pairSizes
+
     ''' Calculate the compression based distance metric and save distance matrix to a file.
 
-        @param fileList List of paths to compressed files
+        The distances are calculated in place in blocks of rows so the only large array
+        is the array of pair sizes.  All of the distances are checked before the output
+        file is written.
+
+        @param names List of sample names
+        @param singleSizes Array of compressed sizes of samples
+        @param pairSizes Square array of compressed sizes of pairs (NaN when a pair does not have a size),
+                         the array is replaced with the distance values
         @param scale Scale of distance values, 'std' for 0 to 1, 'inf' for 0 to infinity
         @param outputFile Path to file with output distance matrix
+        @param binaryFile Path to file with output binary distance matrix or None to not write it
+        @param valueType Type of values in binary distance matrix ('float64' or 'float32')
+        @raise ValueError: A distance is greater than 1.0
         @return Nothing
     '''
 
-    def _cbdCalculator(self, fileList, scale, outputFile):
-        # Parse the files.
-        single_sizes = dict()
-        pair_sizes = dict()
-        
-        for sourceFile in fileList:
-            # Should strip prefix too
-            fbase = os.path.basename(sourceFile)
-            # This works as long as '.sorted.xz' only occurs at the end of the path.
-            fname = fbase.replace('.sorted.xz', '')
-            if PairSeparator in fname:
-                pair_sizes[fname] = os.path.getsize(sourceFile)
-            else:
-                single_sizes[fname] = os.path.getsize(sourceFile)
-
-        # Map file names to indices.
-        fnames = single_sizes.keys()
-        fnames.sort()
-        indices = dict()
-        
-        for name,i in zip(fnames, range(len(fnames))):
-            indices[name] = i
-        
+    def _cbdCalculator(self, names, singleSizes, pairSizes, scale, outputFile, binaryFile=None, valueType='float64'):
         # Compute the distance scores.
-        pair_names = pair_sizes.keys()
-        cbd_array = numpy.zeros((len(fnames), len(fnames)), dtype=float)
-        for pair in pair_names:
-            name1, name2 = pair.split(PairSeparator)
-            c1 = float(single_sizes[name1])
-            c2 = float(single_sizes[name2])
-            c12 = float(pair_sizes[pair])
-            distance = 1.0 - ( 2.0 * ( (c1 + c2 - c12) / (c1 + c2) ) )
-            if distance > 1.0:
-                part1 = "Distance %f is greater than 1.0.  " %(distance)
+        numSamples = len(names)
+        for start in range(0, numSamples, RowBlockSize):
+            end = min(start + RowBlockSize, numSamples)
+            total = singleSizes[start:end, numpy.newaxis] + singleSizes[numpy.newaxis, :]
+            distance = 1.0 - ( 2.0 * ( (total - pairSizes[start:end]) / total ) )
+            with numpy.errstate(invalid='ignore'):
+                invalid = numpy.flatnonzero(distance > 1.0)
+            if len(invalid) > 0:
+                i, j = sorted([ start + invalid[0] // numSamples, invalid[0] % numSamples ])
+                pair = '%s%s%s' %(names[i], PairSeparator, names[j])
+                part1 = "Distance %f is greater than 1.0.  " %(distance.flat[invalid[0]])
                 part2 = "Check sequence read lengths and relative number of sequence reads.  "
-                part3 = "(c1=%f %s, c2=%f %s c12=%f %s)" %(c1, name1, c2, name2, c12, pair)
+                part3 = "(c1=%f %s, c2=%f %s c12=%f %s)" %(singleSizes[i], names[i], singleSizes[j], names[j], pairSizes[i, j], pair)
                 raise ValueError(part1+part2+part3)
             if scale == 'inf':
-                distance = distance/(1.0 - distance)
-            cbd_array[indices[name1],indices[name2]] = distance
-            cbd_array[indices[name2],indices[name1]] = distance
-            
-        # Build the output file in CSV format.
+                with numpy.errstate(divide='ignore'):
+                    distance = distance/(1.0 - distance)
+            distance[numpy.isnan(distance)] = 0.0 # Diagonal and pairs without a size
+            pairSizes[start:end] = distance
+        distances = pairSizes
+
+        # Build the output file in CSV format a block of rows at a time.
+        rowFormat = ','.join([ '%g' ] * numSamples) + '\n'
         outf = open(outputFile, 'w')
-        outf.write('ID,' + ','.join(fnames) + '\n')
-        for i in range(len(fnames)):
-             outf.write(fnames[i] + ',' + ','.join(['{0:g}'.format(x) for x in cbd_array[i,:]]) + '\n')
+        outf.write('ID,' + ','.join(names) + '\n')
+        for start in range(0, numSamples, RowBlockSize):
+            end = min(start + RowBlockSize, numSamples)
+            outf.write(''.join([ names[i] + ',' + rowFormat %tuple(distances[i].tolist()) for i in range(start, end) ]))
         outf.close()
+
+        # Build the binary file with the condensed distance matrix.
+        if binaryFile is not None:
+            write_binary_matrix(binaryFile, names, distances, valueType)
         return
     
     ''' Cleanup after running a job.
@@ -109,13 +163,27 @@ class CompressionBasedDistance:
                 self.shockClient.delete_node(nodeId)
             except Exception as e:
                 self._log(log.ERR, 'Error deleting node %s from Shock: %s' %(nodeId, e.message))
+        if 'sizes_node_id' in self.input:
+            try:
+                self.shockClient.delete_node(self.input['sizes_node_id'])
+            except Exception as e:
+                self._log(log.ERR, 'Error deleting node %s from Shock: %s' %(self.input['sizes_node_id'], e.message))
             
         # Remove the work directory.
+        self.journal.close()
         shutil.rmtree(self.jobDirectory)
             
         # Stop the process pool.
         self.pool.close()
         self.pool.join()
+
+        # Release the memory reserved for tasks that did not finish.
+        if self.limiter is not None:
+            self.limiter.release_all()
+
+        # Close the cache of pair sizes.
+        if self.pairCache is not None:
+            self.pairCache.close()
         
         return
     
@@ -138,24 +206,431 @@ class CompressionBasedDistance:
                                 self.context['method'], self.context['call_id'])
         return
 
+    ''' Load the compressed sizes saved by a previous job.
+
+        @param sizesFile Path to file with compressed sizes from a previous job
+        @raise SizesError: Error with the compressed sizes file or settings
+        @return Tuple with dictionary mapping file names to compressed sizes and dictionary mapping sample names to checksums
+    '''
+
+    def _loadSizes(self, sizesFile):
+        try:
+            previous = json.load(open(sizesFile, 'r'))
+        except Exception as e:
+            raise SizesError("Error loading compressed sizes file: %s" %(e))
+
+        # The compressed sizes are only valid for the same extraction and compression settings.
+        for key in SizesSettings:
+            if key not in previous or previous[key] != self.input[key]:
+                raise SizesError("Value of '%s' does not match the value used to compute the compressed sizes" %(key))
+        return previous['sizes'], previous.get('checksums', dict())
+
+    ''' Save the compressed sizes so a later job can extend the distance matrix.
+
+        The file is a JSON object with the settings used to compute the sizes, a
+        dictionary mapping sample names to the checksums of the input sequence files,
+        and a dictionary mapping file names to compressed sizes.  The dictionary of
+        sizes is written a block of rows at a time so the sizes are never in a
+        dictionary in memory.
+
+        @param names List of sample names
+        @param singleSizes Array of compressed sizes of samples
+        @param pairSizes Square array of compressed sizes of pairs
+        @param sizesFile Path to output file with compressed sizes
+        @return Nothing
+    '''
+
+    def _saveSizes(self, names, singleSizes, pairSizes, sizesFile):
+        quoted = [ json.dumps(name) for name in names ]
+        with open(sizesFile, 'w') as f:
+            f.write('{')
+            for key in SizesSettings:
+                f.write('%s: %s, ' %(json.dumps(key), json.dumps(self.input[key])))
+            checksums = dict([ (name, self.sampleChecksums[name]) for name in names if name in self.sampleChecksums ])
+            f.write('"checksums": %s, ' %(json.dumps(checksums)))
+            f.write('"sizes": {')
+            f.write(', '.join([ '%s: %d' %(quoted[i], singleSizes[i]) for i in range(len(names)) ]))
+            for start in range(0, len(names), SizesBlockRows):
+                entries = list()
+                for i in range(start, min(start + SizesBlockRows, len(names))):
+                    prefix = quoted[i][:-1] + PairSeparator
+                    row = pairSizes[i].tolist()
+                    entries.extend([ '%s%s: %d' %(prefix, quoted[j][1:], row[j]) for j in range(i + 1, len(names)) if row[j] == row[j] ])
+                if len(entries) > 0:
+                    f.write(', ' + ', '.join(entries))
+            f.write('}}')
+        return
+
+    ''' Save the checksum that identifies the contents of a sample.
+
+        The checksum is saved in the compressed sizes file and is used for the key of
+        the sample in the caches.  When the checksum does not match the checksum of
+        the sample with the same name in the previous job, the compressed sizes of the
+        sample from the previous job are not used.
+
+        @param checksum Checksum of input sequence file (None when not available)
+        @param sequenceFile Path to file with extracted sequence reads for sample
+        @return Nothing
+    '''
+
+    def _setSampleKey(self, checksum, sequenceFile):
+        if checksum is not None:
+            name = os.path.splitext(os.path.basename(sequenceFile))[0]
+            self.sampleChecksums[name] = checksum
+            if self.useKeys:
+                self.sampleKeys[name] = sample_key(checksum, self.input)
+            if name in self.previousChecksums and self.previousChecksums[name] != checksum:
+                self._log(log.WARNING, 'Contents of sample %s do not match the previous job so its compressed sizes are calculated again' %(name))
+                self.changedSamples.add(name)
+        return
+
+    ''' Get a compressed size calculated before the job started.
+
+        A size recorded in the journal of a resumed job is always used.  A size from
+        the previous job is only used when none of the samples changed.
+
+        @param name Name of sample or pair
+        @param sampleNames List of names of samples in the sample or pair
+        @return Size in bytes of compressed data or None if size is not available
+    '''
+
+    def _previousSize(self, name, sampleNames):
+        if name in self.journal.sizes:
+            return self.journal.sizes[name]
+        if name in self.previousSizes:
+            for sampleName in sampleNames:
+                if sampleName in self.changedSamples:
+                    return None
+            return self.previousSizes[name]
+        return None
+
+    ''' Get the sorted sequence reads for a sample from the cache.
+
+        @param sequenceFile Path to file with extracted sequence reads for sample
+        @return True when the sample was found in the cache
+    '''
+
+    def _getCachedSample(self, sequenceFile):
+        name = os.path.splitext(os.path.basename(sequenceFile))[0]
+        if self.sampleCache is None or name not in self.sampleKeys:
+            return False
+        sortedFile = '%s.sorted' %(os.path.splitext(sequenceFile)[0])
+        try:
+            cachedSizes = self.sampleCache.get(self.sampleKeys[name], sortedFile)
+        except Exception as e:
+            self._log(log.WARNING, 'Error getting sample %s from cache: %s' %(name, e))
+            return False
+        if cachedSizes is None:
+            return False
+        size = cached_size(cachedSizes, self.input['extreme'])
+        if size is not None:
+            self.cachedSizes[name] = size
+        return True
+
+    ''' Build a function that raises an exception for a failed task.
+
+        @param errorClass Class of exception to raise
+        @param message Description of the task that failed
+        @return Function called with the exception from the task
+    '''
+
+    def _taskError(self, errorClass, message):
+        def onError(e):
+            if isinstance(e, CommandError):
+                raise errorClass("%s: %s\nCommand: '%s'\nStdout: '%s'\nStderr: '%s'" %(message, e.message, e.cmd, e.stdout, e.stderr))
+            raise errorClass("%s: %s" %(message, e))
+        return onError
+
+    ''' Add a sample to the job.
+
+        The sorted sequence reads are taken from the journal of a resumed job or from
+        the cache when available.  Otherwise a task is submitted to extract and sort
+        the sequence reads from the input sequence file.
+
+        @param nodeId Node ID of sequence file in Shock or None for a local file
+        @param sourceFile Path to input sequence file
+        @param sourceSize Size in bytes of input sequence file
+        @param destFile Path to output file with extracted sequence reads (the sorted reads are saved with a .sorted extension)
+        @return Nothing
+    '''
+
+    def _addSample(self, nodeId, sourceFile, sourceSize, destFile):
+        name = os.path.splitext(os.path.basename(destFile))[0]
+        sortedFile = '%s.sorted' %(os.path.splitext(destFile)[0])
+        if self.journal.completed('sorted', name, sortedFile):
+            if os.path.exists(sortedFile): # Sample did not have the minimum number of sequences
+                self._onSorted(sortedFile, True, journaled=True)
+            return
+        if self._getCachedSample(destFile):
+            self._onSorted(sortedFile, True)
+            return
+        args = dict() # Needs to be scoped here so each process gets its own copy
+        args['format'] = self.input['format']
+        args['shockUrl'] = self.config['shock_url']
+        args['auth'] = self.context['token']
+        args['sequenceLen'] = self.input['sequence_length']
+        args['minReads'] = self.input['min_reads']
+        args['maxReads'] = self.input['max_reads']
+        args['nodeId'] = nodeId
+        args['sourceFile'] = sourceFile
+        args['destFile'] = sortedFile
+        args['sortMemory'] = self.sortMemory
+        args['packed'] = self.packedReads
+        args['sourceSize'] = sourceSize
+
+        # Extract a large sequence file in chunks that run in parallel.
+        chunks = split_sequence_file(args, self.extractChunkSize)
+        if len(chunks) > 0:
+            self._addChunks(args, chunks, destFile)
+            return
+
+        self.scheduler.submit('extract', destFile, extract_seq, (args,),
+                              lambda value: self._onExtracted(sortedFile),
+                              self._taskError(ExtractError, "Error extracting sequences from input sequence file '%s'" %(sourceFile)),
+                              sourceSize)
+        return
+
+    ''' Add a sample from a local sequence file to the job after its checksum is calculated.
+
+        The checksum identifies the contents of the sample in the caches and in the
+        compressed sizes file.  It is calculated by a task so the input files are
+        read in parallel by the process pool instead of one after the other before
+        any other task starts.
+
+        @param sourceFile Path to input sequence file
+        @param sourceSize Size in bytes of input sequence file
+        @param destFile Path to output file with extracted sequence reads
+        @return Nothing
+    '''
+
+    def _addLocalSample(self, sourceFile, sourceSize, destFile):
+        def onChecksum(checksum):
+            self._setSampleKey(checksum, destFile)
+            self._addSample(None, sourceFile, sourceSize, destFile)
+            return
+
+        self.scheduler.submit('checksum', destFile, file_checksum, (sourceFile,), onChecksum,
+                              self._taskError(ExtractError, "Error calculating checksum of input sequence file '%s'" %(sourceFile)),
+                              sourceSize)
+        return
+
+    ''' Submit the tasks to extract the chunks of a large sequence file.
+
+        Each chunk is sorted and the sorted chunks are merged after all of the chunks
+        are extracted.
+
+        @param args Dictionary of argument values for extract_seq()
+        @param chunks List of tuples with start and end offsets of chunks
+        @param destFile Path to output file with extracted sequence reads
+        @return Nothing
+    '''
+
+    def _addChunks(self, args, chunks, destFile):
+        combineArgs = dict(args)
+        combineArgs['chunkFiles'] = list()
+        combineArgs['numReads'] = 0
+        remaining = [ len(chunks) ]
+
+        def onChunkDone(numReads):
+            combineArgs['numReads'] += numReads
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                self.scheduler.submit('combine', destFile, combine_chunks, (combineArgs,),
+                                      lambda value: self._onExtracted(args['destFile']),
+                                      self._taskError(ExtractError, "Error combining chunks of input sequence file '%s'" %(args['sourceFile'])),
+                                      args['sourceSize'])
+            return
+
+        for index, (start, end) in enumerate(chunks):
+            chunkArgs = dict(args) # Each task needs its own copy
+            chunkArgs['chunkStart'] = start
+            chunkArgs['chunkEnd'] = end
+            chunkArgs['destFile'] = '%s.chunk%d' %(args['destFile'], index)
+            combineArgs['chunkFiles'].append(chunkArgs['destFile'])
+            self.scheduler.submit('extract', '%s.chunk%d' %(destFile, index), extract_chunk, (chunkArgs,), onChunkDone,
+                                  self._taskError(ExtractError, "Error extracting sequences from chunk %d of input sequence file '%s'" %(index, args['sourceFile'])),
+                                  end - start)
+        return
+
+    ''' Check a sample after the sequence reads are extracted and sorted.
+
+        @param sortedFile Path to file with sorted sequence reads
+        @raise SeqLenError: Sequence file has no sequences
+        @return Nothing
+    '''
+
+    def _onExtracted(self, sortedFile):
+        # See if the file did not have the minimum number of sequences.
+        if not os.path.exists(sortedFile):
+            self.journal.record('sorted', os.path.splitext(os.path.basename(sortedFile))[0], None)
+            return
+
+        # See if the file has no data.
+        if text_size(sortedFile) == 0:
+            raise SeqLenError("Sequence file '%s' has no sequences" %(sortedFile))
+
+        self._onSorted(sortedFile, False)
+        return
+
+    ''' Submit the tasks to compress a sample and all of its pairs after the sample is sorted.
+
+        @param sortedFile Path to file with sorted sequence reads
+        @param cached True when the sorted sequence reads are from the cache
+        @param journaled True when the sorted sequence reads are from the journal of a resumed job
+        @return Nothing
+    '''
+
+    def _onSorted(self, sortedFile, cached, journaled=False):
+        name = os.path.splitext(os.path.basename(sortedFile))[0]
+        if not journaled:
+            self.journal.record('sorted', name, os.path.getsize(sortedFile))
+        size = text_size(sortedFile) # Estimate costs from the size of the reads as text
+
+        # Add the sorted sequence reads to the cache so later jobs can reuse them.
+        if self.sampleCache is not None and not cached and name in self.sampleKeys:
+            try:
+                self.sampleCache.add(self.sampleKeys[name], sortedFile)
+            except Exception as e:
+                self._log(log.WARNING, 'Error adding sample %s to cache: %s' %(name, e))
+
+        # Calculate the compressed size of the sorted file.
+        previousSize = self._previousSize(name, [ name ])
+        if previousSize is not None:
+            self.singleSizes[self.sampleIndices[name]] = previousSize
+        elif name in self.cachedSizes:
+            self.singleSizes[self.sampleIndices[name]] = self.cachedSizes[name]
+        else:
+            args = dict() # Needs to be scoped here so each process gets its own copy
+            args['sourceFile'] = sortedFile
+            args['extreme'] = self.input['extreme']
+            self.scheduler.submit('compress', name, compress_seq, (args,),
+                                  lambda value: self._onCompressed(name, value),
+                                  self._taskError(CompressError, "Error compressing sequence file '%s'" %(name)),
+                                  size)
+
+        # Calculate the compressed size of the pairs with all of the samples that are already sorted.
+        for otherName, otherFile, otherSize in self.sortedSamples:
+            self._addPair(otherName, otherFile, name, sortedFile, otherSize + size)
+        self.sortedSamples.append( (name, sortedFile, size) )
+        return
+
+    ''' Save the compressed size of a sample.
+
+        @param name Name of sample
+        @param size Size in bytes of compressed data
+        @return Nothing
+    '''
+
+    def _onCompressed(self, name, size):
+        self.singleSizes[self.sampleIndices[name]] = size
+        self.journal.record('size', name, size)
+        if self.sampleCache is not None and name in self.sampleKeys:
+            try:
+                self.sampleCache.set_size(self.sampleKeys[name], self.input['extreme'], size)
+            except Exception as e:
+                self._log(log.WARNING, 'Error saving size of sample %s to cache: %s' %(name, e))
+        return
+
+    ''' Get the compressed size of a pair or submit a task to merge and compress the pair.
+
+        The compressed size is taken from the previous job or the pair size cache when
+        available.
+
+        @param pname Name of first sample in pair
+        @param p Path to file with sorted sequence reads of first sample
+        @param qname Name of second sample in pair
+        @param q Path to file with sorted sequence reads of second sample
+        @param size Total size in bytes of both files with sorted sequence reads
+        @return Nothing
+    '''
+
+    def _addPair(self, pname, p, qname, q, size):
+        name = '%s%s%s' %(pname, PairSeparator, qname)
+        if len(self.previousSizes) > 0 or len(self.journal.sizes) > 0:
+            previousSize = self._previousSize(name, [ pname, qname ])
+            if previousSize is None:
+                previousSize = self._previousSize('%s%s%s' %(qname, PairSeparator, pname), [ pname, qname ])
+            if previousSize is not None:
+                self._setPairSize(pname, qname, previousSize)
+                return
+        if self.pairCache is not None and pname in self.sampleKeys and qname in self.sampleKeys:
+            cachedSize = self.pairCache.get(self.sampleKeys[pname], self.sampleKeys[qname], self.input['extreme'])
+            if cachedSize is not None:
+                self._setPairSize(pname, qname, cachedSize)
+                self.pairCacheHits += 1
+                return
+            self.pairCacheMisses += 1
+
+        # Merge the pair straight into the compressor.
+        args = dict() # Needs to be scoped here so each process gets its own copy
+        args['sourceFile1'] = p
+        args['sourceFile2'] = q
+        args['extreme'] = self.input['extreme']
+        self.scheduler.submit('merge', name, merge_compress_seq, (args,),
+                              lambda value: self._onPairCompressed(name, pname, qname, value),
+                              self._taskError(MergeError, "Error merging and compressing sequence files '%s'" %(name)),
+                              size)
+        return
+
+    ''' Save the compressed size of a pair.
+
+        @param name Name of pair
+        @param pname Name of first sample in pair
+        @param qname Name of second sample in pair
+        @param size Size in bytes of compressed data
+        @return Nothing
+    '''
+
+    def _onPairCompressed(self, name, pname, qname, size):
+        self._setPairSize(pname, qname, size)
+        self.journal.record('size', name, size)
+        if self.pairCache is not None and pname in self.sampleKeys and qname in self.sampleKeys:
+            self.newPairSizes.append( (self.sampleKeys[pname], self.sampleKeys[qname], size) )
+        return
+
+    ''' Save the compressed size of a pair in the array of pair sizes.
+
+        @param pname Name of first sample in pair
+        @param qname Name of second sample in pair
+        @param size Size in bytes of compressed data
+        @return Nothing
+    '''
+
+    def _setPairSize(self, pname, qname, size):
+        i = self.sampleIndices[pname]
+        j = self.sampleIndices[qname]
+        self.pairSizes[i, j] = size
+        self.pairSizes[j, i] = size
+        return
+
     def __init__(self):
         self.logger = None
 
     ''' Run a job to build a distance matrix.
 
-        When successful the distance matrix csv file is stored in Shock.
+        When successful the distance matrix csv file and a file with the compressed
+        sizes are stored in Shock.  When the input includes the compressed sizes
+        from a previous job, only the sizes for new files and pairs with a new file
+        are computed.
+
+        The sorted file of each sample and each compressed size that is calculated
+        are recorded in a journal in the work directory.  When resuming a job that
+        was interrupted, the journal is replayed and only the samples that were not
+        sorted and the compressed sizes that were not calculated are done again.
 
         @param job Dictionary with configuration variables, context variables, and input variables for job
+        @param resume True to resume a job from its journal
+        @param pool Process pool that is already running or None to create the process pool for the job
         @raise ExtractError: Error extracting sequences from input sequence file
         @raise SeqLenError: Error with lengths of sequences in input sequence file
-        @raise SortError: Error sorting a raw sequence file
-        @raise MergeError: Error merging a raw sequence file
-        @raise CompressError: Error compressing a raw sequence file
+        @raise MergeError: Error merging and compressing a pair of sorted sequence files
+        @raise CompressError: Error compressing a sorted sequence file
         @raise ShockError: Error saving file to Shock
+        @raise SizesError: Error with the compressed sizes from a previous job
         @return Nothing
     '''
 
-    def runJob(self, job):
+    def runJob(self, job, resume=False, pool=None):
         
         self.config = job['config']
         self.context = job['context']
@@ -167,163 +642,162 @@ class CompressionBasedDistance:
         # Create a user and job state client and authenticate as the user.
         ujsClient = UserAndJobState(self.config['userandjobstate_url'], token=self.context['token'])
 
-        # Create a process pool.
-        self.pool = Pool(processes=int(self.config['num_pool_processes']))
+        # Create a process pool unless the job was given a pool that is already running.
+        self.pool = pool
+        if self.pool is None:
+            self.pool = Pool(processes=int(self.config['num_pool_processes']))
+
+        # Limit the memory used by tasks across all of the jobs on the system when there is a budget.
+        self.limiter = None
+        memoryBudget = int(self.config.get('memory_budget', 0))
+        if memoryBudget > 0:
+            self.limiter = MemoryLimiter(os.path.join(self.config['work_folder_path'], 'memory.ledger'), memoryBudget * 1024 * 1024)
         
         # Create a work directory for storing intermediate files.
         self.jobDirectory = make_job_dir(self.config['work_folder_path'], job['id'])
         self._log(log.INFO, 'Job '+job['id']+' running with work folder '+self.jobDirectory)
 
-        # Download input fasta files from Shock and extract sequences to work directory.
-        try:
-            ujsClient.update_job_progress(job['id'], self.context['token'], 'extracting sequence files', 1, timestamp(3600))
-        except:
-            pass
-        resultList = []
-        sequenceList = []
-        for nodeId in self.input['node_ids']:
-            node = self.shockClient.get_node(nodeId)
-            sourceFile = os.path.join(self.jobDirectory, node['file']['name'])
-            destFile = '%s.sequence' %(os.path.splitext(sourceFile)[0])
-            if PairSeparator in destFile: # Check for pair separator string in file name and replace as needed.
-                destFile = destFile.replace(PairSeparator, '-')
-            sequenceList.append(destFile)
-            args = dict() # Needs to be scoped here so each process gets its own copy
-            args['format'] = self.input['format']
-            args['shockUrl'] = self.config['shock_url']
-            args['auth'] = self.context['token']
-            args['sequenceLen'] = self.input['sequence_length']
-            args['minReads'] = self.input['min_reads']
-            args['maxReads'] = self.input['max_reads']
-            args['nodeId'] = nodeId
-            args['sourceFile'] = sourceFile
-            args['destFile'] = destFile
-            result = self.pool.apply_async(extract_seq, (args,))
-            resultList.append(result)
-        for result in resultList:
-            if result.get() != 0:
-                self._cleanup()
-                raise ExtractError("Error extracting sequences from input sequence file, result: %d" %(result.get()))
-        for path in self.input['file_paths']:
-            sourceFile = os.path.basename(path)
-            destFile = '%s/%s.sequence' %(self.jobDirectory, os.path.splitext(sourceFile)[0])
-            if PairSeparator in destFile: # Check for pair separator string in file name and replace as needed.
-                destFile = destFile.replace(PairSeparator, '-')
-            sequenceList.append(destFile)
-            args = dict() # Needs to be scoped here so each process gets its own copy
-            args['format'] = self.input['format']
-            args['shockUrl'] = self.config['shock_url']
-            args['auth'] = self.context['token']
-            args['sequenceLen'] = self.input['sequence_length']
-            args['minReads'] = self.input['min_reads']
-            args['maxReads'] = self.input['max_reads']
-            args['nodeId'] = None
-            args['sourceFile'] = path
-            args['destFile'] = destFile
-            result = self.pool.apply_async(extract_seq, (args,))
-            resultList.append(result)
-        for result in resultList:
+        # Record completed work in the journal and replay the work completed before the job was interrupted.
+        self.journal = Journal(os.path.join(self.jobDirectory, JournalFileName), resume)
+        if resume:
+            self._log(log.INFO, 'Job %s resumed with %d sorted files and %d compressed sizes from journal'
+                      %(job['id'], len(self.journal.sorted), len(self.journal.sizes)))
+
+        # Use the cache of sorted sequence reads shared across jobs when it is enabled.
+        self.sampleCache = None
+        self.sampleKeys = dict()
+        self.cachedSizes = dict()
+        cacheSize = int(self.config.get('sample_cache_size', 0))
+        if cacheSize > 0:
+            self.sampleCache = SampleCache(os.path.join(self.config['work_folder_path'], 'cache'), cacheSize * 1024 * 1024)
+
+        # Use the cache of compressed sizes of pairs shared across jobs when it is enabled.
+        self.pairCache = None
+        if self.config.get('pair_cache_path'):
+            self.pairCache = PairSizeCache(self.config['pair_cache_path'])
+        self.useKeys = self.sampleCache is not None or self.pairCache is not None
+
+        # Get the compressed sizes from a previous job when extending a distance matrix.
+        previousSizes = dict()
+        previousChecksums = dict()
+        if 'sizes_node_id' in self.input:
+            sizesFile = os.path.join(self.jobDirectory, 'previous.sizes.json')
             try:
-                result.get()
+                self.shockClient.download_to_path(self.input['sizes_node_id'], sizesFile)
+                previousSizes, previousChecksums = self._loadSizes(sizesFile)
             except Exception as e:
                 self._cleanup()
-                raise ExtractError("Error extracting sequences from input sequence file: %s" %(e.message))
-
-        # Confirm that each file met the criteria for sequence length and number of sequences.
-        filesToRemove = list()
-        for index in range(len(sequenceList)):
-            # See if the file did not have the minimum number of sequences.
-            if not os.path.exists(sequenceList[index]):
-                filesToRemove.append(index)
-                continue
-
-            # See if the file has no data.
-            if os.path.getsize(sequenceList[index]) == 0:
-                self._cleanup()
-                raise SeqLenError("Sequence file '%s' has no sequences" %(sequenceList[index]))
+                raise SizesError("Error getting compressed sizes from previous job: %s" %(e))
 
-        filteredList = list()
-        for index in range(len(sequenceList)):
-            if index not in filesToRemove:
-                filteredList.append(sequenceList[index])
-        if len(filteredList) < 2:
-            self._cleanup()
-            raise SeqLenError("There are not enough sequence files that meet the sequence length or number of sequences criteria.")
-
-        # Sort the sequences.
+        # Build the distance matrix by running the tasks to extract, sort, and compress the
+        # sequence files.  A task runs as soon as the tasks it depends on are done.
         try:
-            ujsClient.update_job_progress(job['id'], self.context['token'], 'sorting sequence files', 1, timestamp(3600))
+            ujsClient.update_job_progress(job['id'], self.context['token'], 'extracting, sorting, and compressing sequence files', 1, timestamp(3600))
         except:
             pass
-        resultList = []
-        sortedList = []
-        for sourceFile in filteredList:
-            destFile = '%s.sorted' %(os.path.splitext(sourceFile)[0])
-            sortedList.append(destFile)
-            args = [ '/usr/bin/sort', '--output=%s' %(destFile), sourceFile ]
-            result = self.pool.apply_async(run_command, (args,))
-            resultList.append(result)
-        for result in resultList:
-            try:
-                result.get()
-            except CommandError as e:
-                self._cleanup()
-                raise SortError("Error sorting sequence file: %s\nCommand: '%s'\nStdout: '%s'\nStderr: '%s'" %(e.message, e.cmd, e.stdout, e.stderr))
-             
-        # Create combined and sorted files.
+        self.sortMemory = int(self.config.get('sort_memory', DefaultSortMemory)) * 1024 * 1024
+        self.packedReads = self.config.get('packed_reads', '0') == '1'
+        self.extractChunkSize = int(self.config.get('extract_chunk_size', DefaultExtractChunkSize)) * 1024 * 1024
+        self.scheduler = TaskScheduler(self.pool, int(self.config['num_pool_processes']), self.input['extreme'], self.sortMemory, self.limiter)
+        self.previousSizes = previousSizes
+        self.previousChecksums = previousChecksums
+        self.sampleChecksums = dict()
+        self.changedSamples = set()
+        self.sortedSamples = list()
+        self.newPairSizes = list()
+        self.pairCacheHits = 0
+        self.pairCacheMisses = 0
         try:
-            ujsClient.update_job_progress(job['id'], self.context['token'], 'merging all pairs of sequence files', 1, timestamp(3600))
+            # Find the sample for each input sequence file in Shock or on the local file system.
+            samples = list()
+            for nodeId in self.input['node_ids']:
+                node = self.shockClient.get_node(nodeId)
+                sourceFile = os.path.join(self.jobDirectory, node['file']['name'])
+                destFile = '%s.sequence' %(os.path.splitext(strip_compression_extension(sourceFile))[0])
+                if PairSeparator in destFile: # Check for pair separator string in file name and replace as needed.
+                    destFile = destFile.replace(PairSeparator, '-')
+                samples.append( (os.path.splitext(os.path.basename(destFile))[0], nodeId, sourceFile, node['file'].get('size', 0), destFile,
+                                 node['file'].get('checksum', dict()).get('md5')) )
+            for path in self.input['file_paths']:
+                sourceFile = os.path.basename(path)
+                destFile = '%s/%s.sequence' %(self.jobDirectory, os.path.splitext(strip_compression_extension(sourceFile))[0])
+                if PairSeparator in destFile: # Check for pair separator string in file name and replace as needed.
+                    destFile = destFile.replace(PairSeparator, '-')
+                samples.append( (os.path.splitext(os.path.basename(destFile))[0], None, path, os.path.getsize(path), destFile, None) )
+
+            # The samples are numbered in sorted order of their names and the compressed sizes
+            # are saved in arrays indexed by sample number as the tasks finish.
+            samples.sort()
+            self.sampleNames = [ sample[0] for sample in samples ]
+            self.sampleIndices = dict(zip(self.sampleNames, range(len(samples))))
+            self.singleSizes = numpy.empty(len(samples), dtype=float)
+            self.singleSizes.fill(numpy.nan)
+            self.pairSizes = numpy.empty((len(samples), len(samples)), dtype=float)
+            self.pairSizes.fill(numpy.nan)
+
+            # Extract sequences from the input sequence files to the work directory.  The
+            # checksum of a local file is calculated by a task.
+            for name, nodeId, sourceFile, sourceSize, destFile, checksum in samples:
+                if nodeId is None:
+                    self._addLocalSample(sourceFile, sourceSize, destFile)
+                    continue
+                self._setSampleKey(checksum, destFile)
+                self._addSample(nodeId, sourceFile, sourceSize, destFile)
+
+            # Run tasks until all of the compressed sizes are calculated.
+            self.scheduler.run()
+
+            # Confirm that enough files met the criteria for sequence length and number of sequences.
+            if len(self.sortedSamples) < 2:
+                raise SeqLenError("There are not enough sequence files that meet the sequence length or number of sequences criteria.")
         except:
-            pass
-        resultList = []
-        for p,q in combinations(sortedList, 2):
-            pbase = os.path.basename(p)
-            qbase = os.path.basename(q)
-            dbase = '%s%s%s.sorted' %(os.path.splitext(pbase)[0], PairSeparator, os.path.splitext(qbase)[0])
-            destFile = os.path.join(self.jobDirectory, dbase)
-            sortedList.append(destFile)
-            args = [ '/usr/bin/sort', '-m', '--output=%s' %(destFile), p, q ]
-            result = self.pool.apply_async(run_command, (args,))
-            resultList.append(result)
-        for result in resultList:
+            self._cleanup()
+            raise
+
+        # Record the estimated and actual time of the tasks so the cost model can be checked.
+        summary = self.scheduler.summary()
+        for kind in sorted(summary):
+            count, estimated, actual = summary[kind]
+            self._log(log.INFO, 'Job %s ran %d %s tasks with estimated time %.1f seconds and actual time %.1f seconds'
+                      %(job['id'], count, kind, estimated, actual))
+        if self.config.get('task_history_folder_path'):
             try:
-                result.get()
-            except CommandError as e:
-                self._cleanup()
-                raise MergeError("Error merging sequence file: %s\nCommand: '%s'\nStdout: '%s'\nStderr: '%s'" %(e.message, e.cmd, e.stdout, e.stderr))
-                   
-        # Compress all sorted files.
-        try:
-            ujsClient.update_job_progress(job['id'], self.context['token'], 'compressing sequence files', 1, timestamp(3600))
-        except:
-            pass
-        resultList = []
-        compressedList = []
-        for sourceFile in sortedList:
-            compressedList.append(sourceFile+'.xz')
-            if self.input['extreme']:
-                level = '-9e'
-            else:
-                level = '-9'
-            args = [ '/usr/bin/xz', '--keep', level, '--no-warn', sourceFile ]
-            result = self.pool.apply_async(run_command, (args,))
-            resultList.append(result)
-        for result in resultList:
+                self.scheduler.save_history(os.path.join(self.config['task_history_folder_path'], '%s.tasks.tsv' %(job['id'])))
+            except Exception as e:
+                self._log(log.WARNING, 'Error saving task history for job %s: %s' %(job['id'], e))
+
+        # Save the compressed sizes of the new pairs so later jobs can reuse them.
+        if self.pairCache is not None:
             try:
-                result.get()
-            except CommandError as e:
-                self._cleanup()
-                raise CompressError("Error compressing sequence file: %s\nCommand: '%s'\nStdout: '%s'\nStderr: '%s'" %(e.message, e.cmd, e.stdout, e.stderr))
-        
+                self.pairCache.set_many(self.newPairSizes, self.input['extreme'])
+            except Exception as e:
+                self._log(log.WARNING, 'Error saving pair sizes to cache: %s' %(e))
+            self._log(log.INFO, 'Job %s pair size cache had %d hits and %d misses' %(job['id'], self.pairCacheHits, self.pairCacheMisses))
+
         # Calculate the distance matrix.
         try:
             ujsClient.update_job_progress(job['id'], self.context['token'], 'calculating distance matrix', 1, timestamp(3600))
         except:
             pass
+        # Only the samples that met the criteria for sequence length and number of sequences
+        # are in the distance matrix.
+        indices = sorted([ self.sampleIndices[name] for name, sortedFile, size in self.sortedSamples ])
+        names = [ self.sampleNames[index] for index in indices ]
+        singleSizes = self.singleSizes
+        pairSizes = self.pairSizes
+        if len(indices) < len(self.sampleNames):
+            singleSizes = singleSizes[indices]
+            pairSizes = pairSizes[numpy.ix_(indices, indices)]
+        del self.singleSizes, self.pairSizes
+
+        # The compressed sizes are saved first because the distances replace the pair sizes.
+        sizesFile = os.path.join(self.jobDirectory, '%s.sizes.json' %(job['id']))
+        self._saveSizes(names, singleSizes, pairSizes, sizesFile)
         csvFile = os.path.join(self.jobDirectory, '%s.csv' %(job['id']))
-        self._cbdCalculator(compressedList, self.input['scale'], csvFile)
+        binaryFile = os.path.join(self.jobDirectory, '%s.matrix' %(job['id']))
+        self._cbdCalculator(names, singleSizes, pairSizes, self.input['scale'], csvFile, binaryFile, self.config.get('binary_matrix_type', 'float64'))
         
-        # Store the output file in shock.
+        # Store the output files in shock.
         try:
             ujsClient.update_job_progress(job['id'], self.context['token'], 'storing output file in shock', 1, timestamp(3600))
         except:
@@ -334,9 +808,27 @@ class CompressionBasedDistance:
             os.rename(csvFile, '%s/%s.csv' %(self.config['work_folder_path'], job['id']))
             self._cleanup()
             raise ShockError("Error saving distance matrix file to Shock. A Shock node was not created.")
+        sizesNode = self.shockClient.create_node(sizesFile, '')
+        if not sizesNode['id']:
+            # The distance matrix is still usable so just log the problem.
+            self._log(log.ERR, 'Error saving compressed sizes file to Shock for job '+job['id'])
+
+        binaryNode = self.shockClient.create_node(binaryFile, '')
+        if not binaryNode['id']:
+            self._log(log.ERR, 'Error saving binary distance matrix file to Shock for job '+job['id'])
         
-        # Mark the job as complete.
-        results = { 'shocknodes': [ node['id'] ], 'shockurl': self.config['shock_url'] }
+        # Mark the job as complete.  Each output file is found by the name of its node and
+        # the list has all of the nodes so a client can remove them from Shock.
+        results = { 'matrix_node': node['id'], 'shocknodes': [ node['id'] ], 'shockurl': self.config['shock_url'] }
+        if self.pairCache is not None:
+            results['pair_cache_hits'] = self.pairCacheHits
+            results['pair_cache_misses'] = self.pairCacheMisses
+        if sizesNode['id']:
+            results['sizes_node'] = sizesNode['id']
+            results['shocknodes'].append(sizesNode['id'])
+        if binaryNode['id']:
+            results['binary_node'] = binaryNode['id']
+            results['shocknodes'].append(binaryNode['id'])
         ujsClient.complete_job(job['id'], self.context['token'], 'done', None, results)
         self._log(log.INFO, 'Job '+job['id']+' completed successfully')
 
@@ -348,12 +840,16 @@ class CompressionBasedDistance:
     def calculate(self, listFilePath, scale, csvFile):
 
         # Each line of the list file is a path to a compressed file.
-        compressedList = list()
+        sizes = dict()
         listFile = open(listFilePath, 'r')
         for line in listFile:
-            compressedList.append(line.strip())
+            sourceFile = line.strip()
+            # This works as long as '.sorted.xz' only occurs at the end of the path.
+            fname = os.path.basename(sourceFile).replace('.sorted.xz', '')
+            sizes[fname] = os.path.getsize(sourceFile)
         listFile.close()
 
         # Calculate the distance matrix.
-        self._cbdCalculator(compressedList, scale, csvFile)
+        names, singleSizes, pairSizes = self._sizeArrays(sizes)
+        self._cbdCalculator(names, singleSizes, pairSizes, scale, csvFile)
         return
@@ -0,0 +1,131 @@
+import sys
+import unittest
+import subprocess
+import time
+import os
+import shutil
+from biokbase.CompressionBasedDistance.Helpers import get_config
+
+class TestExtendMatrixScript(unittest.TestCase):
+    '''
+    Test inputs and option processing
+    '''
+        
+    def setUp(self):
+        self.cmd = os.path.join(os.environ['KB_TOP'], 'bin/cbd-extendmatrix')
+        self._config = get_config(os.environ["KB_TEST_CONFIG"])
+        configPath = os.path.join(os.environ['HOME'], '.kbase_config')
+        if os.path.exists(configPath):
+            shutil.copy(configPath, os.path.join(os.environ['HOME'], '.kbase_config.saved'))
+        args = [ 'kbase-login', self._config['test_user'], '--password', self._config['test_pwd'] ]
+        proc = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        proc.communicate()
+
+    def tearDown(self):
+        if os.path.exists('list.input'):
+            os.remove('list.input')
+        if os.path.exists('sizes.input'):
+            os.remove('sizes.input')
+        configPath = os.path.join(os.environ['HOME'], '.kbase_config')
+        os.remove(configPath)
+        savedConfigPath = os.path.join(os.environ['HOME'], '.kbase_config.saved')
+        if os.path.exists(savedConfigPath):
+            shutil.copy(savedConfigPath, configPath)
+            os.remove(savedConfigPath)
+
+    def test_help(self):
+        '''Run cbd-extendmatrix --help and verify that the major sections in the help text are present'''
+        
+        args = [ self.cmd, '--help' ]
+        proc = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        (so, se) = proc.communicate()
+        self.assertEqual(proc.returncode, 0)
+        self.assertNotEqual(so.find('NAME'), -1)
+        self.assertNotEqual(so.find('SYNOPSIS'), -1)
+        self.assertNotEqual(so.find('DESCRIPTION'), -1)
+        self.assertNotEqual(so.find('EXAMPLES'), -1)
+        self.assertEqual(se, '')
+                
+    def test_badOption(self):
+        '''Run cbd-extendmatrix with a bad option and verify that the error message is returned.'''
+        
+        args = [ self.cmd, 'sizes', 'input', '--chia' ]
+        proc = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        (so, se) = proc.communicate()
+        self.assertEqual(proc.returncode, 2)
+        self.assertEqual(so, '')
+        self.assertNotEqual(se.find('unrecognized arguments:'), -1)
+        
+    def test_missingOptionValue(self):
+        '''Run cbd-extendmatrix with a missing option value and verify that the error message is returned.'''
+        
+        args = [ self.cmd, 'sizes', 'input', '--format' ]
+        proc = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        (so, se) = proc.communicate()
+        self.assertEqual(proc.returncode, 2)
+        self.assertEqual(so, '')
+        self.assertNotEqual(se.find('expected one argument'), -1)
+        
+    def test_missingArg(self):
+        '''Run cbd-extendmatrix with a missing argument and verify that the error message is returned.'''
+        
+        args = [ self.cmd, '--format', 'fasta', 'sizes' ]
+        proc = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        (so, se) = proc.communicate()
+        self.assertEqual(proc.returncode, 2)
+        self.assertEqual(so, '')
+        self.assertNotEqual(se.find('too few arguments'), -1)
+
+    def test_missingSizesFile(self):
+        '''Run cbd-extendmatrix with an invalid path to the compressed sizes file.'''
+
+        listf = open('list.input', 'w')
+        listf.write('client-tests/1_V2.fasta\n')
+        listf.close()
+
+        args = [ self.cmd, 'badfile', 'list.input' ]
+        proc = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        (so, se) = proc.communicate()
+        self.assertEqual(proc.returncode, 1)
+        self.assertNotEqual(so.find('Error reading compressed sizes file'), -1)
+        self.assertEqual(se, '')
+
+    def test_badInputFile(self):
+        '''Run cbd-extendmatrix with an input list file that has a bad path to a sequence file.'''
+
+        sizesf = open('sizes.input', 'w')
+        sizesf.write('{ "sequence_length": 0, "max_reads": 0, "extreme": 0, "sizes": { } }\n')
+        sizesf.close()
+        listf = open('list.input', 'w')
+        listf.write('client-tests/1_V2.fasta\n')
+        listf.write('badfile\n')
+        listf.write('client-tests/3_V2.fasta\n')
+        listf.close()
+
+        args = [ self.cmd, 'sizes.input', 'list.input' ]
+        proc = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        (so, se) = proc.communicate()
+        self.assertEqual(proc.returncode, 1)
+        self.assertNotEqual(so.find('1 files are not accessible'), -1)
+        self.assertEqual(se, '')
+
+    def test_noChecksums(self):
+        '''Run cbd-extendmatrix with a compressed sizes file without checksums and verify that the files are not matched by name.'''
+
+        sizesf = open('sizes.input', 'w')
+        sizesf.write('{ "sequence_length": 0, "max_reads": 0, "extreme": 0, "sizes": { "1_V2": 58844 } }\n')
+        sizesf.close()
+        listf = open('list.input', 'w')
+        listf.write('client-tests/1_V2.fasta\n')
+        listf.write('client-tests/2_V2.fasta\n')
+        listf.close()
+
+        args = [ self.cmd, 'sizes.input', 'list.input' ]
+        proc = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        (so, se) = proc.communicate()
+        self.assertEqual(proc.returncode, 1)
+        self.assertNotEqual(so.find('--trust-names'), -1)
+        self.assertEqual(se, '')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,6 +3,11 @@ import unittest
 import subprocess
 import time
 import os
+import gzip
+import bz2
+import shutil
+import tempfile
+from biokbase.CompressionBasedDistance.Helpers import file_compression_type, open_decompressed
 
 class TestFilterMatrixScript(unittest.TestCase):
     '''
@@ -13,8 +18,9 @@ class TestFilterMatrixScript(unittest.TestCase):
         self.cmd = os.path.join(os.environ['KB_TOP'], 'bin/cbd-filtermatrix')
 
     def tearDown(self):
-        if os.path.exists('list.input'):
-            os.remove('list.input')
+        for path in [ 'list.input', 'batch.input', 'day0.csv', 'day7.csv' ]:
+            if os.path.exists(path):
+                os.remove(path)
 
     def test_help(self):
         '''Run cbd-filtermatrix --help and verify that the major sections in the help text are present'''
@@ -136,5 +142,89 @@ class TestFilterMatrixScript(unittest.TestCase):
         self.assertNotEqual(so.find('Only one group can be specified with filter'), -1)
         self.assertEqual(se, '')
         
+    def test_badBatchLine(self):
+        '''Run cbd-filtermatrix with a batch file that has a missing destination path.'''
+
+        listf = open('list.input', 'w')
+        listf.write('client-tests/1_V2.fasta\tday0\n')
+        listf.write('client-tests/2_V2.fasta\tday0\n')
+        listf.write('client-tests/4_V2.fasta\tday7\n')
+        listf.close()
+        batchf = open('batch.input', 'w')
+        batchf.write('within\tday0\tday0.csv\n')
+        batchf.write('without\tday0\n')
+        batchf.close()
+
+        args = [ self.cmd, '--batch-path', 'batch.input', 'list.input', 'client-tests/output.csv' ]
+        proc = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        (so, se) = proc.communicate()
+        self.assertEqual(proc.returncode, 1)
+        self.assertNotEqual(so.find('Each line must contain a filter, group list, and destination path'), -1)
+        self.assertEqual(se, '')
+        self.assertFalse(os.path.exists('day0.csv'))
+
+    def test_batch(self):
+        '''Run cbd-filtermatrix with a batch file and verify that each destination distance matrix is created.'''
+
+        listf = open('list.input', 'w')
+        listf.write('client-tests/1_V2.fasta\tday0\n')
+        listf.write('client-tests/2_V2.fasta\tday0\n')
+        listf.write('client-tests/3_V2.fasta\tday7\n')
+        listf.write('client-tests/4_V2.fasta\tday7\n')
+        listf.close()
+        batchf = open('batch.input', 'w')
+        batchf.write('within\tday0\tday0.csv\n')
+        batchf.write('without\tday0\tday7.csv\n')
+        batchf.close()
+
+        args = [ self.cmd, '--batch-path', 'batch.input', 'list.input', 'client-tests/output.csv' ]
+        proc = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        (so, se) = proc.communicate()
+        self.assertEqual(proc.returncode, 0)
+        self.assertEqual(se, '')
+        destf = open('day0.csv', 'r')
+        self.assertEqual(destf.readline(), 'ID,1_V2,2_V2\n')
+        destf.close()
+        destf = open('day7.csv', 'r')
+        self.assertEqual(destf.readline(), 'ID,3_V2,4_V2\n')
+        destf.close()
+
+    def test_compressedInputFiles(self):
+        '''Run cbd-filtermatrix with compressed sequence files in the input list file and verify the sample IDs match.'''
+
+        # Compress the sequence files so the list has the same files a user would give cbd-buildmatrix.
+        folder = tempfile.mkdtemp()
+        try:
+            data = open('client-tests/1_V2.fasta', 'rb').read()
+            gzipPath = os.path.join(folder, '1_V2.fasta.gz')
+            f = gzip.open(gzipPath, 'wb')
+            f.write(data)
+            f.close()
+            bzip2Path = os.path.join(folder, '2_V2.fasta.bz2')
+            with open(bzip2Path, 'wb') as f:
+                f.write(bz2.compress(open('client-tests/2_V2.fasta', 'rb').read()))
+            self.assertEqual(file_compression_type(gzipPath), 'gzip')
+            self.assertEqual(file_compression_type(bzip2Path), 'bzip2')
+            source = open_decompressed(open(gzipPath, 'rb'))
+            self.assertEqual(''.join(iter(lambda: source.read(65536), '')), data)
+            source.close()
+
+            listf = open('list.input', 'w')
+            listf.write('%s\tday0\n' %(gzipPath))
+            listf.write('%s\tday0\n' %(bzip2Path))
+            listf.write('client-tests/4_V2.fasta\tday7\n')
+            listf.close()
+
+            args = [ self.cmd, 'list.input', 'client-tests/output.csv', 'day0.csv', 'day0' ]
+            proc = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+            (so, se) = proc.communicate()
+            self.assertEqual(proc.returncode, 0)
+            self.assertEqual(se, '')
+            destf = open('day0.csv', 'r')
+            self.assertEqual(destf.readline(), 'ID,1_V2,2_V2\n')
+            destf.close()
+        finally:
+            shutil.rmtree(folder)
+
 if __name__ == '__main__':
     unittest.main()
@@ -13,8 +13,9 @@ class TestPlotMatrixScript(unittest.TestCase):
         self.cmd = os.path.join(os.environ['KB_TOP'], 'bin/cbd-plotmatrix')
 
     def tearDown(self):
-        if os.path.exists('list.input'):
-            os.remove('list.input')
+        for path in [ 'list.input', 'tree.txt', 'tree.nwk', 'coords.csv', 'mds.pdf', 'linkage.csv', 'dendrogram.png', 'batch.input' ]:
+            if os.path.exists(path):
+                os.remove(path)
 
     def test_help(self):
         '''Run cbd-plotmatrix --help and verify that the major sections in the help text are present'''
@@ -69,5 +70,90 @@ class TestPlotMatrixScript(unittest.TestCase):
         self.assertNotEqual(so.find('No such file or directory'), -1)
         self.assertEqual(se, '')
 
+    def test_treeNewick(self):
+        '''Run cbd-plotmatrix to generate a tree plot and save the tree in Newick format.'''
+
+        args = [ self.cmd, '--method', 'nj', '--newick-path', 'tree.nwk', 'client-tests/output.csv', 'tree.txt' ]
+        proc = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        (so, se) = proc.communicate()
+        self.assertEqual(proc.returncode, 0)
+        self.assertEqual(se, '')
+        treef = open('tree.txt', 'r')
+        art = treef.read()
+        treef.close()
+        newickf = open('tree.nwk', 'r')
+        newick = newickf.read()
+        newickf.close()
+        for id in [ '1_V2', '2_V2', '3_V2', '4_V2' ]:
+            self.assertNotEqual(art.find(id), -1)
+            self.assertNotEqual(newick.find(id), -1)
+        self.assertTrue(newick.startswith('('))
+        self.assertTrue(newick.endswith(';\n'))
+
+    def test_mdsCoordinates(self):
+        '''Run cbd-plotmatrix to generate a mds plot and save the coordinates of the samples.'''
+
+        args = [ self.cmd, '--type', 'mds', '--labels', 'none', '--coordinates-path', 'coords.csv', 'client-tests/output.csv', 'mds.pdf' ]
+        proc = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        (so, se) = proc.communicate()
+        self.assertEqual(proc.returncode, 0)
+        self.assertEqual(se, '')
+        self.assertTrue(os.path.exists('mds.pdf'))
+        coordsf = open('coords.csv', 'r')
+        lines = coordsf.readlines()
+        coordsf.close()
+        self.assertEqual(lines[0], 'ID,Coordinate 1,Coordinate 2\n')
+        self.assertEqual(len(lines), 5)
+        self.assertTrue(lines[1].startswith('1_V2,'))
+
+    def test_dendrogramExport(self):
+        '''Run cbd-plotmatrix to generate a dendrogram plot and save the linkage matrix and tree.'''
+
+        args = [ self.cmd, '--type', 'dendrogram', '--method', 'upgma', '--linkage-path', 'linkage.csv', '--newick-path', 'tree.nwk',
+                 '--plot-options', 'truncate=2', 'client-tests/output.csv', 'dendrogram.png' ]
+        proc = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        (so, se) = proc.communicate()
+        self.assertEqual(proc.returncode, 0)
+        self.assertEqual(se, '')
+        self.assertTrue(os.path.exists('dendrogram.png'))
+        linkagef = open('linkage.csv', 'r')
+        lines = linkagef.readlines()
+        linkagef.close()
+        self.assertEqual(lines[0], 'Cluster 1,Cluster 2,Distance,Size\n')
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[3].endswith(',4\n'))
+        newickf = open('tree.nwk', 'r')
+        newick = newickf.read()
+        newickf.close()
+        for id in [ '1_V2', '2_V2', '3_V2', '4_V2' ]:
+            self.assertNotEqual(newick.find(id), -1)
+
+    def test_batch(self):
+        '''Run cbd-plotmatrix to generate a tree and a dendrogram from a plan file.'''
+
+        batchf = open('batch.input', 'w')
+        batchf.write('# Plots sharing the upgma clustering\n')
+        batchf.write('--newick-path tree.nwk tree.txt\n')
+        batchf.write('\n')
+        batchf.write('--type dendrogram --method upgma --title \'My Plot\' dendrogram.png\n')
+        batchf.close()
+        args = [ self.cmd, '--batch-path', 'batch.input', '--processes', '2', 'client-tests/output.csv' ]
+        proc = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        (so, se) = proc.communicate()
+        self.assertEqual(proc.returncode, 0)
+        self.assertEqual(se, '')
+        self.assertTrue(os.path.exists('tree.txt'))
+        self.assertTrue(os.path.exists('tree.nwk'))
+        self.assertTrue(os.path.exists('dendrogram.png'))
+
+        # A plan line without a destination path is an error.
+        batchf = open('batch.input', 'w')
+        batchf.write('--type dendrogram\n')
+        batchf.close()
+        proc = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        (so, se) = proc.communicate()
+        self.assertEqual(proc.returncode, 1)
+        self.assertNotEqual(so.find('Line 1 of plan file'), -1)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,240 @@
+import sys
+import unittest
+import subprocess
+import os
+import json
+import shutil
+import signal
+import time
+from biokbase.CompressionBasedDistance.JobQueue import JobQueue
+
+# Folder with the files used by the tests that run jobs.
+TestFolder = 'workerd.test'
+
+# Module loaded at startup by the daemon when running jobs.  It replaces the Shock
+# and user and job state clients with clients that save to local files and kills
+# the process running a job for the jobs listed in crashJobs.  The jobs listed in
+# interruptJobs are killed the first time they run after the given number of
+# units of work are recorded in the journal.  Each recorded unit of work is also
+# saved to a file because the journal is removed when a job is done.
+HookModule = '''
+import os
+import json
+import shutil
+import signal
+import shock
+import biokbase.userandjobstate.client
+
+crashJobs = %(crashJobs)r
+interruptJobs = %(interruptJobs)r
+interruptAfter = [ 0 ]
+recordsPath = [ None ]
+
+class LocalShockClient:
+    def __init__(self, url, token=None):
+        self.folder = url
+    def create_node(self, path, attributes):
+        nodeId = 'node%%d' %%(len(os.listdir(self.folder)))
+        shutil.copy(path, os.path.join(self.folder, nodeId))
+        return { 'id': nodeId }
+    def delete_node(self, nodeId):
+        return
+
+class LocalUserAndJobState:
+    def __init__(self, url, token=None):
+        self.folder = url
+    def update_job_progress(self, jobId, token, status, progress, estimate):
+        return
+    def complete_job(self, jobId, token, status, error, results):
+        json.dump([ status, error, results ], open(os.path.join(self.folder, jobId+'.complete'), 'w'))
+
+shock.Client = LocalShockClient
+biokbase.userandjobstate.client.UserAndJobState = LocalUserAndJobState
+from biokbase.CompressionBasedDistance import Worker, Journal
+Worker.ShockClient = LocalShockClient
+Worker.UserAndJobState = LocalUserAndJobState
+
+runJob = Worker.CompressionBasedDistance.runJob
+
+def hookedRunJob(self, job, resume=False, pool=None):
+    with open(os.path.join(job['config']['work_folder_path'], job['id']+'.starts'), 'a') as f:
+        f.write('start %%s\\n' %%('warm' if pool is not None else 'cold'))
+    if job['id'] in crashJobs:
+        os.kill(os.getpid(), signal.SIGKILL)
+    recordsPath[0] = os.path.join(job['config']['work_folder_path'], job['id']+'.records')
+    if job['id'] in interruptJobs and not os.path.exists(os.path.join(job['config']['work_folder_path'], job['id'], 'journal.log')):
+        interruptAfter[0] = interruptJobs[job['id']]
+    return runJob(self, job, resume, pool)
+
+Worker.CompressionBasedDistance.runJob = hookedRunJob
+
+record = Journal.Journal.record
+
+def hookedRecord(self, event, name, size):
+    record(self, event, name, size)
+    with open(recordsPath[0], 'a') as f:
+        f.write('%%s %%s\\n' %%(event, name))
+    if interruptAfter[0] > 0:
+        interruptAfter[0] -= 1
+        if interruptAfter[0] == 0:
+            os.killpg(os.getpgrp(), signal.SIGKILL)
+
+Journal.Journal.record = hookedRecord
+'''
+
+class TestWorkerdScript(unittest.TestCase):
+    '''
+    Test inputs and option processing
+    '''
+
+    def setUp(self):
+        self.cmd = os.path.join(os.environ['KB_TOP'], 'bin/cbd-workerd')
+
+    def tearDown(self):
+        if os.path.exists('workerd.cfg'):
+            os.remove('workerd.cfg')
+        if os.path.exists(TestFolder):
+            shutil.rmtree(TestFolder)
+
+    def setup_jobs(self, jobIdList, maxRestarts, crashJobs, interruptJobs={}):
+        ''' Create the config file, the hook module, and the queue with the jobs to run. '''
+
+        folder = os.path.abspath(TestFolder)
+        self.workFolder = os.path.join(folder, 'work')
+        self.serviceFolder = os.path.join(folder, 'service')
+        self.hookFolder = os.path.join(folder, 'hook')
+        self.queuePath = os.path.join(folder, 'queue.db')
+        for path in [ self.workFolder, self.serviceFolder, self.hookFolder ]:
+            os.makedirs(path)
+        with open(os.path.join(self.hookFolder, 'sitecustomize.py'), 'w') as f:
+            f.write(HookModule %{ 'crashJobs': crashJobs, 'interruptJobs': interruptJobs })
+        with open('workerd.cfg', 'w') as f:
+            f.write('[CompressionBasedDistance]\njob_queue_path=%s\nmax_running_jobs=2\nmax_job_restarts=%d\nnum_pool_processes=2\n' %(self.queuePath, maxRestarts))
+
+        config = { 'shock_url': self.serviceFolder, 'userandjobstate_url': self.serviceFolder, 'work_folder_path': self.workFolder,
+                   'num_pool_processes': '2' }
+        context = { 'token': 'token', 'client_ip': '127.0.0.1', 'user_id': 'kbasetest', 'module': 'CompressionBasedDistance',
+                    'method': 'build_matrix', 'call_id': '' }
+        input = { 'node_ids': [], 'format': 'fasta', 'scale': 'std', 'sequence_length': 0, 'min_reads': 0, 'max_reads': 0, 'extreme': 0,
+                  'file_paths': [ os.path.abspath('client-tests/%s.fasta' %(name)) for name in [ '1_V2', '2_V2', '4_V2' ] ] }
+        queue = JobQueue(self.queuePath)
+        for jobId in jobIdList:
+            jobDirectory = os.path.join(self.workFolder, jobId)
+            os.makedirs(jobDirectory)
+            jobDataPath = os.path.join(jobDirectory, 'jobdata.json')
+            json.dump({ 'id': jobId, 'config': config, 'context': context, 'input': input }, open(jobDataPath, 'w'))
+            queue.add(jobId, context['user_id'], jobDataPath)
+        queue.close()
+
+    def run_daemon(self):
+        ''' Run the daemon until all of the jobs are done and return the output from the daemon. '''
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([ self.hookFolder, env.get('PYTHONPATH', '') ])
+        args = [ self.cmd, '--config', 'workerd.cfg', '--poll-interval', '0.2' ]
+        proc = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE, env = env)
+        queue = JobQueue(self.queuePath)
+        try:
+            for index in range(600):
+                time.sleep(0.2)
+                if queue.counts() == (0, 0) or proc.poll() is not None:
+                    break
+            self.assertEqual(queue.counts(), (0, 0))
+        finally:
+            queue.close()
+            if proc.poll() is None:
+                proc.send_signal(signal.SIGTERM)
+            (so, se) = proc.communicate()
+        self.assertEqual(proc.returncode, 0)
+        self.assertEqual(se, '')
+        return so
+
+    def job_result(self, jobId):
+        ''' Get the number of times a job was started and its final status. '''
+
+        with open(os.path.join(self.workFolder, jobId+'.starts'), 'r') as f:
+            numStarts = len(f.readlines())
+        with open(os.path.join(self.serviceFolder, jobId+'.complete'), 'r') as f:
+            status, error, results = json.load(f)
+        return numStarts, status, error, results
+
+    def test_help(self):
+        '''Run cbd-workerd --help and verify that the major sections in the help text are present'''
+
+        args = [ self.cmd, '--help' ]
+        proc = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        (so, se) = proc.communicate()
+        self.assertEqual(proc.returncode, 0)
+        self.assertNotEqual(so.find('NAME'), -1)
+        self.assertNotEqual(so.find('SYNOPSIS'), -1)
+        self.assertNotEqual(so.find('DESCRIPTION'), -1)
+        self.assertNotEqual(so.find('EXAMPLES'), -1)
+        self.assertEqual(se, '')
+
+    def test_badOption(self):
+        '''Run cbd-workerd with a bad option and verify that the error message is returned.'''
+
+        args = [ self.cmd, '--chia' ]
+        proc = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        (so, se) = proc.communicate()
+        self.assertEqual(proc.returncode, 2)
+        self.assertEqual(so, '')
+        self.assertNotEqual(se.find('unrecognized arguments:'), -1)
+
+    def test_missingQueuePath(self):
+        '''Run cbd-workerd with a config file that does not set the job queue path and verify that the error message is returned.'''
+
+        with open('workerd.cfg', 'w') as f:
+            f.write('[CompressionBasedDistance]\njob_queue_path=\n')
+        args = [ self.cmd, '--config', 'workerd.cfg' ]
+        proc = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        (so, se) = proc.communicate()
+        self.assertEqual(proc.returncode, 1)
+        self.assertNotEqual(so.find('job_queue_path variable must be set'), -1)
+
+    def test_crashedJob(self):
+        '''Run a job whose process is killed and verify that it is restarted and then marked as failed.'''
+
+        self.setup_jobs([ 'crashed-job', 'good-job' ], 1, [ 'crashed-job' ])
+        so = self.run_daemon()
+        self.assertNotEqual(so.find('job crashed-job was terminated by signal 9 and was put back in the queue (restart 1 of 1)'), -1)
+        self.assertNotEqual(so.find('job crashed-job was terminated by signal 9 and was restarted too many times'), -1)
+        numStarts, status, error, results = self.job_result('crashed-job')
+        self.assertEqual(numStarts, 2)
+        self.assertEqual(status, 'failed')
+        self.assertNotEqual(error.find('terminated by signal 9'), -1)
+        numStarts, status, error, results = self.job_result('good-job')
+        self.assertEqual(numStarts, 1)
+        self.assertEqual(status, 'done')
+
+    def test_resumeInterruptedJob(self):
+        '''Run a job that is killed partway through and verify that it is resumed from its journal.'''
+
+        self.setup_jobs([ 'interrupted-job', 'reference-job' ], 1, [], { 'interrupted-job': 4 })
+        so = self.run_daemon()
+        self.assertNotEqual(so.find('job interrupted-job was terminated by signal 9 and was put back in the queue (restart 1 of 1)'), -1)
+        numStarts, status, error, results = self.job_result('interrupted-job')
+        self.assertEqual(numStarts, 2)
+        self.assertEqual(status, 'done')
+        numStarts, status, error, referenceResults = self.job_result('reference-job')
+        self.assertEqual(numStarts, 1)
+        self.assertEqual(status, 'done')
+
+        # Every job started in a job runner with a process pool that was already running.
+        for jobId in [ 'interrupted-job', 'reference-job' ]:
+            with open(os.path.join(self.workFolder, jobId+'.starts'), 'r') as f:
+                self.assertEqual(set(f.readlines()), set([ 'start warm\n' ]))
+
+        # The resumed job has the same distance matrix and only did the work that was missing.
+        self.assertEqual(sorted([ results['matrix_node'], results['sizes_node'], results['binary_node'] ]), sorted(results['shocknodes']))
+        with open(os.path.join(self.serviceFolder, results['matrix_node']), 'r') as f:
+            matrix = f.read()
+        with open(os.path.join(self.serviceFolder, referenceResults['matrix_node']), 'r') as f:
+            self.assertEqual(matrix, f.read())
+        with open(os.path.join(self.workFolder, 'interrupted-job.records'), 'r') as f:
+            records = f.readlines()
+        self.assertEqual(len(records), 9)
+        self.assertEqual(len(set(records)), 9)
+
+if __name__ == '__main__':
+    unittest.main()
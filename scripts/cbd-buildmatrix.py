@@ -3,7 +3,6 @@ import sys
 import os
 import time
 import traceback
-from shock import Client as ShockClient
 from biokbase.CompressionBasedDistance.Client import CompressionBasedDistance
 from biokbase.CompressionBasedDistance.Helpers import get_url, parse_input_file
 
@@ -35,11 +34,17 @@ DESCRIPTION
 
       Note that the group list and label fields are not used by cbd-buildmatrix.
 
+      A sequence file can be compressed with gzip, bzip2, xz, or zstd and it is
+      decompressed as it is read.  The compressed file is uploaded so it uses
+      less space and transfer time than the uncompressed file.
+
       The --format optional argument specifies the type of the sequence files.
       Valid formats include 'fasta', 'fastq', 'clustal', 'embl', 'genbank',
       'nexus, and 'seqxml'.  All of the sequence files must be in the same
       format.  If the --format argument is not specified, the format is set
-      from the extension of the sequence files.
+      from the extension of the sequence files.  The extension of a compressed
+      sequence file is the extension before the compression extension (for
+      example, the format of sample1.fastq.gz is fastq).
 
       The --trim optional argument specifies the length to trim sequence reads
       to.  Sequence reads shorter than the specified length are discarded.  All
@@ -130,6 +135,7 @@ if __name__ == "__main__":
     cbdClient = CompressionBasedDistance(url=args.url)
     
     # Create a shock client.
+    from shock import Client as ShockClient
     shockClient = ShockClient(args.shockurl, cbdClient._headers['AUTHORIZATION'])
     
     # Parse the input file with the list of sequence files.
@@ -0,0 +1,179 @@
+import argparse
+import sys
+import os
+import json
+import traceback
+from biokbase.CompressionBasedDistance.Client import CompressionBasedDistance
+from biokbase.CompressionBasedDistance.Helpers import get_url, parse_input_file, strip_compression_extension, PairSeparator
+from biokbase.CompressionBasedDistance.Cache import file_checksum
+
+desc1 = '''
+NAME
+      cbd-extendmatrix -- extend a distance matrix with new microbiota samples
+
+SYNOPSIS
+'''
+
+desc2 = '''
+DESCRIPTION
+      Extend a distance matrix built by a previous job with new sequence files.
+      Only the compressed sizes of the new sequence files and of the pairs that
+      include a new sequence file are computed.  The compressed sizes of all
+      other sequence files and pairs are taken from the compressed sizes file
+      saved from the previous job.
+
+      The sizesPath positional argument is the path to the compressed sizes
+      file saved by the --sizes-path optional argument of cbd-getmatrix.
+
+      The inputPath positional argument is the path to a file with the list of
+      paths to the input sequence files and the groups each file belongs to.
+      See cbd-buildmatrix for a description of the list file.  The list must
+      include both the sequence files in the existing distance matrix and the
+      new sequence files.  The sequence files in the existing distance matrix
+      must have the same file names as when the matrix was built.  The
+      compressed sizes file records the checksum of each sequence file and a
+      sequence file with the same name but different contents is treated as a
+      new sequence file.
+
+      The --trust-names optional argument allows a compressed sizes file
+      without checksums, for example from a job run with an older version of
+      the service, to be used.  The sequence files are then matched to the
+      existing distance matrix by file name only so a sequence file with the
+      same name must have the same contents as when the matrix was built.
+
+      The --format optional argument specifies the type of the sequence files.
+      If the --format argument is not specified, the format is set from the
+      extension of the sequence files.
+
+      The --scale optional argument specifies the scale of the distance values.
+      A value of 'std' means to use the standard scale of 0 to 1 and a value of
+      'inf' means to use a scale from 0 to infinity.
+
+      The --min-reads optional argument specifies the minimum number of sequence
+      reads that must be in a sequence file.  If a file does not contain the
+      minimum number of sequence reads, the file is not used.
+
+      The values for trimming sequence reads, the maximum number of sequence
+      reads, and extreme compression are taken from the compressed sizes file
+      so they match the values used for the existing matrix.
+
+      The --url optional argument specifies an alternate URL for the service
+      endpoint.  The --shock-url optional argument specifies an alternate URL
+      for the shock service endpoint.
+
+      The --show-error optional argument shows additional detailed information
+      when an exception occurs.
+
+      A job is started to build the extended distance matrix and the job id is
+      returned.  Use the cbd-getmatrix command to monitor the status of the job.
+      When the job is done, the cbd-getmatrix command saves the distance matrix
+      to a file.
+'''
+
+desc3 = '''
+EXAMPLES
+      Extend a distance matrix with the new sequence files in a list file:
+      > cbd-extendmatrix mystudy.sizes mystudy.list
+
+SEE ALSO
+      cbd-buildmatrix
+      cbd-getmatrix
+
+AUTHORS
+      Mike Mundy
+'''
+
+if __name__ == "__main__":
+    # Parse options.
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, prog='cbd-extendmatrix', epilog=desc3)
+    parser.add_argument('sizesPath', help='path to file with compressed sizes from previous job', action='store', default=None)
+    parser.add_argument('inputPath', help='path to file with list of input sequence files', action='store', default=None)
+    parser.add_argument('-f', '--format', help='format of input sequence files', action='store', dest='format', default=None)
+    parser.add_argument('-s', '--scale', help='scale for distance matrix values', action='store', dest='scale', default='std')
+    parser.add_argument('--min-reads', help='minimum number of reads each sequence file must contain', action='store', dest='minReads', type=int, default=0)
+    parser.add_argument('--trust-names', help='match sequence files to compressed sizes by file name only', action='store_true', dest='trustNames', default=False)
+    parser.add_argument('-u', '--url', help='url for service', action='store', dest='url', default=None)
+    parser.add_argument('--shock-url', help='url for shock service', action='store', dest='shockurl', default='https://kbase.us/services/shock-api/')
+    parser.add_argument('-e', '--show-error', help='show detailed information for an exception', action='store_true', dest='showError', default=False)
+    usage = parser.format_usage()
+    parser.description = desc1 + '      ' + usage + desc2
+    parser.usage = argparse.SUPPRESS
+    args = parser.parse_args()
+
+    # Get the settings used to compute the compressed sizes from the sizes file.
+    # Create input parameters for extend_matrix() function.
+    input = dict()
+    try:
+        sizes = json.load(open(args.sizesPath, 'r'))
+        input['sequence_length'] = sizes['sequence_length']
+        input['max_reads'] = sizes['max_reads']
+        input['extreme'] = sizes['extreme']
+    except Exception as e:
+        print "Error reading compressed sizes file '%s': %s" %(args.sizesPath, e)
+        exit(1)
+    input['scale'] = args.scale
+    input['min_reads'] = args.minReads
+    input['node_ids'] = list()
+
+    # Create a cbd client (which must be authenticated).
+    if args.url is None:
+        args.url = get_url()
+    cbdClient = CompressionBasedDistance(url=args.url)
+
+    # Create a shock client.
+    from shock import Client as ShockClient
+    shockClient = ShockClient(args.shockurl, cbdClient._headers['AUTHORIZATION'])
+
+    # Parse the input file with the list of sequence files.
+    (fileList, extensions, numMissingFiles) = parse_input_file(args.inputPath)
+    if numMissingFiles > 0:
+        exit(1)
+
+    # Set the format based on the sequence file extension if the format argument was not specified.
+    if args.format is None:
+        if len(extensions) == 1:
+            input['format'] = extensions.keys()[0]
+        else:
+            print "The format of the sequence files could not be determined.  Set the format with the --format argument."
+            exit(1)
+    else:
+        input['format'] = args.format
+
+    # Confirm that the sequence files with the same name as a sample in the existing distance
+    # matrix can be matched by their contents.
+    checksums = sizes.get('checksums', dict())
+    for filename in fileList:
+        name = os.path.splitext(strip_compression_extension(os.path.basename(filename)))[0].replace(PairSeparator, '-')
+        if name not in sizes['sizes']:
+            continue
+        if name in checksums:
+            if file_checksum(filename) != checksums[name]:
+                print "Contents of sequence file '%s' do not match sample '%s' in the existing distance matrix so its compressed sizes are calculated again" %(filename, name)
+        elif not args.trustNames:
+            print "Compressed sizes file '%s' has no checksum for sample '%s' so sequence file '%s' cannot be matched by its contents.  Use the --trust-names argument to match by file name only." \
+                %(args.sizesPath, name, filename)
+            exit(1)
+
+    # For each file, upload to shock (keep track of ids).
+    for filename in fileList:
+        print "Uploading sequence file '%s'" %(filename)
+        node = shockClient.create_node(filename, '')
+        input['node_ids'].append(node['id'])
+    node = shockClient.create_node(args.sizesPath, '')
+    input['sizes_node_id'] = node['id']
+
+    # Submit a job to extend the distance matrix.
+    try:
+        jobid = cbdClient.extend_matrix(input)
+    except Exception as e:
+        print 'Error starting job: '+e.message
+        if args.showError:
+            traceback.print_exc(file=sys.stdout)
+        # Delete all of the input files from shock if something went wrong.
+        for nodeId in input['node_ids']:
+            shockClient.delete_node(nodeId)
+        shockClient.delete_node(input['sizes_node_id'])
+        exit(1)
+
+    print "Job '%s' submitted" %(jobid)
+    exit(0)
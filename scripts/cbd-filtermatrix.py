@@ -2,6 +2,8 @@ import argparse
 import sys
 import os
 import numpy
+from biokbase.CompressionBasedDistance.Matrix import load_matrix
+from biokbase.CompressionBasedDistance.Helpers import strip_compression_extension
 
 desc1 = '''
 NAME
@@ -27,7 +29,8 @@ DESCRIPTION
           /myhome/sample1.fasta    subject1;day7
 
       The sourcePath positional argument is the path to the source distance
-      matrix created by cbd-buildmatrix and saved by cbd-getmatrix.
+      matrix created by cbd-buildmatrix and saved by cbd-getmatrix.  The source
+      distance matrix can be in csv or binary format.
 
       The destPath positional argument is the path to the destination distance
       matrix after the filter is applied.
@@ -38,6 +41,18 @@ DESCRIPTION
       The --filter optional argument specifies the filter to apply to the source
       distance matrix.  Valid filters are 'within' to select one group,
      'without' to exclude one group, and 'between' to select multiple groups.
+
+      The --batch-path optional argument is the path to a file with a list of
+      filters to apply to the source distance matrix.  The source distance
+      matrix is loaded once and all of the filters are applied in one pass.
+      Each line of the batch file has three tab delimited fields: (1) filter,
+      (2) list of groups, (3) path to the destination distance matrix.  The
+      destPath and group positional arguments are not used with a batch file.
+      In the following example, the batch file creates two destination
+      distance matrices.
+
+          within     subject1           subject1.csv
+          between    day0;day7;day14    days.csv
 '''
 
 desc3 = '''
@@ -54,6 +69,9 @@ EXAMPLES
       > cbd-filtermatrix --filter between 
         mystudy.input mystudy.csv dest.csv 'day0;day7;day14'
 
+      Apply all of the filters in the batch file myfilters.txt:
+      > cbd-filtermatrix --batch-path myfilters.txt mystudy.input mystudy.csv
+
 SEE ALSO
       cbd-buildmatrix
       cbd-getmatrix
@@ -62,33 +80,98 @@ AUTHORS
       Mike Mundy 
 '''
 
-# Special value to indicate entry is not included.
-NA = -1.0
+# Filters that can be applied to a distance matrix.
+Filters = [ 'within', 'without', 'between' ]
+
+''' Parse and validate a filter and list of groups.
+
+    @param filter Type of filter (within, without, or between)
+    @param group List of group identifiers (separated by semicolon)
+    @raise ValueError: Filter or list of groups is not valid
+    @return List of groups
+'''
+
+def parse_filter(filter, group):
+    if filter not in Filters:
+        raise ValueError("Filter '%s' is not supported" %(filter))
+    groupList = group.split(';')
+    if filter != 'between' and len(groupList) != 1:
+        raise ValueError("Only one group can be specified with filter '%s'" %(filter))
+    return groupList
+
+''' Build a mask of the samples selected by a filter.
 
-''' Check if the specified ID is in the list of selected groups. '''
+    The mask for each group is built once with a set lookup for each ID and saved
+    in groupMasks so it can be reused by other filters on the same matrix.
 
-def isIdSelected(id, groupToId, groupList):
+    @param idList List of IDs in distance matrix
+    @param groupToId Dictionary mapping a group to the set of IDs in the group
+    @param groupMasks Dictionary mapping a group to the mask of its IDs in idList
+    @param filter Type of filter (within, without, or between)
+    @param groupList List of groups to apply with the filter
+    @return Boolean array that is True for each selected sample
+'''
+
+def select_samples(idList, groupToId, groupMasks, filter, groupList):
+    selected = numpy.zeros(len(idList), dtype=bool)
     for group in groupList:
-        if id in groupToId[group]:
-            return True
-    return False
+        if group not in groupMasks:
+            ids = groupToId[group]
+            groupMasks[group] = numpy.array([ id in ids for id in idList ], dtype=bool)
+        selected |= groupMasks[group]
+    if filter == 'without':
+        selected = ~selected
+    return selected
+
+''' Write the selected samples of a distance matrix to a csv file.
+
+    @param path Path to destination distance matrix file
+    @param idList List of IDs in distance matrix
+    @param sourceArray Square array of distance values
+    @param selected Boolean array that is True for each selected sample
+    @return Nothing
+'''
+
+def write_filtered_matrix(path, idList, sourceArray, selected):
+    indices = numpy.flatnonzero(selected)
+    destArray = sourceArray[numpy.ix_(indices, indices)]
+    destIdList = [ idList[index] for index in indices ]
+    rowFormat = ','.join([ '%g' ] * len(destIdList)) + '\n'
+    with open(path, 'w') as destFile:
+        destFile.write(','.join([ 'ID' ] + destIdList) + '\n')
+        for row in range(len(destIdList)):
+            destFile.write(destIdList[row] + ',' + rowFormat %tuple(destArray[row].tolist()))
+    return
 
 if __name__ == "__main__":
     # Parse options.
     parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, prog='cbd-filtermatrix', epilog=desc3)
     parser.add_argument('inputPath', help='path to file with list of input sequence files', action='store', default=None)
     parser.add_argument('sourcePath', help='path to source distance matrix file', action='store', default=None)
-    parser.add_argument('destPath', help='path to destination distance matrix file', action='store', default=None)
-    parser.add_argument('group', help='list of group identifiers (separated by semicolon)', action='store', default=None)
+    parser.add_argument('destPath', help='path to destination distance matrix file', action='store', nargs='?', default=None)
+    parser.add_argument('group', help='list of group identifiers (separated by semicolon)', action='store', nargs='?', default=None)
     parser.add_argument('-f', '--filter', help='type of filter (within, without, or between)', action='store', dest='filter', default='within')
+    parser.add_argument('-b', '--batch-path', help='path to file with list of filters to apply', action='store', dest='batchPath', default=None)
     usage = parser.format_usage()
     parser.description = desc1 + '      ' + usage + desc2
     parser.usage = argparse.SUPPRESS
-    args = parser.parse_args()
-    
-    # Parse the list of group identifiers.
-    groupList = args.group.split(';')
-    
+    args, extraList = parser.parse_known_args()
+
+    # Optional positional arguments are matched before any options so assign the
+    # positional arguments that follow the options.
+    for name in [ 'destPath', 'group' ]:
+        if getattr(args, name) is None and len(extraList) > 0 and not extraList[0].startswith('-'):
+            setattr(args, name, extraList.pop(0))
+    if len(extraList) > 0:
+        parser.error('unrecognized arguments: %s' %(' '.join(extraList)))
+
+    # The destination path and group are required unless a batch file is used.
+    if args.batchPath is None:
+        if args.group is None:
+            parser.error('too few arguments')
+    elif args.destPath is not None:
+        parser.error('destPath and group arguments are not allowed with --batch-path')
+
     # Open the input file with the list of files.
     try:
         infile = open(args.inputPath, 'r')
@@ -111,84 +194,70 @@ if __name__ == "__main__":
             
             # Add an entry to the dictionary for the ID.
             fileName = os.path.basename(filePath)
-            sampleID = os.path.splitext(fileName)[0]
+            sampleID = os.path.splitext(strip_compression_extension(fileName))[0] # Same as the ID assigned by the worker
             for group in groups:
-                if group not in groupToId.keys():
-                    groupToId[group] = list()
-                groupToId[group].append(sampleID)
+                if group not in groupToId:
+                    groupToId[group] = set()
+                groupToId[group].add(sampleID)
     infile.close()
-    
-    # Open the source distance matrix file.
+
+    # Build the list of filters to apply.  Each entry has the filter, the list of
+    # groups, and the path to the destination distance matrix file.
+    filterList = list()
+    if args.batchPath is None:
+        try:
+            filterList.append( (args.filter, parse_filter(args.filter, args.group), args.destPath) )
+        except ValueError as e:
+            print e
+            exit(1)
+    else:
+        try:
+            batchFile = open(args.batchPath, 'r')
+        except IOError as e:
+            print "Error opening batch file '%s': %s" %(args.batchPath, e.strerror)
+            exit(1)
+        lineNumber = 0
+        for line in batchFile:
+            lineNumber += 1
+            line = line.strip('\n\r')
+            if line and line[0] != '#': # Skip empty and comment lines
+                fields = line.split('\t')
+                if len(fields) != 3:
+                    print "Each line must contain a filter, group list, and destination path.  Line %d contains %d fields:" %(lineNumber, len(fields))
+                    print "  " + line
+                    exit(1)
+                try:
+                    filterList.append( (fields[0], parse_filter(fields[0], fields[1]), fields[2]) )
+                except ValueError as e:
+                    print "Error in line %d of batch file '%s': %s" %(lineNumber, args.batchPath, e)
+                    exit(1)
+        batchFile.close()
+
+    # Load the source distance matrix file.
     try:
-        sourceFile = open(args.sourcePath, 'r')
+        idList, sourceArray = load_matrix(args.sourcePath)
     except IOError as e:
         print "Error opening source distance matrix file '%s': %s" %(args.sourcePath, e.strerror)
         exit(1)
-  
-    # Get the list of IDs from the first line of the source file.
-    line = sourceFile.readline()
-    line = line.strip('\n\r')
-    idList = line.split(',')
-    idList.pop(0) # Remove the first entry which is always 'ID'
-    
-    # Read the source distance matrix from the source file. 
-    sourceArray = numpy.zeros((len(idList),len(idList)), dtype=float)
-    row = 0
-    for line in sourceFile:
-        line = line.strip('\n\r')
-        fields = line.split(',')
-        fields.pop(0) # Remove the first field which is the ID
-        for index in range(0,len(fields)):
-            sourceArray[row,index] = fields[index]
-        row += 1
-    sourceFile.close()
-        
-    # Create the destination array and initialize to special value.
-    destArray = numpy.empty((len(idList),len(idList)), dtype=float)
-    destArray.fill(NA)
-
-    # For filters 'within' and 'between', find all of the values in the specified group.
-    if args.filter == 'within' or args.filter == 'between':
-        if args.filter == 'within'  and len(groupList) != 1:
-            print "Only one group can be specified with filter 'within'"
-            exit(1)
-        for row in range(0,len(idList)):
-            if isIdSelected(idList[row], groupToId, groupList):
-                for col in range(0,len(idList)):
-                    if isIdSelected(idList[col], groupToId, groupList):
-                        destArray[row,col] = sourceArray[row,col]
-    
-    # For filter 'without', find all of the values not in the specified group.
-    elif args.filter == 'without':
-        if len(groupList) != 1:
-            print "Only one group can be specified with filter 'without'"
+    except ValueError as e:
+        print "Error loading source distance matrix file '%s': %s" %(args.sourcePath, e)
+        exit(1)
+
+    # Make sure all of the groups are in the input list file before saving any files.
+    for filter, groupList, destPath in filterList:
+        for group in groupList:
+            if group not in groupToId:
+                print "Group '%s' is not in input list file '%s'" %(group, args.inputPath)
+                exit(1)
+
+    # Apply each filter to the source distance matrix and save the selected samples.
+    groupMasks = dict()
+    for filter, groupList, destPath in filterList:
+        selected = select_samples(idList, groupToId, groupMasks, filter, groupList)
+        try:
+            write_filtered_matrix(destPath, idList, sourceArray, selected)
+        except IOError as e:
+            print "Error saving destination distance matrix file '%s': %s" %(destPath, e.strerror)
             exit(1)
-        for row in range(0,len(idList)):
-            if idList[row] not in groupToId[groupList[0]]:
-                for col in range(0,len(idList)):
-                    if idList[col] not in groupToId[groupList[0]]:
-                        destArray[row,col] = sourceArray[row,col]
 
-    else:
-        print "Filter '%s' is not supported" %(args.filter)
-        exit(1)
-        
-    # Open the destination file and build the header line.
-    destFile = open(args.destPath, 'w')
-    header = 'ID'
-    for index in range(0,len(idList)):
-        column = destArray[:,index]
-        line = column[numpy.logical_not(column == -1.0)]
-        if len(line) > 0:
-            header += ','+idList[index]        
-    destFile.write(header + '\n')
-    
-    # Write the destination matrix to the destination file.
-    for index in range(0,len(idList)):
-        row = destArray[index,]
-        line = row[numpy.logical_not(row == -1.0)]
-        if len(line) > 0:
-            destFile.write(idList[index] + ',' + ','.join(['{0:g}'.format(x) for x in line]) + '\n')
-    destFile.close()
-            
     exit(0)
@@ -3,7 +3,6 @@ import sys
 import os
 import time
 import traceback
-from shock import Client as ShockClient
 from biokbase.CompressionBasedDistance.Helpers import job_info_dict
 from biokbase.userandjobstate.client import UserAndJobState, ServerError as JobStateServerError
 
@@ -28,6 +27,18 @@ DESCRIPTION
       0 means the two communities are identical and a value of 1 means the two
       communities are completely different.
 
+      The --sizes-path optional argument specifies the path to an output file
+      where the compressed sizes computed by the job are stored.  Use the
+      compressed sizes file with cbd-extendmatrix to add new sequence files to
+      the distance matrix without recomputing the existing values.
+
+      The --binary-path optional argument specifies the path to an output file
+      where the distance matrix is stored in binary format.  The binary file has
+      a header with the list of IDs followed by the upper triangle of the matrix
+      and can be memory mapped so large matrices load almost instantly.  The
+      binary file can be used instead of the csv file with cbd-filtermatrix and
+      cbd-plotmatrix.
+
       The --show-times optional argument displays the start and finish times
       for successful jobs.
 
@@ -40,8 +51,15 @@ EXAMPLES
       Get a distance matrix and save to a file:
       > cbd-getmatrix 5285059be4b0ef8357331c34 mystudy.csv
 
+      Get a distance matrix and the compressed sizes and save to files:
+      > cbd-getmatrix --sizes-path mystudy.sizes 5285059be4b0ef8357331c34 mystudy.csv
+
+      Get a distance matrix in both csv and binary format and save to files:
+      > cbd-getmatrix --binary-path mystudy.matrix 5285059be4b0ef8357331c34 mystudy.csv
+
 SEE ALSO
       cbd-buildmatrix
+      cbd-extendmatrix
       cbd-filtermatrix
 
 AUTHORS
@@ -53,6 +71,8 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, prog='cbd-getmatrix', epilog=desc3)
     parser.add_argument('jobID', help='path to file with list of input sequence files', action='store', default=None)
     parser.add_argument('outputPath', help='path to output csv file', action='store', default=None)
+    parser.add_argument('--sizes-path', help='path to output compressed sizes file', action='store', dest='sizesPath', default=None)
+    parser.add_argument('--binary-path', help='path to output binary distance matrix file', action='store', dest='binaryPath', default=None)
     parser.add_argument('--show-times', help='show job start and end timestamps', action='store_true', dest='showTimes', default=False)
     parser.add_argument('--ujs-url', help='url for user and job state service', action='store', dest='ujsURL', default='https://kbase.us/services/userandjobstate')
     usage = parser.format_usage()
@@ -86,20 +106,58 @@ if __name__ == "__main__":
     if args.showTimes:
         print 'Job started at %s and finished at %s' %(info['started'], info['last_update'])
 
-    # Create a shock client.
+    # Create a shock client.  The shock module is not loaded while polling a running job.
+    from shock import Client as ShockClient
     shockClient = ShockClient(info['results']['shockurl'], ujsClient._headers['AUTHORIZATION'])
        
-    # Download the output to the specified file and remove the file from shock.
-    try:
-        shockClient.download_to_path(info['results']['shocknodes'][0], args.outputPath)
-    except Exception as e:
-        print 'Error downloading distance matrix from %s: %s' %(info['results']['shockurl'], e.message)
-        traceback.print_exc(file=sys.stdout)
+    # Find the node for each output file.  Jobs run with an older version of the service
+    # only have the list of nodes with the output files in a fixed order.
+    results = info['results']
+    matrixNode = results.get('matrix_node', results['shocknodes'][0])
+    sizesNode = results.get('sizes_node')
+    binaryNode = results.get('binary_node')
+    if 'matrix_node' not in results:
+        if len(results['shocknodes']) > 1:
+            sizesNode = results['shocknodes'][1]
+        if len(results['shocknodes']) > 2:
+            binaryNode = results['shocknodes'][2]
+
+    # Download the output to the specified file.
     try:
-        shockClient.delete_node(info['results']['shocknodes'][0])
+        shockClient.download_to_path(matrixNode, args.outputPath)
     except Exception as e:
-        print 'Error deleting distance matrix file from %s: ' %(+info['results']['shockurl'], e.message)
+        print 'Error downloading distance matrix from %s: %s' %(results['shockurl'], e.message)
         traceback.print_exc(file=sys.stdout)
+
+    # Download the compressed sizes to the specified file.
+    if args.sizesPath is not None:
+        if sizesNode is not None:
+            try:
+                shockClient.download_to_path(sizesNode, args.sizesPath)
+            except Exception as e:
+                print 'Error downloading compressed sizes from %s: %s' %(results['shockurl'], e.message)
+                traceback.print_exc(file=sys.stdout)
+        else:
+            print "Job '%s' did not save the compressed sizes." %(args.jobID)
+
+    # Download the binary distance matrix to the specified file.
+    if args.binaryPath is not None:
+        if binaryNode is not None:
+            try:
+                shockClient.download_to_path(binaryNode, args.binaryPath)
+            except Exception as e:
+                print 'Error downloading binary distance matrix from %s: %s' %(results['shockurl'], e.message)
+                traceback.print_exc(file=sys.stdout)
+        else:
+            print "Job '%s' did not save the binary distance matrix." %(args.jobID)
+
+    # Remove the files from shock.
+    for nodeId in info['results']['shocknodes']:
+        try:
+            shockClient.delete_node(nodeId)
+        except Exception as e:
+            print 'Error deleting file from %s: %s' %(info['results']['shockurl'], e.message)
+            traceback.print_exc(file=sys.stdout)
     
     # Delete the job.
     ujsClient.delete_job(args.jobID)
@@ -1,17 +1,12 @@
 import argparse
 import sys
 import os
+import shlex
+import multiprocessing
 import numpy
-from cogent.cluster.UPGMA import upgma
-from cogent.phylo.nj import nj
-import matplotlib
-from scipy.cluster.hierarchy import dendrogram, linkage
-import scipy.spatial.distance as ssd
-# MDS import rpy2.robjects as ro
-
-# MDS plots depend on the rpy2 Python package which must be built for the version
-# of R that is installed.  Still working out the dependencies for using the KBase
-# runtime so the MDS plot support is disabled.
+from biokbase.CompressionBasedDistance.Matrix import load_matrix, load_condensed_matrix, condensed_to_square
+from biokbase.CompressionBasedDistance.Tree import upgma_linkage, nj, tree_from_linkage
+from biokbase.CompressionBasedDistance.Helpers import strip_compression_extension
 
 desc1 = '''
 NAME
@@ -26,24 +21,41 @@ DESCRIPTION
       distance matrix.
 
       The sourcePath positional argument is the path to the source distance
-      matrix saved by cbd-getmatrix or cbd-filtermatrix.
+      matrix saved by cbd-getmatrix or cbd-filtermatrix.  The source distance
+      matrix can be in csv or binary format.
 
       The destPath positional argument is the path to the output file
-      containing the plot.
+      containing the plot.  The destPath positional argument is not used when
+      the --batch-path optional argument is specified.
+
+      The --batch-path optional argument specifies the path to a plan file for
+      generating multiple plots from the source distance matrix.  Each line of
+      the plan file has the optional arguments for one plot followed by the
+      destPath for the plot.  Blank lines and lines that start with '#' are
+      skipped.  The source distance matrix is loaded once and the clustering
+      for each method is computed once and shared by all of the plots that use
+      it.  A 'tree' plot with the 'upgma' method and a 'dendrogram' plot with
+      the 'upgma' method share the same clustering.  The --processes optional
+      argument specifies the number of processes used to generate the plots.
+      The default is 1.
 
       The --type optional argument specifies the type of the plot.  Valid
       types are 'tree' to generate a tree plot, 'dendrogram' to generate a
       dendrogram plot, and 'mds' to generate a metric dimensional scaling plot.
       The default type is 'tree'.
 
-      For a 'tree' type of plot, the supported optional argument is --method.
-      The --method optional argument specifies the clustering method to use and
-      the valid values are 'upgma' for unweighted pair group method with
-      arithmetic mean and 'nj' for neighbor joining.  The default method is
-      'upgma'.  All other optional arguments are ignored.
+      For a 'tree' type of plot, the supported optional arguments are --method
+      and --newick-path.  The --method optional argument specifies the
+      clustering method to use and the valid values are 'upgma' for unweighted
+      pair group method with arithmetic mean and 'nj' for neighbor joining.
+      The default method is 'upgma'.  The tree is drawn as text in the output
+      file.  The --newick-path optional argument specifies the path to a file
+      to save the tree in Newick format.  All other optional arguments are
+      ignored.
 
       For a 'dendrogram' type of plot, the supported optional arguments are
-      --method, --title, --labels, and --plot-options.  The --method optional
+      --method, --title, --labels, --plot-options, --newick-path, and
+      --linkage-path.  The --method optional
       argument specifies the clustering method to use and the valid values are
       'complete', 'upgma', 'single', 'weighted', 'centroid', 'median', or
       'ward'.  The default method is complete.  The --title optional argument
@@ -55,35 +67,48 @@ DESCRIPTION
       is 'source'.  The --input-file-path optional argument must be specified
       when using 'input' for the labels.  The --plot-options optional argument
       specifies a semicolon delimited list of options for controlling the plot.
-      The valid options are 'labelsize', 'count_sort', and 'orientation'.
-
+      The valid options are 'labelsize', 'count_sort', 'orientation', and
+      'truncate'.  The 'truncate' option is the number of clusters at the top
+      of the dendrogram to draw when there are more samples than the number.
+      The default is 30 and 0 draws every sample.  The --newick-path optional
+      argument specifies the path to a file to save the full clustering as a
+      tree in Newick format with the sample IDs from the source distance
+      matrix.  The --linkage-path optional argument specifies the path to a
+      csv file to save the full linkage matrix.  Each row of the linkage
+      matrix is a merge of two clusters with the indices of the clusters, the
+      distance between them, and the number of samples in the new cluster.
+      The indices of the samples are their positions in the source distance
+      matrix and the cluster made by row k has index N+k where N is the number
+      of samples.
+
+      For a 'mds' type of plot, the supported optional arguments are --title,
+      --labels, --colors, --file-options, --plot-options, and
+      --coordinates-path.  The points are placed with classical (metric)
+      multidimensional scaling which gives the same coordinates as the R
+      cmdscale() function.  The --title optional argument specifies the title
+      to place on the plot.  The default title is 'MDS'.  The --labels optional
+      argument specifies the source for labeling the points in the plot.  The
+      valid values are 'input' to use the value from the third field of the
+      input list file, 'source' to use the headings from the source distance
+      matrix, and 'none' for no labels.  The default value is 'source'.  The
+      --input-file-path optional argument must be specified when using 'input'
+      for the labels.  The --file-options optional argument specifies a
+      semicolon delimited list of options for controlling the output file.
+      The 'width' and 'height' options set the size of the plot in inches and
+      any other options supported by the matplotlib savefig() function can be
+      used.  The --plot-options optional argument specifies a semicolon
+      delimited list of options for controlling the plot.  The 'xlab' and
+      'ylab' options set the axis labels and any other options supported by
+      the matplotlib scatter() function can be used.  Options that start with
+      'text.' are used to control the text labels on the plot with any options
+      supported by the matplotlib annotate() function.  The --colors optional
+      argument is a semicolon delimited list of groups and colors.  A point
+      from a sample with the specified group is drawn with the specified
+      color.  The default color is black.  The --input-file-path optional
+      argument must be specified when using the --colors optional argument.
+      The --coordinates-path optional argument specifies the path to a csv
+      file to save the coordinates of each sample.
 '''
-# MDS Help text for MDS plots
-#       For a 'mds' type of plot, the supported optional arguments are --title,
-#       --labels, --colors, --file-options, --plot-options.  The --title optional
-#       argument specifies the title to place on the plot.  The default title is
-#       'MDS'.  The --labels optional argument specifies the source for labeling
-#       the points in the plot.  The valid values are 'input' to use the value
-#       from the third field of the input list file, 'source' to use the headings
-#       from the source distance matrix, and 'none' for no labels.  The default
-#       value is 'source'.  The --input-file-path optional argument must be
-#       specified when using 'input' for the labels.  The --file-options optional
-#       argument specifies a semicolon delimited list of options for controlling
-#       the output file.  Any options supported by the R pdf() function can be
-#       used.  The --plot-options optional argument specifies a semicolon
-#       delimited list of options for controlling the plot.  Any options supported
-#       by the R plot() function can be used.  Options that start with 'text.' are
-#       used to control the text labels on the plot.  The --colors optional
-#       argument is a semicolon delimited list of groups and colors.  A point from
-#       a sample with the specified group is drawn with the specified color.  The
-#       default color is black.  The --input-file-path optional argument must be
-#       specified when using the --colors optional argument.
-
-# MDS Example for MDS plot
-#       Generate a MDS plot using the input list file for the labels:
-#       > cbd-plotmatrix --type mds --labels input --input-file-path mystudy.list
-#           --file-options 'height=5.0;width=5.0' --plot-options 'pch=19;text.col=blue'
-#           --colors 'day1=blue;day7=orange' mystudy.csv mystudy.pdf
 
 desc3 = '''
 EXAMPLES
@@ -93,10 +118,25 @@ EXAMPLES
       Generate a tree plot using the nj method:
       > cbd-plotmatrix --method nj mystudy.csv mystudy.txt
 
+      Generate a tree plot and also save the tree in Newick format:
+      > cbd-plotmatrix --newick-path mystudy.nwk mystudy.csv mystudy.txt
+
       Generate a dendrogram plot using the centroid method and with a title:
       > cbd-plotmatrix --type dendrogram --method centroid --title 'My Plot'
           --plot-options label_size=8 mystudy.csv mystudy.pdf
 
+      Generate a MDS plot using the input list file for the labels:
+      > cbd-plotmatrix --type mds --labels input --input-file-path mystudy.list
+          --file-options 'height=5.0;width=5.0' --plot-options 'marker=o;text.color=blue'
+          --colors 'day1=blue;day7=orange' mystudy.csv mystudy.pdf
+
+      Generate a MDS plot and save the coordinates of the samples:
+      > cbd-plotmatrix --type mds --labels none --coordinates-path mystudy.coords.csv
+          mystudy.csv mystudy.pdf
+
+      Generate all of the plots in a plan file using 4 processes:
+      > cbd-plotmatrix --batch-path mystudy.plan --processes 4 mystudy.csv
+
 SEE ALSO
       cbd-buildmatrix
       cbd-getmatrix
@@ -106,6 +146,13 @@ AUTHORS
       Mike Mundy 
 '''
 
+# Largest number of samples drawn in a dendrogram by default.  Only the top
+# clusters are drawn for larger distance matrices.
+MaxDendrogramLeaves = 30
+
+# Clustering methods supported for a dendrogram.
+DendrogramMethods = [ 'complete', 'average', 'single', 'weighted', 'centroid', 'median', 'ward' ]
+
 def get_fields_from_line(line):
     line = line.strip('\n\r')
     if line and line[0] != '#': # Skip empty and comment lines
@@ -117,7 +164,7 @@ def get_fields_from_line(line):
 
         # Extract the sampleID from the path in the first field.
         fileName = os.path.basename(fields[0])
-        sampleID = os.path.splitext(fileName)[0]
+        sampleID = os.path.splitext(strip_compression_extension(fileName))[0]
 
         # Create a list of groups from the semicolon delimited string in the second field.
         groups = fields[1].split(';')
@@ -131,42 +178,106 @@ def get_fields_from_line(line):
     else:
         return (None, None, None)
 
-def plot_tree(sourceArray, args):
+''' Parse the arguments for a plot.
+
+    The destPath positional argument is optional so it is matched before any
+    options and is assigned here when it follows the options.
+
+    @param parser Argument parser
+    @param argList List of arguments or None to use the command line
+    @return Parsed arguments
+'''
 
-    # Build the input dictionary for the tree functions.
-    distanceDict = dict()
-    for i in range(len(idList)):
-        for j in range(len(idList)):
-            distanceDict[(idList[i], idList[j])]=sourceArray[i,j]
+def parse_arguments(parser, argList=None):
+    args, extraList = parser.parse_known_args(argList)
+    if args.destPath is None and len(extraList) > 0 and not extraList[0].startswith('-'):
+        args.destPath = extraList.pop(0)
+    if len(extraList) > 0:
+        parser.error('unrecognized arguments: %s' %(' '.join(extraList)))
+    return args
 
-    # Generate the tree using the specified method.
-    if args.method == 'upgma' or args.method is None:
-        tree = upgma(distanceDict)
-    elif args.method == 'nj':
-        tree = nj(distanceDict)
+''' Get the clustering method used by a plot.
+
+    The upgma method is the same as the average method for a dendrogram so both
+    types of plots can share the same linkage matrix.
+
+    @param args Arguments for the plot
+    @raise ValueError: Plot type or method is not supported
+    @return Name of clustering method or None when the plot does not use clustering
+'''
+
+def get_clustering_method(args):
+    if args.type == 'tree':
+        if args.method is None or args.method == 'upgma':
+            return 'average'
+        if args.method == 'nj':
+            return 'nj'
+    elif args.type == 'dendrogram':
+        if args.method is None:
+            return 'complete'
+        if args.method == 'upgma':
+            return 'average'
+        if args.method in DendrogramMethods:
+            return args.method
+    elif args.type == 'mds':
+        return None
     else:
-        print "Method '%s' is not supported." %(args.method)
-        exit(1)
+        raise ValueError("Plot type '%s' is not supported" %(args.type))
+    raise ValueError("Method '%s' is not supported." %(args.method))
+
+''' Cluster the samples in a condensed distance matrix.
+
+    @param method Name of clustering method
+    @param idList List of IDs in distance matrix
+    @param condensed Condensed array of distance values
+    @raise ValueError: Distance matrix cannot be clustered
+    @return TreeNode at the root of the tree for the nj method or linkage matrix for other methods
+'''
+
+def build_clustering(method, idList, condensed):
+    if method == 'nj':
+        return nj(idList, condensed)
+    if method == 'average':
+        return upgma_linkage(condensed, len(idList))
+    from scipy.cluster.hierarchy import linkage
+    return linkage(condensed, method)
+
+def plot_tree(idList, clustering, args):
+
+    # Get the tree from the clustering of the distance matrix.
+    if args.method == 'nj':
+        tree = clustering
+    else:
+        tree = tree_from_linkage(clustering, idList)
 
     # Convert the tree to text and save to the specified file.
-    art = tree.asciiArt()
+    art = tree.ascii_art()
     destFile = open(args.destPath, 'w')
     destFile.write(art+'\n')
     destFile.close()
+
+    # Save the tree in Newick format when requested.
+    if args.newickPath is not None:
+        newickFile = open(args.newickPath, 'w')
+        newickFile.write(tree.newick()+'\n')
+        newickFile.close()
     return
 
-def plot_dendrogram(sourceArray, idList, args):
+''' Load the matplotlib plotting module.
 
-    # Convert input value to dendrogram() function value and set default.
-    if args.method is None:
-        args.method = 'complete'
-    if args.method == 'upgma':
-        args.method = 'average'
+    matplotlib is only imported when a plot is drawn so that printing help and
+    generating text plots do not pay for loading it.
 
-    # Convert the redundant square matrix form into a condensed nC2 array and
-    # build the linkage matrix using the specified method.
-    distArray = ssd.squareform(sourceArray)
-    linkageMatrix = linkage(distArray, args.method)
+    @return pyplot module using the Agg backend
+'''
+
+def load_pyplot():
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import pyplot
+    return pyplot
+
+def plot_dendrogram(idList, linkageMatrix, args):
 
     # Set the labels for the plot.
     if args.labels == 'input':
@@ -221,25 +332,49 @@ def plot_dendrogram(sourceArray, idList, args):
         plotOptions['count_sort'] = 'ascending'
     if 'orientation' not in plotOptions:
         plotOptions['orientation'] = 'right'
-
-    # Generate the plot and save to file.
-    matplotlib.use('Agg')
-    dendrogram(linkageMatrix, labels=labelList, count_sort=plotOptions['count_sort'], orientation=plotOptions['orientation'])
-    matplotlib.pyplot.title(args.title)
+    if 'truncate' not in plotOptions:
+        plotOptions['truncate'] = MaxDendrogramLeaves
+    truncate = int(plotOptions['truncate'])
+
+    # Save the full clustering when requested.  The branch lengths in the Newick
+    # format are the differences between the heights in the dendrogram.
+    if args.newickPath is not None:
+        newickFile = open(args.newickPath, 'w')
+        newickFile.write(tree_from_linkage(linkageMatrix, idList, heightFactor=1.0).newick()+'\n')
+        newickFile.close()
+    if args.linkagePath is not None:
+        linkageFile = open(args.linkagePath, 'w')
+        linkageFile.write('Cluster 1,Cluster 2,Distance,Size\n')
+        for first, second, distance, size in linkageMatrix.tolist():
+            linkageFile.write('%d,%d,%r,%d\n' %(first, second, distance, size))
+        linkageFile.close()
+
+    # Generate the plot and save to file.  Only the top clusters are drawn when
+    # there are too many samples to label.
+    from scipy.cluster.hierarchy import dendrogram
+    pyplot = load_pyplot()
+    pyplot.figure()
+    if truncate > 0 and truncate < len(idList):
+        dendrogram(linkageMatrix, labels=labelList, count_sort=plotOptions['count_sort'], orientation=plotOptions['orientation'],
+                   truncate_mode='lastp', p=truncate)
+    else:
+        dendrogram(linkageMatrix, labels=labelList, count_sort=plotOptions['count_sort'], orientation=plotOptions['orientation'])
+    pyplot.title(args.title)
     if plotOptions['orientation'] == 'left' or plotOptions['orientation'] == 'right':
         tickAxis = 'y'
     else:
         tickAxis = 'x'
-    matplotlib.pyplot.tick_params(tickAxis, labelsize=plotOptions['labelsize']) # Need to do this manually because of bug in dendrogram() function
-    matplotlib.pyplot.savefig(args.destPath)
+    pyplot.tick_params(tickAxis, labelsize=plotOptions['labelsize']) # Need to do this manually because of bug in dendrogram() function
+    pyplot.savefig(args.destPath)
+    pyplot.close()
     return
 
-def plot_mds(idList, args):
+def plot_mds(idList, sourceArray, args):
 
     # Set the colors for the plot.
     if args.colors is not None or args.labels == 'input':
         if args.inputFilePath is None:
-            print "You must use the --input-file-path argument when using the --colors argument."
+            print "You must use the --input-file-path argument when using the --colors argument or the --labels input argument."
             exit(1)
 
         # Parse the colors argument which assigns a color to a group.
@@ -248,16 +383,16 @@ def plot_mds(idList, args):
             itemList = args.colors.split(';') # Each group=color item is delimited by a semicolon
             for index in range(len(itemList)):
                 pair = itemList[index].split('=')
+                if len(pair) != 2:
+                    print "Error parsing colors argument '%s'" %(args.colors)
+                    exit(1)
                 groupToColor[pair[0]] = pair[1]
-            if len(groupToColor) == 0:
-                print "Error parsing colors argument '%s'" %(args.colors)
-                exit(1)
 
         # Open the input file with the list of sequence files, groups, and labels.
         try:
             inputFile = open(args.inputFilePath, 'r')
         except IOError as e:
-            print "Error opening input list file '%s': %s" %(args.inputPath, e.strerror)
+            print "Error opening input list file '%s': %s" %(args.inputFilePath, e.strerror)
             exit(1)
 
         # Parse the list file and keep track of the groups assigned to each ID and an
@@ -272,23 +407,25 @@ def plot_mds(idList, args):
                 idToLabel[sampleID] = label
         inputFile.close()
 
-        # Assign colors and labels for each sample ID.
+        # Assign colors and labels for each sample ID.  A sample is drawn with the
+        # color of the first of its groups that has a color.
         labelList = list()
         colorList = list()
         for index in range(len(idList)):
-            groupList = idToGroups[idList[index]]
-            addedGroup = False
-            for group in groupList:
+            if idList[index] not in idToGroups:
+                print "Sample ID '%s' is not in input list file '%s'" %(idList[index], args.inputFilePath)
+                exit(1)
+            color = 'black'
+            for group in idToGroups[idList[index]]:
                 if group in groupToColor:
-                    colorList.append(groupToColor[group])
-                    addedGroup = True
-            if not addedGroup:
-                colorList.append('black')
+                    color = groupToColor[group]
+                    break
+            colorList.append(color)
             labelList.append(idToLabel[idList[index]])
 
     if args.colors is None:
         # Default is for every point to be black.
-        colorList = [ 'black' ]
+        colorList = 'black'
 
     if args.labels == 'source':
         # Use the sample IDs from the source distance matrix for the labels.
@@ -298,14 +435,20 @@ def plot_mds(idList, args):
         print "Label type '%s' is not supported." %(args.labels)
         exit(1)
 
-    # Run the R commands to create the points for the MDS plot.
-    ro.r('input.data <- read.csv("%s")' %(args.sourcePath))
-    ro.r('distance.matrix <- as.matrix(input.data[,-1])')
-    ro.r('fit <- cmdscale(distance.matrix, eig=TRUE, k=2)')
-    x = ro.r('fit$points[,1]')
-    y = ro.r('fit$points[,2]')
+    # Compute the coordinates of the points in place in the distance matrix.
+    from biokbase.CompressionBasedDistance.Scaling import classical_mds
+    coordinates, eigenvalues = classical_mds(sourceArray, 2, overwrite=True)
+    del sourceArray
+
+    # Save the coordinates when requested.
+    if args.coordinatesPath is not None:
+        coordinatesFile = open(args.coordinatesPath, 'w')
+        coordinatesFile.write('ID,Coordinate 1,Coordinate 2\n')
+        for index in range(len(idList)):
+            coordinatesFile.write('%s,%g,%g\n' %(idList[index], coordinates[index,0], coordinates[index,1]))
+        coordinatesFile.close()
 
-    # Parse the options to pass to the pdf command.
+    # Parse the options for creating the output file.
     fileArgs = dict()
     if args.fileOptions is not None:
         optionList = args.fileOptions.split(';')
@@ -315,9 +458,8 @@ def plot_mds(idList, args):
                 fileArgs[fields[0]] = float(fields[1])
             except:
                 fileArgs[fields[0]] = fields[1]
-
-    # Open the pdf device.
-    ro.r.pdf(args.destPath, **fileArgs)
+    width = fileArgs.pop('width', 7.0)
+    height = fileArgs.pop('height', 7.0)
 
     # Parse the options for creating the plot.
     plotArgs = dict()
@@ -331,43 +473,85 @@ def plot_mds(idList, args):
             except:
                 value = fields[1]
             if fields[0].startswith('text.'):
-                keyword = fields[0].lstrip('text.')
-                textArgs[keyword] = value
+                textArgs[fields[0][len('text.'):]] = value
             else:
                 plotArgs[fields[0]] = value
 
     # Add default options if they haven't been overridden by the user.
-    if 'xlab' not in plotArgs:
-        plotArgs['xlab'] = 'Coordinate 1'
-    if 'ylab' not in plotArgs:
-        plotArgs['ylab'] = 'Coordinate 2'
-    if 'type' not in plotArgs:
-        plotArgs['type'] = 'p'
-    if 'pch' not in plotArgs:
-        plotArgs['pch'] = 17
-    plotArgs['main'] = args.title
-    colors = ro.StrVector(colorList)
-    labels = ro.StrVector(labelList)
+    xlabel = plotArgs.pop('xlab', 'Coordinate 1')
+    ylabel = plotArgs.pop('ylab', 'Coordinate 2')
+    if 'marker' not in plotArgs:
+        plotArgs['marker'] = '^'
 
     # Generate the plot and save to file.
-    ro.r.plot(x, y, col=colors, **plotArgs)
-    ro.r.abline(h=0, v=0)
+    pyplot = load_pyplot()
+    pyplot.figure(figsize=(width, height))
+    pyplot.scatter(coordinates[:,0], coordinates[:,1], c=colorList, **plotArgs)
+    pyplot.axhline(0, color='black', linewidth=0.5)
+    pyplot.axvline(0, color='black', linewidth=0.5)
+    pyplot.xlabel(xlabel)
+    pyplot.ylabel(ylabel)
+    pyplot.title(args.title)
 
     # Add labels to the points.
     if args.labels != 'none':
-        if 'pos' not in textArgs:
-            textArgs['pos'] = 3
-        if 'cex' not in textArgs:
-            textArgs['cex'] = 0.5
-        ro.r.text(x, y, labels = labels, **textArgs)
-    ro.r('dev.off()')
+        if 'fontsize' not in textArgs:
+            textArgs['fontsize'] = 6
+        for index in range(len(idList)):
+            pyplot.annotate(labelList[index], (coordinates[index,0], coordinates[index,1]), xytext=(0, 3),
+                            textcoords='offset points', ha='center', va='bottom', **textArgs)
+    pyplot.savefig(args.destPath, **fileArgs)
+    pyplot.close()
     return
 
+''' Create a plot.
+
+    @param idList List of IDs in distance matrix
+    @param condensed Condensed array of distance values or None
+    @param sourceArray Square array of distance values or None to build it from the condensed array
+    @param clusterings Dictionary mapping a clustering method to the clustering of the distance matrix
+    @param args Arguments for the plot
+    @return Nothing
+'''
+
+def create_plot(idList, condensed, sourceArray, clusterings, args):
+    if args.type == 'tree':
+        plot_tree(idList, clusterings[get_clustering_method(args)], args)
+
+    elif args.type == 'dendrogram':
+        if args.title is None:
+            args.title = 'Dendrogram'
+        plot_dendrogram(idList, clusterings[get_clustering_method(args)], args)
+
+    elif args.type == 'mds':
+        if args.title is None:
+            args.title = 'MDS'
+        if sourceArray is None:
+            sourceArray = condensed_to_square(condensed, len(idList))
+        plot_mds(idList, sourceArray, args)
+    return
+
+''' Create one plot from the plan file in a separate process.
+
+    The distance matrix, clusterings, and list of plots are inherited from the
+    main process.
+
+    @param index Index of plot in list of plots
+    @return Exit code of the plot (0 for success)
+'''
+
+def create_plot_in_process(index):
+    try:
+        create_plot(idList, condensed, None, clusterings, planList[index])
+    except SystemExit as e:
+        return e.code
+    return 0
+
 if __name__ == "__main__":
     # Parse options.
     parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, prog='cbd-plotmatrix', epilog=desc3)
     parser.add_argument('sourcePath', help='path to source distance matrix file', action='store', default=None)
-    parser.add_argument('destPath', help='path to destination distance matrix file', action='store', default=None)
+    parser.add_argument('destPath', help='path to destination distance matrix file', action='store', nargs='?', default=None)
     parser.add_argument('--type', help='type of plot to generate', action='store', dest='type', default='tree')
     parser.add_argument('--method', help='clustering method', action='store', dest='method', default=None)
     parser.add_argument('--title', help='title for plot', action='store', dest='title', default=None)
@@ -376,54 +560,96 @@ if __name__ == "__main__":
     parser.add_argument('--labels', help='source for labels on points in plot', dest='labels', action='store', default='source')
     parser.add_argument('--plot-options', help='options to pass to plot command', action='store', dest='plotOptions', default=None)
     parser.add_argument('--file-options', help='options to pass to file creation command', action='store', dest='fileOptions', default=None)
+    parser.add_argument('--newick-path', help='path to file to save tree in Newick format', action='store', dest='newickPath', default=None)
+    parser.add_argument('--coordinates-path', help='path to file to save MDS coordinates in csv format', action='store', dest='coordinatesPath', default=None)
+    parser.add_argument('--linkage-path', help='path to file to save dendrogram linkage matrix in csv format', action='store', dest='linkagePath', default=None)
+    parser.add_argument('--batch-path', help='path to plan file with list of plots to generate', action='store', dest='batchPath', default=None)
+    parser.add_argument('--processes', help='number of processes for generating plots from a plan file', action='store', dest='processes', type=int, default=1)
     usage = parser.format_usage()
     parser.description = desc1 + '      ' + usage + desc2
     parser.usage = argparse.SUPPRESS
-    args = parser.parse_args()
-    
-    # Open the source distance matrix file.
+    args = parse_arguments(parser)
+
+    # Build the list of plots to generate.  Each line of a plan file has the
+    # arguments for one plot.
+    if args.batchPath is None:
+        if args.destPath is None:
+            parser.error('too few arguments')
+        planList = [ args ]
+    else:
+        if args.destPath is not None:
+            parser.error('destPath argument is not allowed with --batch-path')
+        try:
+            planFile = open(args.batchPath, 'r')
+        except IOError as e:
+            print "Error opening plan file '%s': %s" %(args.batchPath, e.strerror)
+            exit(1)
+        planList = list()
+        lineNumber = 0
+        for line in planFile:
+            lineNumber += 1
+            line = line.strip('\n\r')
+            if line and line[0] != '#': # Skip empty and comment lines
+                try:
+                    plan = parse_arguments(parser, [ args.sourcePath ] + shlex.split(line))
+                except (SystemExit, ValueError):
+                    print "Error parsing line %d of plan file '%s':" %(lineNumber, args.batchPath)
+                    print "  " + line
+                    exit(1)
+                if plan.destPath is None or plan.batchPath is not None:
+                    print "Line %d of plan file '%s' must have a destination path and cannot use --batch-path:" %(lineNumber, args.batchPath)
+                    print "  " + line
+                    exit(1)
+                planList.append(plan)
+        planFile.close()
+
+    # Find the clustering methods needed for the plots.
+    methodList = list()
+    for plan in planList:
+        try:
+            method = get_clustering_method(plan)
+        except ValueError as e:
+            print e
+            exit(1)
+        if method is not None and method not in methodList:
+            methodList.append(method)
+
+    # Load the source distance matrix file.  A single mds plot is made from the
+    # square form of the matrix and all other plots use the condensed form.
+    condensed = None
+    sourceArray = None
     try:
-        sourceFile = open(args.sourcePath, 'r')
+        if len(planList) == 1 and planList[0].type == 'mds':
+            idList, sourceArray = load_matrix(args.sourcePath)
+        else:
+            idList, condensed = load_condensed_matrix(args.sourcePath)
     except IOError as e:
         print "Error opening source distance matrix file '%s': %s" %(args.sourcePath, e.strerror)
         exit(1)
-  
-    # Get the list of IDs from the first line of the source file.
-    line = sourceFile.readline()
-    line = line.strip('\n\r')
-    idList = line.split(',')
-    idList.pop(0) # Remove the first entry which is always 'ID'
-    
-    # Read the source distance matrix from the source file. 
-    sourceArray = numpy.zeros((len(idList),len(idList)), dtype=float)
-    row = 0
-    for line in sourceFile:
-        line = line.strip('\n\r')
-        fields = line.split(',')
-        fields.pop(0) # Remove the first field which is the ID
-        for index in range(0,len(fields)):
-            sourceArray[row,index] = float(fields[index])
-        row += 1
-    sourceFile.close()
-    
-    # Create the specified plot.
-    if args.type == 'tree':
-        plot_tree(sourceArray, args)
-
-    elif args.type == 'dendrogram':
-        if args.title is None:
-            args.title = 'Dendrogram'
-        plot_dendrogram(sourceArray, idList, args)
-
-    elif args.type == 'mds':
-        print 'Metric dimensional scaling plots are not currently supported.'
+    except ValueError as e:
+        print "Error loading source distance matrix file '%s': %s" %(args.sourcePath, e)
         exit(1)
-# MDS        if args.title is None:
-# MDS            args.title = 'MDS'
-# MDS        plot_mds(idList, args)
 
+    # Cluster the distance matrix once for each method.
+    clusterings = dict()
+    for method in methodList:
+        try:
+            clusterings[method] = build_clustering(method, idList, condensed)
+        except ValueError as e:
+            print "Error clustering distance matrix with method '%s': %s" %(method, e)
+            exit(1)
+
+    # Create the plots.
+    if args.processes > 1 and len(planList) > 1:
+        pool = multiprocessing.Pool(min(args.processes, len(planList)))
+        exitCodes = pool.map(create_plot_in_process, range(len(planList)))
+        pool.close()
+        pool.join()
+        for exitCode in exitCodes:
+            if exitCode != 0:
+                exit(1)
     else:
-        print "Plot type '%s' is not supported" %(args.type)
-        exit(1)
-        
+        for plan in planList:
+            create_plot(idList, condensed, sourceArray, clusterings, plan)
+
     exit(0)
@@ -10,13 +10,14 @@ from biokbase.userandjobstate.client import UserAndJobState
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(prog='cbd-runjob')
     parser.add_argument('jobDataPath', help='path to job data file', action='store', default=None)
+    parser.add_argument('--resume', help='resume an interrupted job from its journal', action='store_true', dest='resume', default=False)
     args = parser.parse_args()
     
     # Run the job.
     job = json.load(open(args.jobDataPath, 'r'))
     try:
         worker = CompressionBasedDistance()
-        worker.runJob(job)
+        worker.runJob(job, resume=args.resume)
     except Exception as e:
         # Mark the job as failed.
         tb = traceback.format_exc()
@@ -0,0 +1,297 @@
+#! /usr/bin/python
+
+import argparse
+import traceback
+import signal
+import sys
+import os
+import json
+import time
+from multiprocessing import Process, Pipe, Pool
+from biokbase.CompressionBasedDistance.Helpers import get_config
+from biokbase.CompressionBasedDistance.JobQueue import JobQueue
+from biokbase.CompressionBasedDistance.Worker import CompressionBasedDistance
+from biokbase.userandjobstate.client import UserAndJobState
+
+desc1 = '''
+NAME
+      cbd-workerd -- run queued jobs
+
+SYNOPSIS
+'''
+
+desc2 = '''
+DESCRIPTION
+      Run the jobs that are added to the job queue by the server.  The daemon is
+      started with the service and runs until it is stopped with a SIGTERM or
+      SIGINT signal.
+
+      The configuration variables are read from the CompressionBasedDistance
+      section of the deployment config file.  The job_queue_path variable is the
+      path to the job queue database and must be set.  The max_running_jobs
+      variable is the maximum number of jobs running at the same time on the
+      system.  The max_user_jobs variable is the maximum number of jobs running
+      at the same time for one user (0 for no maximum).  When a job slot is
+      available, the oldest queued job of the user with the fewest running jobs
+      is started.
+
+      The daemon keeps a job runner ready for each free job slot.  A job runner
+      is a process that is forked before there is a job for it and creates its
+      process pool with num_pool_processes processes while it waits.  A queued
+      job is handed to a ready job runner so the job starts in a process with
+      the worker modules imported and the process pool running.  Each job runner
+      runs one job and exits so a job that dies does not affect other jobs, and
+      a new job runner is forked for the free job slot.
+
+      When the daemon is stopped, running jobs are stopped and put back in the
+      queue the next time the daemon starts.  A job that is started again is
+      resumed from its journal so only the work that is missing is done.
+
+      When the process running a job dies before the job is done (for example
+      when it is killed by the out of memory killer), the job is put back in
+      the queue and resumed from its journal.  The max_job_restarts variable is
+      the maximum number of times a job is restarted.  After that the job is
+      marked as failed.
+
+      The --config optional argument specifies the path to the deployment config
+      file.  The default is the value of the KB_DEPLOYMENT_CONFIG environment
+      variable.  The --pid-file optional argument specifies the path to a file
+      for saving the process ID of the daemon.  The --poll-interval optional
+      argument specifies the number of seconds between checks of the job queue.
+'''
+
+desc3 = '''
+EXAMPLES
+      Run queued jobs with the deployment config file:
+      > cbd-workerd --config /kb/deployment/deployment.cfg
+
+SEE ALSO
+      cbd-buildmatrix
+      cbd-extendmatrix
+
+AUTHORS
+      Mike Mundy
+'''
+
+# Set to True when the daemon is told to stop.
+stopping = False
+
+''' Handle a signal to stop the daemon.
+
+    @param signum Signal number
+    @param frame Current stack frame
+    @return Nothing
+'''
+
+def stop_handler(signum, frame):
+    global stopping
+    stopping = True
+    return
+
+''' Describe how the process running a job ended.
+
+    @param exitCode Exit code of process (negative for the signal that killed the process)
+    @return Description string
+'''
+
+def exit_description(exitCode):
+    if exitCode < 0:
+        return 'was terminated by signal %d' %(-exitCode)
+    return 'exited with code %d' %(exitCode)
+
+''' Mark a job as failed in the user and job state service.
+
+    @param jobDataPath Path to job data file
+    @param message Error message for the job
+    @return Nothing
+'''
+
+def fail_job(jobDataPath, message):
+    job = json.load(open(jobDataPath, 'r'))
+    ujsClient = UserAndJobState(job['config']['userandjobstate_url'], token=job['context']['token'])
+    ujsClient.complete_job(job['id'], job['context']['token'], 'failed', message, { })
+    return
+
+''' Start a job runner that waits for a job to run.
+
+    @param poolSize Number of processes in the process pool of the job runner (0 to create the pool when the job runs)
+    @return Tuple with job runner process and connection for sending the job to the job runner
+'''
+
+def start_runner(poolSize):
+    connection, runnerConnection = Pipe()
+    process = Process(target=runner_main, args=(runnerConnection, poolSize))
+    process.start()
+    runnerConnection.close()
+    return process, connection
+
+''' Prepare a job runner and run the job it is sent.
+
+    @param connection Connection for receiving the path to the job data file (None when the daemon is stopping)
+    @param poolSize Number of processes in the process pool (0 to create the pool when the job runs)
+    @return Nothing
+'''
+
+def runner_main(connection, poolSize):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    # Put the job runner in its own process group so the job and its process pool can be stopped together.
+    os.setpgrp()
+
+    # Create the process pool while waiting for a job.
+    pool = None
+    if poolSize > 0:
+        pool = Pool(processes=poolSize)
+    jobDataPath = connection.recv()
+    connection.close()
+    if jobDataPath is None:
+        return
+    run_job(jobDataPath, pool, poolSize)
+    return
+
+''' Run a job in a job runner.
+
+    @param jobDataPath Path to job data file
+    @param pool Process pool for running the tasks of the job or None to create the pool for the job
+    @param poolSize Number of processes in the process pool
+    @return Nothing
+'''
+
+def run_job(jobDataPath, pool, poolSize):
+    # Send output from the job to the log files in the job's work directory.
+    jobDirectory = os.path.dirname(jobDataPath)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(os.open(os.path.join(jobDirectory, 'stdout.log'), os.O_WRONLY|os.O_CREAT|os.O_APPEND, 0664), 1)
+    os.dup2(os.open(os.path.join(jobDirectory, 'stderr.log'), os.O_WRONLY|os.O_CREAT|os.O_APPEND, 0664), 2)
+
+    # Run the job.  A new job has no journal so resuming it runs the whole job.
+    job = json.load(open(jobDataPath, 'r'))
+    if pool is not None and int(job['config']['num_pool_processes']) != poolSize:
+        pool.terminate()
+        pool = None # Job was queued with a different number of pool processes
+    try:
+        worker = CompressionBasedDistance()
+        worker.runJob(job, resume=True, pool=pool)
+    except Exception as e:
+        # Mark the job as failed.
+        tb = traceback.format_exc()
+        sys.stderr.write(tb)
+        ujsClient = UserAndJobState(job['config']['userandjobstate_url'], token=job['context']['token'])
+        ujsClient.complete_job(job['id'], job['context']['token'], 'failed', tb, { })
+    return
+
+if __name__ == "__main__":
+    # Parse options.
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, prog='cbd-workerd', epilog=desc3)
+    parser.add_argument('--config', help='path to deployment config file', action='store', dest='configPath', default=os.environ.get('KB_DEPLOYMENT_CONFIG'))
+    parser.add_argument('--pid-file', help='path to file for saving process ID', action='store', dest='pidFile', default=None)
+    parser.add_argument('--poll-interval', help='seconds between checks of job queue', action='store', dest='pollInterval', type=float, default=2.0)
+    usage = parser.format_usage()
+    parser.description = desc1 + '      ' + usage + desc2
+    parser.usage = argparse.SUPPRESS
+    args = parser.parse_args()
+
+    # Get the configuration variables.
+    config = get_config(args.configPath)
+    if not config.get('job_queue_path', ''):
+        print 'The job_queue_path variable must be set in the deployment config file'
+        exit(1)
+    maxRunning = int(config.get('max_running_jobs', 2))
+    maxUserRunning = int(config.get('max_user_jobs', 0))
+    maxRestarts = int(config.get('max_job_restarts', 2))
+    poolSize = int(config.get('num_pool_processes', 0))
+
+    if args.pidFile is not None:
+        with open(args.pidFile, 'w') as f:
+            f.write('%d\n' %(os.getpid()))
+    signal.signal(signal.SIGTERM, stop_handler)
+    signal.signal(signal.SIGINT, stop_handler)
+
+    # Jobs that were running when the daemon stopped are started again.
+    queue = JobQueue(config['job_queue_path'])
+    numRequeued = queue.requeue_running()
+    numQueued, numRunning = queue.counts()
+    print '%s cbd-workerd started with %d queued jobs (%d restarted)' %(time.strftime('%Y-%m-%d %H:%M:%S'), numQueued, numRequeued)
+    sys.stdout.flush()
+
+    running = dict()
+    runners = list()
+    while not stopping:
+        # Remove the jobs that are done from the queue.  A job whose process died
+        # is put back in the queue until it has been restarted too many times.
+        for jobId in running.keys():
+            process, jobDataPath = running[jobId]
+            if process.is_alive():
+                continue
+            process.join()
+            del running[jobId]
+            if process.exitcode == 0:
+                queue.finish(jobId)
+                print '%s job %s finished' %(time.strftime('%Y-%m-%d %H:%M:%S'), jobId)
+                continue
+
+            # Stop the pool processes that are left from the job.
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            description = exit_description(process.exitcode)
+            restarts = queue.requeue(jobId)
+            if restarts <= maxRestarts:
+                print '%s job %s %s and was put back in the queue (restart %d of %d)' \
+                    %(time.strftime('%Y-%m-%d %H:%M:%S'), jobId, description, restarts, maxRestarts)
+                continue
+            queue.finish(jobId)
+            print '%s job %s %s and was restarted too many times' %(time.strftime('%Y-%m-%d %H:%M:%S'), jobId, description)
+            try:
+                fail_job(jobDataPath, 'Process running job %s and was restarted %d times' %(description, maxRestarts))
+            except Exception as e:
+                print '%s error marking job %s as failed: %s' %(time.strftime('%Y-%m-%d %H:%M:%S'), jobId, e)
+
+        # Start queued jobs with the ready job runners until all of the job slots are used.
+        while True:
+            nextJob = queue.next_job(maxRunning, maxUserRunning)
+            if nextJob is None:
+                break
+            jobId, jobDataPath = nextJob
+            if len(runners) > 0:
+                process, connection = runners.pop(0)
+            else:
+                process, connection = start_runner(poolSize)
+            connection.send(jobDataPath)
+            connection.close()
+            running[jobId] = (process, jobDataPath)
+            print '%s job %s started' %(time.strftime('%Y-%m-%d %H:%M:%S'), jobId)
+        sys.stdout.flush()
+
+        # Keep a job runner ready for each free job slot.  A job runner that died while
+        # waiting is replaced.
+        for process, connection in [ runner for runner in runners if not runner[0].is_alive() ]:
+            process.join()
+            connection.close()
+            runners.remove( (process, connection) )
+        while len(runners) < maxRunning - len(running):
+            runners.append(start_runner(poolSize))
+        time.sleep(args.pollInterval)
+
+    # Stop the running jobs which stay marked as running so they are started again.
+    for jobId in running:
+        process, jobDataPath = running[jobId]
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except OSError:
+            pass # Job finished since the last check
+        process.join()
+
+    # Stop the job runners that are waiting for a job.  Other job runners have copies of
+    # the connections so the job runners are told to stop instead of closing the connections.
+    for process, connection in runners:
+        connection.send(None)
+        connection.close()
+        process.join()
+    queue.close()
+    if args.pidFile is not None and os.path.exists(args.pidFile):
+        os.remove(args.pidFile)
+    exit(0)